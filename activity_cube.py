@@ -0,0 +1,324 @@
+"""
+Persistent grid cube of 311 activity: request counts per service x day x grid cell, kept on disk.
+
+Requests are projected into California State Plane zone 6 (as in neighbor_query.py) and binned into square
+cells of a configurable size over the extent of the requests, by the day they were requested. The cube is stored
+as a summed-area table, a 4-d .npy array (service, day, y, x) of inclusive prefix sums with a leading zero on
+every axis, in data/cache/activity_cube.npy next to a json file with the grid, the services and the size and
+modification time of the source files. Opening it memory maps the file, so nothing is read until a query touches
+it, and the count over any box of cells and range of days is 8 lookups whatever the size of the box. Queries are
+vectorized over arrays of boxes, so zone totals, daily inflows and rough "how much of service X happened around
+here during period Y" screens are answered without loading request level data. Counts near a point are over
+whole cells, so they do not replace the exact 150 ft counts of safety_counts.py.
+
+The file takes 4 bytes x services x (days + 1) x (rows + 1) x (columns + 1). The default six services over about
+seven years of days, on 250 m cells cropped to the requests (the city is roughly 33 x 65 km), come to about
+1.9 GB, a larger cell_size or fewer services shrink it.
+
+The cube is built one service at a time straight into the memory mapped file, so building needs memory for the
+request rows and one service's slab rather than the whole cube.
+
+Run as a script: python activity_cube.py [cell=<meters>] [services=all] [force] [streaming]
+[memory_limit_mb=<megabytes>] [profile]
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+
+from data_loading import (CACHE_DIR, DATA_DIR, OPEN_REQUESTS_FILE, STREET_LIGHT_SERVICE, concat_requests,
+                          load_options_from_args, read_closed_requests, read_open_requests)
+from neighbor_query import DEFAULT_CRS, project_lat_lng, to_meters
+from profiling import Progress, enable_profiling, profiled, stage, write_report
+from safety_counts import SAFETY_SERVICE_NAMES
+from zone_tagging import load_zone_layer
+
+CUBE_FILE = os.path.join(CACHE_DIR, 'activity_cube.npy')
+# side of a grid cell in meters
+CUBE_CELL_SIZE = 250
+# the services in the cube unless asked for all of them, each service is one slab of the file
+CUBE_SERVICES = [STREET_LIGHT_SERVICE] + SAFETY_SERVICE_NAMES
+# lat/lng box around the city, requests outside it (bad or missing geocodes) are left out of the cube
+CITY_BOUNDS = {'lat': (32.50, 33.15), 'lng': (-117.35, -116.85)}
+CUBE_COLUMNS = ['service_name', 'date_requested', 'lat', 'lng']
+
+
+def _meta_file(cube_file):
+    return os.path.splitext(cube_file)[0] + '.json'
+
+
+def cube_source_files():
+    """
+    the open request file and every yearly closed request file in the data directory
+    """
+    return [OPEN_REQUESTS_FILE] + sorted(glob.glob(os.path.join(DATA_DIR, 'get_it_done_requests_closed_*_datasd.csv')))
+
+
+def _source_signature(source_files):
+    return {source_file: [os.stat(source_file).st_size, os.stat(source_file).st_mtime_ns]
+            for source_file in source_files if os.path.exists(source_file)}
+
+
+def _closed_years(source_files):
+    years = []
+    for source_file in source_files:
+        match = re.search(r'closed_(\d{4})_', os.path.basename(source_file))
+        if match:
+            years.append(int(match.group(1)))
+    return years
+
+
+@profiled
+def build_cube(cube_file=CUBE_FILE, cell_size=CUBE_CELL_SIZE, services=CUBE_SERVICES, bounds=CITY_BOUNDS,
+               crs=DEFAULT_CRS, **load_options):
+    """
+    reads every request file and writes the summed-area table of request counts
+        Args:
+            cube_file: the .npy file to write, its metadata goes in the .json file of the same name
+            cell_size: the side of a grid cell in meters
+            services: the service names to count, None for every service in the files
+            bounds: dict of 'lat' and 'lng' (min, max), requests outside are left out, the grid is cropped to the
+                requests inside
+            crs: the projected CRS of the grid, must have meters as its unit
+            load_options: streaming / chunking options passed on to the loaders
+        Returns: an ActivityCube of the new file
+    """
+    source_files = cube_source_files()
+    service_filter = list(services) if services is not None else None
+    frames = [read_open_requests(columns=CUBE_COLUMNS, service_names=service_filter, **load_options)]
+    years = _closed_years(source_files)
+    if years:
+        frames.append(read_closed_requests(years, columns=CUBE_COLUMNS, service_names=service_filter, **load_options))
+    requests = concat_requests(frames)
+    lat, lng = requests['lat'].to_numpy(dtype='float64'), requests['lng'].to_numpy(dtype='float64')
+    days = pd.to_datetime(requests['date_requested']).dt.floor('D').to_numpy(dtype='datetime64[D]')
+    inside = ((lat >= bounds['lat'][0]) & (lat <= bounds['lat'][1]) & (lng >= bounds['lng'][0])
+              & (lng <= bounds['lng'][1]) & ~np.isnat(days))
+    service_codes, service_names = pd.factorize(np.asarray(requests['service_name'], dtype=object)[inside], sort=True)
+    xy = project_lat_lng(lat[inside], lng[inside], crs=crs)
+    days = days[inside]
+    del requests, frames
+
+    # the grid only covers the requests, the city box is mostly ocean and back country with none
+    x0, y0 = xy.min(axis=0) if len(xy) else (0.0, 0.0)
+    n_x, n_y = ((xy.max(axis=0) - xy.min(axis=0)) // cell_size).astype(np.int64) + 1 if len(xy) else (1, 1)
+    n_x, n_y = int(n_x), int(n_y)
+    day0 = days.min() if len(days) else np.datetime64('today', 'D')
+    n_days = int((days.max() - day0).astype(np.int64)) + 1 if len(days) else 1
+    ix = np.clip(((xy[:, 0] - x0) // cell_size).astype(np.int64), 0, n_x - 1)
+    iy = np.clip(((xy[:, 1] - y0) // cell_size).astype(np.int64), 0, n_y - 1)
+    it = (days - day0).astype(np.int64)
+
+    os.makedirs(os.path.dirname(cube_file) or '.', exist_ok=True)
+    # write then rename so readers never map a half built cube
+    table = np.lib.format.open_memmap(cube_file + '.tmp.npy', mode='w+', dtype=np.int32,
+                                      shape=(max(len(service_names), 1), n_days + 1, n_y + 1, n_x + 1))
+    progress = Progress(len(service_names), label='cube services')
+    for position in range(len(service_names)):
+        rows = service_codes == position
+        slab = table[position, 1:, 1:, 1:]
+        cells, counts = np.unique((it[rows] * n_y + iy[rows]) * n_x + ix[rows], return_counts=True)
+        slab[np.unravel_index(cells, (n_days, n_y, n_x))] = counts
+        for axis in range(3):
+            np.cumsum(slab, axis=axis, out=slab)
+        progress.update()
+    table.flush()
+    del table
+    os.replace(cube_file + '.tmp.npy', cube_file)
+    with open(_meta_file(cube_file), 'w') as f:
+        json.dump({'services': [str(name) for name in service_names], 'crs': crs, 'cell_size': cell_size,
+                   'x0': float(x0), 'y0': float(y0), 'n_x': n_x, 'n_y': n_y, 'day0': str(day0), 'n_days': n_days,
+                   'requested_services': list(services) if services is not None else None,
+                   'sources': _source_signature(source_files)}, f)
+    return ActivityCube(cube_file)
+
+
+def load_cube(cube_file=CUBE_FILE, cell_size=CUBE_CELL_SIZE, services=CUBE_SERVICES, force=False, **load_options):
+    """
+    opens the stored cube, rebuilding it first if the request files or the settings changed
+        Args:
+            cube_file: the .npy file of the cube
+            cell_size: the side of a grid cell in meters
+            services: the service names to count, None for every service in the files
+            force: rebuild even if the stored cube is up to date
+            load_options: streaming / chunking options passed on to the loaders when rebuilding
+        Returns: an ActivityCube
+    """
+    meta_file = _meta_file(cube_file)
+    if not force and os.path.exists(cube_file) and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if (meta['sources'] == _source_signature(cube_source_files()) and meta['cell_size'] == cell_size
+                and meta['requested_services'] == (list(services) if services is not None else None)):
+            return ActivityCube(cube_file)
+    return build_cube(cube_file, cell_size=cell_size, services=services, **load_options)
+
+
+class ActivityCube:
+    """
+    read only view of a stored cube, the table is memory mapped and only the entries a query uses are read
+        Args:
+            cube_file: the .npy file written by build_cube
+    """
+
+    def __init__(self, cube_file=CUBE_FILE):
+        with open(_meta_file(cube_file)) as f:
+            self.meta = json.load(f)
+        self.table = np.load(cube_file, mmap_mode='r')
+        self.services = self.meta['services']
+        self.cell_size = self.meta['cell_size']
+        self.day0 = np.datetime64(self.meta['day0'], 'D')
+        self.n_days, self.n_y, self.n_x = self.meta['n_days'], self.meta['n_y'], self.meta['n_x']
+
+    def service_positions(self, services=None):
+        """
+        the slabs of the named services, every service if None
+        """
+        if services is None:
+            return list(range(len(self.services)))
+        if isinstance(services, str):
+            services = [services]
+        unknown = [service for service in services if service not in self.services]
+        if unknown:
+            raise ValueError(f"services {unknown} are not in the cube, it holds {self.services}")
+        return [self.services.index(service) for service in services]
+
+    def cells(self, lat, lng):
+        """
+        the grid cell of each point
+            Args:
+                lat: array like of latitudes
+                lng: array like of longitudes
+            Returns:
+                ix, iy: int arrays of cell columns and rows, -1 for points without a location, points off the grid
+                    get columns and rows outside it
+        """
+        xy = project_lat_lng(np.atleast_1d(lat), np.atleast_1d(lng), crs=self.meta['crs'])
+        located = np.isfinite(xy).all(axis=1)
+        ix = np.full(len(xy), -1, dtype=np.int64)
+        iy = np.full(len(xy), -1, dtype=np.int64)
+        ix[located] = ((xy[located, 0] - self.meta['x0']) // self.cell_size).astype(np.int64)
+        iy[located] = ((xy[located, 1] - self.meta['y0']) // self.cell_size).astype(np.int64)
+        return ix, iy
+
+    def days(self, dates, default):
+        """
+        the day index of each date, clipped to the cube, default (0 or n_days) where the date is missing
+        """
+        if dates is None:
+            return np.int64(default)
+        scalar = np.ndim(dates) == 0
+        dates = pd.to_datetime(pd.Series(np.atleast_1d(dates))).dt.floor('D').to_numpy(dtype='datetime64[D]')
+        index = np.clip(np.where(np.isnat(dates), default, (dates - self.day0).astype(np.int64)), 0, self.n_days)
+        return index[0] if scalar else index
+
+    def box_counts(self, x0, x1, y0, y1, t0, t1, services=None):
+        """
+        the number of requests in boxes of cells and ranges of days, 8 table lookups per box and service
+            Args:
+                x0, x1: first and one past the last cell column of each box
+                y0, y1: first and one past the last cell row of each box
+                t0, t1: first and one past the last day index of each box
+                services: service name or list of service names to add up, None for all of them
+            Returns: int64 array of counts, one per box
+        """
+        x0, x1 = np.clip(x0, 0, self.n_x), np.clip(x1, 0, self.n_x)
+        y0, y1 = np.clip(y0, 0, self.n_y), np.clip(y1, 0, self.n_y)
+        t0, t1 = np.clip(t0, 0, self.n_days), np.clip(t1, 0, self.n_days)
+        x0, x1, y0, y1, t0, t1 = np.broadcast_arrays(x0, np.maximum(x1, x0), y0, np.maximum(y1, y0), t0,
+                                                     np.maximum(t1, t0))
+        total = np.zeros(x0.shape, dtype=np.int64)
+        for position in self.service_positions(services):
+            table = self.table[position]
+            for t, sign in ((t1, 1), (t0, -1)):
+                total += sign * (table[t, y1, x1].astype(np.int64) - table[t, y0, x1] - table[t, y1, x0]
+                                 + table[t, y0, x0])
+        return total
+
+    @profiled
+    def near_counts(self, lat, lng, radius, start=None, end=None, services=None, units='ft'):
+        """
+        the number of requests in the square of cells around each point that covers the radius, in a range of days
+        this is a coarse upper bound: the square is 2 * ceil(radius / cell_size) + 1 cells on a side, so with 250 m
+        cells a 150 ft radius counts a 750 m square, use count_safety_near for exact counts within a radius
+            Args:
+                lat: array like of latitudes
+                lng: array like of longitudes
+                radius: the radius the square of cells has to cover
+                start: first date counted, a date or one per point, None for the start of the cube
+                end: date after the last one counted, a date or one per point, None for the end of the cube
+                services: service name or list of service names, None for all of them
+                units: the units of radius, 'ft' or 'm'
+            Returns: int64 array of counts, 0 for points without a location
+        """
+        lat, lng = np.atleast_1d(np.asarray(lat, dtype='float64')), np.atleast_1d(np.asarray(lng, dtype='float64'))
+        ix, iy = self.cells(lat, lng)
+        reach = int(np.ceil(to_meters(radius, units) / self.cell_size))
+        counts = self.box_counts(ix - reach, ix + reach + 1, iy - reach, iy + reach + 1,
+                                 self.days(start, 0), self.days(end, self.n_days), services=services)
+        # a point can be off the cropped grid and still have cells of its square on it, only unlocated points are 0
+        counts[~(np.isfinite(lat) & np.isfinite(lng))] = 0
+        return counts
+
+    def daily_counts(self, services=None, start=None, end=None):
+        """
+        citywide requests per day, e.g. the inflow side of the backlog
+            Args:
+                services: service name or list of service names, None for all of them
+                start, end: the range of dates, None for the whole cube
+            Returns: series of counts indexed by day
+        """
+        t = np.arange(self.days(start, 0), self.days(end, self.n_days))
+        counts = self.box_counts(0, self.n_x, 0, self.n_y, t, t + 1, services=services)
+        return pd.Series(counts, index=pd.DatetimeIndex(self.day0 + t), name='requests')
+
+    def cell_totals(self, start=None, end=None, services=None):
+        """
+        the requests in every cell over a range of days, from two time slices of the table
+            Returns: (n_y, n_x) int64 array
+        """
+        t0, t1 = self.days(start, 0), self.days(end, self.n_days)
+        totals = np.zeros((self.n_y, self.n_x), dtype=np.int64)
+        for position in self.service_positions(services):
+            slab = self.table[position, t1].astype(np.int64) - self.table[position, t0]
+            totals += np.diff(np.diff(slab, axis=0), axis=1)
+        return totals
+
+    @profiled
+    def zone_counts(self, shape_file_name, name_column='name', start=None, end=None, services=None):
+        """
+        the requests in each zone of a zone file over a range of days, cells are assigned by their center
+            Args:
+                shape_file_name: path of a shape/geojson file of geographic regions
+                name_column: the column of the file with the zone names
+                start, end: the range of dates, None for the whole cube
+                services: service name or list of service names, None for all of them
+            Returns: series of counts indexed by zone name
+        """
+        iy, ix = np.mgrid[0:self.n_y, 0:self.n_x]
+        to_lat_lng = Transformer.from_crs(self.meta['crs'], 'EPSG:4326', always_xy=True)
+        lng, lat = to_lat_lng.transform(self.meta['x0'] + (ix.ravel() + 0.5) * self.cell_size,
+                                        self.meta['y0'] + (iy.ravel() + 0.5) * self.cell_size)
+        zones = load_zone_layer(shape_file_name, name_column).label_points(lat, lng)
+        totals = self.cell_totals(start, end, services).ravel()
+        return pd.Series(totals).groupby(zones).sum()
+
+
+if __name__ == "__main__":
+    arg_list = sys.argv[1:]
+    options = dict(arg.split('=', 1) for arg in arg_list if '=' in arg)
+    if "profile" in arg_list:
+        enable_profiling()
+    with stage('activity cube'):
+        cube = load_cube(cell_size=float(options.get('cell', CUBE_CELL_SIZE)),
+                         services=None if options.get('services') == 'all' else CUBE_SERVICES,
+                         force="force" in arg_list, **load_options_from_args(arg_list))
+    print(f"{CUBE_FILE}: {len(cube.services)} services x {cube.n_days} days x {cube.n_y} x {cube.n_x} cells of "
+          f"{cube.cell_size:g} m, {cube.table.nbytes / 2**20:.0f} MB on disk")
+    write_report()
@@ -0,0 +1,215 @@
+"""
+Normalizing and fuzzy matching of street addresses.
+
+Addresses are parsed into a hundred block (1234 -> 1200, '1200 BLOCK' -> 1200), a directional, a street name and
+a street type, with the common spellings folded together (AVENUE/AV -> AVE, NORTH -> N, FIFTH/05TH -> 5TH).
+Street names are matched through an inverted character n-gram index held as a sparse names x n-grams matrix,
+so the candidates of a batch of names come out of one sparse matrix product and only names that share n-grams
+are ever compared. Every distinct name is matched once, which keeps the work close to linear in the number of
+distinct street names rather than the product of the two record counts.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# street type spellings -> the form used by both data sets
+STREET_TYPES = {'STREET':'ST', 'ST':'ST', 'AVENUE':'AVE', 'AVE':'AVE', 'AV':'AVE', 'BOULEVARD':'BLVD', 'BLVD':'BLVD', 'BL':'BLVD',
+                'DRIVE':'DR', 'DR':'DR', 'ROAD':'RD', 'RD':'RD', 'PLACE':'PL', 'PL':'PL', 'COURT':'CT', 'CT':'CT',
+                'LANE':'LN', 'LN':'LN', 'WAY':'WAY', 'WY':'WAY', 'TERRACE':'TER', 'TER':'TER', 'CIRCLE':'CIR',
+                'CIR':'CIR', 'PARKWAY':'PKWY', 'PKWY':'PKWY', 'HIGHWAY':'HWY', 'HWY':'HWY', 'TRAIL':'TRL',
+                'TRL':'TRL', 'PLAZA':'PLZ', 'PLZ':'PLZ', 'SQUARE':'SQ', 'SQ':'SQ', 'ALLEY':'ALY', 'ALY':'ALY',
+                'COVE':'CV', 'CV':'CV', 'POINT':'PT', 'PT':'PT', 'GLEN':'GLN', 'GLN':'GLN', 'WALK':'WALK',
+                'ROW':'ROW', 'MALL':'MALL', 'LOOP':'LOOP', 'EXPRESSWAY':'EXPY', 'EXPY':'EXPY'}
+DIRECTIONS = {'NORTH':'N', 'N':'N', 'SOUTH':'S', 'S':'S', 'EAST':'E', 'E':'E', 'WEST':'W', 'W':'W',
+              'NORTHEAST':'NE', 'NE':'NE', 'NORTHWEST':'NW', 'NW':'NW', 'SOUTHEAST':'SE', 'SE':'SE',
+              'SOUTHWEST':'SW', 'SW':'SW'}
+ORDINAL_WORDS = {'FIRST':'1ST', 'SECOND':'2ND', 'THIRD':'3RD', 'FOURTH':'4TH', 'FIFTH':'5TH', 'SIXTH':'6TH',
+                 'SEVENTH':'7TH', 'EIGHTH':'8TH', 'NINTH':'9TH', 'TENTH':'10TH', 'ELEVENTH':'11TH',
+                 'TWELFTH':'12TH', 'THIRTEENTH':'13TH', 'FOURTEENTH':'14TH', 'FIFTEENTH':'15TH',
+                 'SIXTEENTH':'16TH', 'SEVENTEENTH':'17TH', 'EIGHTEENTH':'18TH', 'NINETEENTH':'19TH',
+                 'TWENTIETH':'20TH'}
+# words (and #) that start a unit number, everything from them on is dropped
+UNIT_WORDS = {'UNIT', 'APT', 'STE', 'SUITE', 'BLDG', 'SPC'}
+UNIT_PATTERN = re.compile(r'(?<=\S)\s*(?:#|\b(?:' + '|'.join(sorted(UNIT_WORDS)) + r')\b).*$')
+BLOCK_SIZE = 100
+NGRAM_SIZE = 3
+# lowest Dice similarity of the n-grams of two street names that counts as a match
+MATCH_THRESHOLD = 0.75
+MATCH_BATCH_SIZE = 5000
+ADDRESS_PARTS = ['block', 'direction', 'street_name', 'street_type']
+
+
+def _ordinal(number):
+    number = int(number)
+    if 10 <= number % 100 <= 20:
+        return f"{number}TH"
+    return f"{number}{ {1:'ST', 2:'ND', 3:'RD'}.get(number % 10, 'TH')}"
+
+
+def parse_address(address):
+    """
+    splits one address into its hundred block, directional, street name and street type
+        Args:
+            address: a street address such as '1234 n Market Street, San Diego' or '1200 BLOCK MARKET ST',
+                for an intersection ('5th Ave & Market St') the first street is used
+        Returns: tuple of block (nan if there is no number), direction, street_name, street_type, missing
+            parts are ''
+    """
+    if not isinstance(address, str):
+        return (np.nan, '', '', '')
+    text = address.upper().split(',')[0]
+    text = re.split(r'\s(?:&|AND|AT)\s|/|@', text)[0]
+    # the unit goes before the punctuation, '#3' would otherwise be left as a 3 and read as 3RD street
+    text = UNIT_PATTERN.sub('', text)
+    tokens = re.sub(r'[^A-Z0-9 ]', ' ', text).split()
+    tokens = [token for token in tokens if token != 'BLOCK']
+    block = np.nan
+    if tokens and re.fullmatch(r'\d+[A-Z]?', tokens[0]) and len(tokens) > 1:
+        block = float(int(re.match(r'\d+', tokens[0]).group()) // BLOCK_SIZE * BLOCK_SIZE)
+        tokens = tokens[1:]
+    # a directional only counts as one if a street name is left without it, 'E ST' is the street named E
+    direction = ''
+    if len(tokens) > 1 and tokens[0] in DIRECTIONS and not (len(tokens) == 2 and tokens[1] in STREET_TYPES):
+        direction = DIRECTIONS[tokens[0]]
+        tokens = tokens[1:]
+    street_type = ''
+    if len(tokens) > 2 and tokens[-1] in DIRECTIONS and not direction:
+        direction = DIRECTIONS[tokens[-1]]
+        tokens = tokens[:-1]
+    if len(tokens) > 1 and tokens[-1] in STREET_TYPES:
+        street_type = STREET_TYPES[tokens[-1]]
+        tokens = tokens[:-1]
+    words = []
+    for token in tokens:
+        if token in ORDINAL_WORDS:
+            token = ORDINAL_WORDS[token]
+        elif re.fullmatch(r'\d+(ST|ND|RD|TH)?', token):
+            # 05TH, 5 and 5TH are all the same numbered street
+            token = _ordinal(re.match(r'\d+', token).group())
+        words.append(token)
+    return (block, direction, ' '.join(words), street_type)
+
+
+def normalize_addresses(addresses):
+    """
+    parses a column of addresses, each distinct address is only parsed once
+        Args:
+            addresses: array like of address strings
+        Returns: dataframe with block, direction, street_name and street_type columns aligned with addresses
+    """
+    codes, distinct = pd.factorize(pd.Series(addresses, dtype='object'), use_na_sentinel=True)
+    parsed = pd.DataFrame([parse_address(address) for address in distinct], columns=ADDRESS_PARTS)
+    # one extra row for missing addresses, which code -1 picks out
+    parsed = pd.concat([parsed, pd.DataFrame([parse_address(None)], columns=ADDRESS_PARTS)], ignore_index=True)
+    return parsed.iloc[codes].reset_index(drop=True)
+
+
+def _ngrams(name, n=NGRAM_SIZE):
+    padded = f" {name} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+class StreetIndex:
+    """
+    inverted n-gram index of distinct street names
+        Args:
+            names: array like of street names, e.g. the street_name column of normalize_addresses
+    """
+
+    def __init__(self, names):
+        self.names = pd.unique(pd.Series(names, dtype='object').dropna().loc[lambda s: s.ne('')])
+        self.vocabulary = {}
+        self.matrix = self._ngram_matrix(self.names, grow=True)
+        self.sizes = np.asarray(self.matrix.sum(axis=1)).ravel()
+        self.lookup = {name: position for position, name in enumerate(self.names)}
+
+    def _ngram_matrix(self, names, grow=False):
+        """
+        names x n-grams binary matrix, n-grams not in the vocabulary are left out unless grow is set
+        """
+        rows, columns = [], []
+        for row, name in enumerate(names):
+            for gram in _ngrams(name):
+                column = self.vocabulary.get(gram)
+                if column is None and grow:
+                    column = self.vocabulary[gram] = len(self.vocabulary)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                                 shape=(len(names), max(len(self.vocabulary), 1)))
+
+    def match(self, names, threshold=MATCH_THRESHOLD, batch_size=MATCH_BATCH_SIZE):
+        """
+        finds the most similar indexed name for every query name
+            Args:
+                names: array like of query street names
+                threshold: lowest Dice similarity of the n-grams that counts as a match
+                batch_size: number of distinct query names compared at a time, bounds the candidate matrix
+            Returns:
+                positions: int array of the matched position in self.names, -1 where nothing matched
+                scores: float array of the similarity of each match
+        """
+        codes, distinct = pd.factorize(pd.Series(names, dtype='object'), use_na_sentinel=True)
+        positions = np.full(len(distinct), -1, dtype=np.int64)
+        scores = np.zeros(len(distinct))
+        exact = np.array([self.lookup.get(name, -1) for name in distinct], dtype=np.int64)
+        positions[exact >= 0] = exact[exact >= 0]
+        scores[exact >= 0] = 1.0
+        fuzzy = np.flatnonzero((exact < 0) & np.array([bool(name) for name in distinct], dtype=bool))
+        for start in range(0, len(fuzzy), batch_size):
+            batch = fuzzy[start:start + batch_size]
+            query = self._ngram_matrix(distinct[batch])
+            query_sizes = np.array([len(_ngrams(name)) for name in distinct[batch]], dtype=np.float64)
+            # shared n-gram counts of every candidate pair, pairs without a shared n-gram never appear
+            overlap = (query @ self.matrix.T).tocoo()
+            if overlap.nnz == 0:
+                continue
+            dice = 2 * overlap.data / (query_sizes[overlap.row] + self.sizes[overlap.col])
+            # best candidate per query: sort by query then score and keep the last of each query
+            order = np.lexsort((dice, overlap.row))
+            last = np.r_[overlap.row[order][1:] != overlap.row[order][:-1], True]
+            best = order[last]
+            good = dice[best] >= threshold
+            positions[batch[overlap.row[best][good]]] = overlap.col[best][good]
+            scores[batch[overlap.row[best][good]]] = dice[best][good]
+        matched_positions = np.where(codes >= 0, positions[codes], -1)
+        matched_scores = np.where(codes >= 0, scores[codes], 0.0)
+        return matched_positions, matched_scores
+
+
+def match_addresses(left, right, threshold=MATCH_THRESHOLD, batch_size=MATCH_BATCH_SIZE, index=None):
+    """
+    pairs up the rows of two address tables that are on the same hundred block of the same street
+        Args:
+            left: dataframe from normalize_addresses, its street names are indexed
+            right: dataframe from normalize_addresses, its street names are matched against the index
+            threshold: lowest street name similarity that counts as a match
+            batch_size: number of distinct street names matched at a time
+            index: a StreetIndex of left's street names, built if not given, pass it in when matching several
+                right tables against the same left one
+        Returns: dataframe of left_row, right_row and score (the street name similarity); the direction and
+            street type must agree where both tables have them
+    """
+    if index is None:
+        index = StreetIndex(left['street_name'])
+    positions, scores = index.match(right['street_name'], threshold=threshold, batch_size=batch_size)
+    left_keys = pd.DataFrame({'left_row': np.arange(len(left)), 'block': left['block'].to_numpy(),
+                              'street': pd.Series(left['street_name'].to_numpy(), dtype='object').map(index.lookup),
+                              'left_direction': left['direction'].to_numpy(),
+                              'left_type': left['street_type'].to_numpy()})
+    matched = positions >= 0
+    right_keys = pd.DataFrame({'right_row': np.flatnonzero(matched), 'block': right['block'].to_numpy()[matched],
+                               'street': positions[matched], 'score': scores[matched],
+                               'right_direction': right['direction'].to_numpy()[matched],
+                               'right_type': right['street_type'].to_numpy()[matched]})
+    # blocking: only rows on the same hundred block of the matched street are paired
+    pairs = left_keys.dropna(subset=['block', 'street']).merge(right_keys.dropna(subset=['block']),
+                                                                on=['block', 'street'])
+    agrees = ((pairs['left_direction'].eq(pairs['right_direction']) | pairs['left_direction'].eq('')
+               | pairs['right_direction'].eq(''))
+              & (pairs['left_type'].eq(pairs['right_type']) | pairs['left_type'].eq('') | pairs['right_type'].eq('')))
+    return pairs.loc[agrees, ['left_row', 'right_row', 'score']].reset_index(drop=True)
@@ -0,0 +1,134 @@
+"""
+Single pass aggregation of a value column over several groupings.
+
+Every key column is factorized once and shared by all the groupings that use it. The values are sorted
+once, so each grouping only needs a stable (radix) sort of its integer group codes to get the order that
+medians are read from, and counts, sums and spreads come from np.bincount over the codes. Each grouping
+comes back as a tidy table with its key columns and one column per statistic.
+"""
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+STATISTICS = ('count', 'mean', 'median', 'std', 'min', 'max', 'sum')
+
+
+def _factorize_columns(df, columns):
+    """
+    factorizes each key column once, in sorted order so the output matches groupby
+        Args:
+            df: the dataframe
+            columns: the key columns used by any grouping
+        Returns: dict of column -> (codes, uniques), codes are -1 for missing keys
+    """
+    return {column: pd.factorize(df[column], sort=True) for column in columns}
+
+
+def _group_codes(factorized, keys):
+    """
+    combines the codes of several key columns into one code per row
+        Args:
+            factorized: dict of column -> (codes, uniques)
+            keys: the key columns of the grouping
+        Returns:
+            codes: int array of group codes, -1 where any key is missing
+            key_values: dict of key column -> value of that key for each group code
+    """
+    key_codes = [factorized[key][0] for key in keys]
+    shape = tuple(len(factorized[key][1]) for key in keys)
+    missing = np.logical_or.reduce([codes < 0 for codes in key_codes])
+    flat = np.full(len(key_codes[0]), -1, dtype=np.int64)
+    flat[~missing] = np.ravel_multi_index([codes[~missing] for codes in key_codes], shape)
+    # keep only the combinations that actually occur
+    present, flat[~missing] = np.unique(flat[~missing], return_inverse=True)
+    combos = np.unravel_index(present, shape)
+    key_values = {key: np.asarray(factorized[key][1])[combo] for key, combo in zip(keys, combos)}
+    return flat, key_values
+
+
+def _grouped_statistics(codes, values, value_order, n_groups, statistics):
+    """
+    computes the statistics of the values for every group code
+        Args:
+            codes: int array of group codes, -1 for rows that are not in any group
+            values: float array of values
+            value_order: the positions of values sorted ascending with nans last
+            n_groups: the number of groups
+            statistics: the statistics to compute
+        Returns: dict of statistic -> array with one entry per group
+    """
+    # like groupby, missing values are left out of every statistic
+    usable = (codes >= 0) & ~np.isnan(values)
+    group = codes[usable]
+    kept = values[usable]
+    count = np.bincount(group, minlength=n_groups)
+    total = np.bincount(group, weights=kept, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    if set(statistics) & {'median', 'min', 'max'}:
+        # the values are already in order, a stable sort by group keeps them in order inside each group
+        ordered = value_order[usable[value_order]]
+        ordered = ordered[np.argsort(codes[ordered], kind='stable')]
+        starts = np.concatenate([[0], np.cumsum(count)[:-1]])
+        has_values = count > 0
+    results = {}
+    for statistic in statistics:
+        if statistic == 'count':
+            results['count'] = count
+        elif statistic == 'sum':
+            results['sum'] = total
+        elif statistic == 'mean':
+            results['mean'] = mean
+        elif statistic == 'std':
+            squares = np.bincount(group, weights=(kept - mean[group]) ** 2, minlength=n_groups)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                results['std'] = np.sqrt(squares / (count - 1))
+            results['std'][count < 2] = np.nan
+        elif statistic in ('median', 'min', 'max'):
+            result = np.full(n_groups, np.nan)
+            if statistic == 'min':
+                result[has_values] = values[ordered[starts[has_values]]]
+            elif statistic == 'max':
+                result[has_values] = values[ordered[starts[has_values] + count[has_values] - 1]]
+            else:
+                low = starts[has_values] + (count[has_values] - 1) // 2
+                high = starts[has_values] + count[has_values] // 2
+                result[has_values] = (values[ordered[low]] + values[ordered[high]]) / 2
+            results[statistic] = result
+        else:
+            raise ValueError(f"unknown statistic '{statistic}', expected one of {STATISTICS}")
+    return results
+
+
+@profiled
+def aggregate(df, value_column, groupings, statistics=('median', 'count'), labels=None):
+    """
+    computes statistics of one value column for several groupings in a single pass
+        Args:
+            df: the dataframe
+            value_column: the column to summarise
+            groupings: dict of table name -> list of key columns, an empty list gives a single overall row
+            statistics: the statistics to compute, any of count, mean, median, std, min, max and sum
+            labels: optional dict renaming statistic and key columns in the output tables
+        Returns: dict of table name -> tidy dataframe with the key columns and one column per statistic
+    """
+    key_columns = list(dict.fromkeys(key for keys in groupings.values() for key in keys))
+    factorized = _factorize_columns(df, key_columns)
+    values = df[value_column].to_numpy(dtype='float64')
+    value_order = np.argsort(values, kind='stable')
+    tables = {}
+    for name, keys in groupings.items():
+        if keys:
+            codes, key_values = _group_codes(factorized, list(keys))
+            n_groups = len(next(iter(key_values.values())))
+        else:
+            # no keys, one group of everything
+            codes, key_values, n_groups = np.zeros(len(df), dtype=np.int64), {}, 1
+        stats = _grouped_statistics(codes, values, value_order, n_groups, statistics)
+        table = pd.DataFrame({**key_values, **stats})
+        if labels:
+            table = table.rename(columns=labels)
+        tables[name] = table
+    return tables
@@ -0,0 +1,313 @@
+"""
+Monte Carlo forecast of the street light repair backlog by council district.
+
+The model is fitted on the request history: weekly arrivals per district (Poisson, from the requests of the
+last year of data, open ones included), the weekly repair capacity (closures in the same year) and, from the
+request history, the chance that a request still open after a week of age is repaired that week, per district
+(the repair duration distribution as a hazard, shrunk towards the city wide one for districts with few repairs).
+The hazard is a life table estimate: the repairs at an age over the requests at risk at it, where the open
+requests count as at risk for every week they have waited so far, so the long waits still in progress are not
+left out.
+The open requests, by district and age in weeks, are the starting backlog.
+
+Every week of a scenario the repair capacity (a multiple of the fitted one) is spread over the waiting requests
+in proportion to hazard x policy weight, the closures of every (simulation, district, age) cell are drawn as one
+binomial array, everyone ages a week and new arrivals are drawn as one Poisson array. All the simulations of a
+scenario move together as (simulations, districts, ages) arrays, and scenarios run in a process pool. The output
+is percentile bands of the backlog size and the median wait of the repairs made, per district and city wide.
+
+Policies:
+    historic      capacity follows the fitted hazards, as repairs were prioritized in the past
+    oldest_first  older requests are weighted up, doubling about every 18 weeks of age
+    equity        districts with slower historic repairs are weighted up in proportion to their median duration
+
+Run as a script: python backlog_forecast.py [weeks=<n>] [sims=<n>] [capacity=1,1.25,1.5]
+[policies=historic,oldest_first,equity] [streaming] [memory_limit_mb=<megabytes>] [profile]
+"""
+
+import os
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_loading import load_options_from_args, read_street_light_requests
+from profiling import enable_profiling, profiled, stage, write_report
+
+FORECAST_WEEKS = 104
+FORECAST_SIMULATIONS = 2000
+# ages past this many weeks share the last age bucket
+MAX_AGE_WEEKS = 104
+# weeks of history the arrival rates and capacity are fitted on
+FIT_WEEKS = 52
+# repairs of city wide weight mixed into each district's hazard, so small districts are not all noise
+HAZARD_PRIOR = 20
+CAPACITY_SCENARIOS = [1.0, 1.25, 1.5]
+POLICIES = ['historic', 'oldest_first', 'equity']
+PERCENTILES = (5, 25, 50, 75, 95)
+# default number of processes the scenarios run in, None means one per core
+FORECAST_WORKERS = None
+BACKLOG_FORECAST_FILE = 'graphs/backlog_forecast.csv'
+
+
+class BacklogModel:
+    """
+    the fitted inputs of the simulation
+        Args:
+            districts: list of council district numbers
+            weekly_arrivals: float array, the mean new requests per week of each district
+            weekly_capacity: the mean repairs per week city wide
+            hazard: (districts, ages) float array, the chance a request of that district and age in weeks is
+                repaired that week
+            initial_backlog: (districts, ages) int array of the open requests
+            median_weeks: float array, the historic median repair duration of each district in weeks
+            start: the date the forecast starts from
+    """
+
+    def __init__(self, districts, weekly_arrivals, weekly_capacity, hazard, initial_backlog, median_weeks, start):
+        self.districts = list(districts)
+        self.weekly_arrivals = weekly_arrivals
+        self.weekly_capacity = weekly_capacity
+        self.hazard = hazard
+        self.initial_backlog = initial_backlog
+        self.median_weeks = median_weeks
+        self.start = start
+
+
+def _age_weeks(days, max_age_weeks):
+    return np.clip(np.floor(np.asarray(days, dtype='float64') / 7), 0, max_age_weeks - 1).astype(np.int64)
+
+
+def _district_codes(df, districts):
+    """
+    the position of each row's council district in districts, -1 for missing or other districts
+    """
+    return pd.Index(districts).get_indexer(df['council_district'].to_numpy(dtype='float64'))
+
+
+def _district_cells(df, districts, ages, max_age_weeks):
+    """
+    counts of requests per (district, age in weeks), rows of other districts are left out
+    """
+    codes = _district_codes(df, districts)
+    known = codes >= 0
+    flat = codes[known] * max_age_weeks + ages[known]
+    return np.bincount(flat, minlength=len(districts) * max_age_weeks).reshape(len(districts), max_age_weeks)
+
+
+@profiled
+def fit_backlog_model(historic_lights, open_lights, fit_weeks=FIT_WEEKS, max_age_weeks=MAX_AGE_WEEKS,
+                      prior=HAZARD_PRIOR):
+    """
+    fits the arrival rates, capacity and repair hazards on closed requests and takes the open ones as the backlog
+        Args:
+            historic_lights: dataframe of closed street light requests with council_district, date_requested,
+                date_closed and case_age_days columns
+            open_lights: dataframe of open street light requests with council_district, date_requested and
+                case_age_days columns
+            fit_weeks: the weeks of history before the latest date the rates are fitted on
+            max_age_weeks: ages past this share the last age bucket
+            prior: repairs of city wide hazard mixed into each district's hazard
+        Returns: a BacklogModel
+    """
+    closed = historic_lights[historic_lights['case_age_days'].notna() & historic_lights['council_district'].notna()]
+    districts = sorted(np.unique(closed['council_district'].to_numpy(dtype='float64')).tolist())
+    start = max(pd.to_datetime(open_lights['date_requested']).max(), pd.to_datetime(closed['date_closed']).max())
+    window_start = start - pd.Timedelta(weeks=fit_weeks)
+
+    # the hazard of each age is the repairs at that age over the requests that were still open at it. the open
+    # requests are right censored: each one was at risk in every week it has completed, up to its current age
+    repairs = _district_cells(closed, districts, _age_weeks(closed['case_age_days'], max_age_weeks), max_age_weeks)
+    open_ages = _age_weeks(open_lights['case_age_days'].fillna(0), max_age_weeks)
+    initial_backlog = _district_cells(open_lights, districts, open_ages, max_age_weeks)
+    still_open = initial_backlog[:, ::-1].cumsum(axis=1)[:, ::-1]
+    at_risk = repairs[:, ::-1].cumsum(axis=1)[:, ::-1]
+    at_risk[:, :-1] += still_open[:, 1:]
+    city_hazard = repairs.sum(axis=0) / np.maximum(at_risk.sum(axis=0), 1)
+    hazard = (repairs + prior * city_hazard) / (at_risk + prior)
+    # the last bucket holds every older request, its hazard is the repairs in it over the weeks requests spent
+    # in it, a repaired request counting the week it was repaired in and an open one only its completed weeks
+    tail_weeks = np.floor(closed['case_age_days'].to_numpy(dtype='float64') / 7) - (max_age_weeks - 1)
+    tail_weeks = tail_weeks[tail_weeks >= 0]
+    open_tail_weeks = np.floor(open_lights['case_age_days'].to_numpy(dtype='float64') / 7) - (max_age_weeks - 1)
+    open_tail_weeks = open_tail_weeks[open_tail_weeks >= 0]
+    hazard[:, -1] = (len(tail_weeks) / (len(tail_weeks) + tail_weeks.sum() + open_tail_weeks.sum()) if len(tail_weeks)
+                     else hazard[:, -2])
+
+    weekly_arrivals = np.zeros(len(districts))
+    for requests in (closed, open_lights):
+        codes = _district_codes(requests, districts)
+        recent = pd.to_datetime(requests['date_requested']).between(window_start, start).to_numpy() & (codes >= 0)
+        weekly_arrivals += np.bincount(codes[recent], minlength=len(districts)) / fit_weeks
+    weekly_capacity = pd.to_datetime(closed['date_closed']).between(window_start, start).sum() / fit_weeks
+
+    closed_codes = _district_codes(closed, districts)
+    durations = closed['case_age_days'].to_numpy(dtype='float64')
+    median_weeks = np.array([np.median(durations[closed_codes == position]) for position in range(len(districts))]) / 7
+    return BacklogModel(districts, weekly_arrivals, float(weekly_capacity), hazard, initial_backlog, median_weeks,
+                        start)
+
+
+def policy_weights(model, policy):
+    """
+    the weight of every (district, age) cell under a prioritization policy
+        Args:
+            model: a BacklogModel
+            policy: one of POLICIES
+        Returns: (districts, ages) float array
+    """
+    n_districts, n_ages = model.hazard.shape
+    if policy == 'historic':
+        return np.ones((n_districts, n_ages))
+    if policy == 'oldest_first':
+        return np.broadcast_to(np.exp(np.arange(n_ages) / 26), (n_districts, n_ages)).copy()
+    if policy == 'equity':
+        return np.broadcast_to((model.median_weeks / np.nanmean(model.median_weeks))[:, None], (n_districts, n_ages)).copy()
+    raise ValueError(f"unknown policy '{policy}', expected one of {POLICIES}")
+
+
+def _median_wait_days(closures):
+    """
+    the median age in days of the repairs in each (simulation, district) row of closures, nan where none
+    """
+    cumulative = closures.cumsum(axis=-1)
+    total = cumulative[..., -1]
+    bucket = (cumulative < (total / 2)[..., None]).sum(axis=-1)
+    return np.where(total > 0, (bucket + 0.5) * 7, np.nan)
+
+
+@profiled
+def simulate(model, capacity=1.0, policy='historic', n_sims=FORECAST_SIMULATIONS, weeks=FORECAST_WEEKS, seed=0):
+    """
+    simulates backlog trajectories, all the simulations as one batch
+        Args:
+            model: a BacklogModel
+            capacity: the repair capacity as a multiple of the fitted one
+            policy: one of POLICIES
+            n_sims: the number of trajectories
+            weeks: the number of weeks to simulate
+            seed: random seed
+        Returns:
+            backlog: (weeks, sims, districts + 1) int array of open requests at the end of each week, the last
+                column is the city total
+            median_wait: (weeks, sims, districts + 1) float array of the median age in days of the week's repairs
+    """
+    rng = np.random.default_rng(seed)
+    n_districts, n_ages = model.hazard.shape
+    weights = model.hazard * policy_weights(model, policy)
+    weekly_capacity = capacity * model.weekly_capacity
+    open_requests = np.repeat(model.initial_backlog[None], n_sims, axis=0).astype(np.int64)
+    backlog = np.zeros((weeks, n_sims, n_districts + 1), dtype=np.int64)
+    median_wait = np.zeros((weeks, n_sims, n_districts + 1), dtype='float32')
+    for week in range(weeks):
+        # spread the capacity over the waiting requests, never more than the requests that are waiting
+        demand = (open_requests * weights).sum(axis=(1, 2))
+        scale = np.divide(weekly_capacity, demand, out=np.zeros(n_sims), where=demand > 0)
+        closures = rng.binomial(open_requests, np.minimum(weights[None] * scale[:, None, None], 1.0))
+        open_requests -= closures
+        # everyone ages a week, the last bucket keeps its requests, then the week's arrivals come in at age 0
+        oldest = open_requests[..., -1] + open_requests[..., -2]
+        open_requests[..., 1:] = open_requests[..., :-1]
+        open_requests[..., -1] = oldest
+        open_requests[..., 0] = rng.poisson(model.weekly_arrivals, size=(n_sims, n_districts))
+        district_backlog = open_requests.sum(axis=2)
+        backlog[week, :, :-1] = district_backlog
+        backlog[week, :, -1] = district_backlog.sum(axis=1)
+        median_wait[week, :, :-1] = _median_wait_days(closures)
+        median_wait[week, :, -1] = _median_wait_days(closures.sum(axis=1))
+    return backlog, median_wait
+
+
+def _bands(values, model, scenario, metric):
+    """
+    percentiles over the simulations as a tidy table
+    """
+    weeks, _, n_columns = values.shape
+    with warnings.catch_warnings():
+        # a district with nothing repaired in a week has no wait in any simulation, its bands are left nan
+        warnings.simplefilter('ignore', RuntimeWarning)
+        percentiles = np.nanpercentile(values, PERCENTILES, axis=1)
+    bands = pd.DataFrame({'scenario': scenario['name'], 'capacity': scenario['capacity'], 'policy': scenario['policy'],
+                          'week': np.repeat(np.arange(1, weeks + 1), n_columns),
+                          'date': np.repeat(model.start + pd.to_timedelta(np.arange(1, weeks + 1), unit='W'), n_columns),
+                          'council_district': np.tile(np.array([int(district) for district in model.districts] + ['All'],
+                                                               dtype=object), weeks),
+                          'metric': metric})
+    for percentile, band in zip(PERCENTILES, percentiles):
+        bands[f"p{percentile}"] = band.ravel()
+    return bands
+
+
+def _run_scenario(model, scenario, n_sims, weeks, seed):
+    """
+    simulates one scenario and summarizes it, run in the worker processes so only the bands are sent back
+    """
+    backlog, median_wait = simulate(model, capacity=scenario['capacity'], policy=scenario['policy'], n_sims=n_sims,
+                                    weeks=weeks, seed=seed)
+    return pd.concat([_bands(backlog, model, scenario, 'backlog'),
+                      _bands(median_wait, model, scenario, 'median_wait_days')], ignore_index=True)
+
+
+def scenario_grid(capacities=CAPACITY_SCENARIOS, policies=POLICIES):
+    """
+    every combination of a capacity multiple and a policy
+        Returns: list of dicts with name, capacity and policy
+    """
+    return [{'name': f"{policy} x{capacity:g}", 'capacity': capacity, 'policy': policy}
+            for policy in policies for capacity in capacities]
+
+
+@profiled
+def forecast(model, scenarios=None, n_sims=FORECAST_SIMULATIONS, weeks=FORECAST_WEEKS, workers=FORECAST_WORKERS,
+             seed=0):
+    """
+    runs the scenarios in a process pool and returns their percentile bands
+        Args:
+            model: a BacklogModel
+            scenarios: list of dicts with name, capacity and policy, scenario_grid() if not given
+            n_sims: the number of trajectories per scenario
+            weeks: the number of weeks to simulate
+            workers: number of processes, None for one per core, 1 to run in this process
+            seed: random seed, each scenario gets its own stream from it
+        Returns: dataframe with scenario, capacity, policy, week, date, council_district ('All' for the city),
+            metric (backlog or median_wait_days) and one column per percentile
+    """
+    scenarios = scenarios or scenario_grid()
+    # an unknown policy fails here rather than in a worker
+    for scenario in scenarios:
+        policy_weights(model, scenario['policy'])
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(scenarios))]
+    args = [(model, scenario, n_sims, weeks, scenario_seed) for scenario, scenario_seed in zip(scenarios, seeds)]
+    workers = min(workers or os.cpu_count() or 1, len(scenarios))
+    if workers <= 1:
+        results = [_run_scenario(*scenario_args) for scenario_args in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_scenario, *zip(*args)))
+    return pd.concat(results, ignore_index=True)
+
+
+if __name__ == "__main__":
+    arg_list = sys.argv[1:]
+    options = dict(arg.split('=', 1) for arg in arg_list if '=' in arg)
+    load_options = load_options_from_args(arg_list)
+    if "profile" in arg_list:
+        enable_profiling()
+    with stage('load street lights'):
+        historic_lights = read_street_light_requests([2017,2018,2019,2020,2021,2022], **load_options)
+        open_lights = read_street_light_requests(**load_options)
+    model = fit_backlog_model(historic_lights, open_lights)
+    scenarios = scenario_grid([float(capacity) for capacity in options['capacity'].split(',')] if 'capacity' in options else CAPACITY_SCENARIOS,
+                              options['policies'].split(',') if 'policies' in options else POLICIES)
+    with stage('backlog forecast', rows=len(scenarios)):
+        bands = forecast(model, scenarios, n_sims=int(options.get('sims', FORECAST_SIMULATIONS)),
+                         weeks=int(options.get('weeks', FORECAST_WEEKS)))
+    os.makedirs(os.path.dirname(BACKLOG_FORECAST_FILE), exist_ok=True)
+    bands.to_csv(BACKLOG_FORECAST_FILE, index=False)
+    final = bands[bands['week'].eq(bands['week'].max()) & bands['council_district'].eq('All')]
+    print(f"Backlog now {int(model.initial_backlog.sum())}, fitted {model.weekly_arrivals.sum():.0f} requests and "
+          f"{model.weekly_capacity:.0f} repairs a week. After {bands['week'].max()} weeks:")
+    print(final[['scenario', 'metric', 'p5', 'p50', 'p95']].to_string(index=False))
+    write_report()
@@ -0,0 +1,200 @@
+"""
+Timing and memory benchmarks of the hot paths on synthetic data.
+
+For every scale (a multiple of a real year, see synthetic_data.py) the synthetic files are written once to
+benchmarks/scale_<scale>/data and reused on later runs. Each hot path is timed over a few repeats and then run
+once more under tracemalloc for its peak memory. tracemalloc sees numpy and pandas allocations made in this
+process, not Arrow buffers or the loader's worker processes, so the peak resident size of the whole run is
+reported per scale as well. The results are written as JSON named after the git commit, and compare=<file>
+prints how each case changed against an earlier results file.
+
+Run as a script: python benchmark.py [scales=1,10] [repeats=3] [compare=<earlier results json>]
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from aggregation import aggregate
+from data_loading import REFERRED_STATUS, STREET_LIGHT_SERVICE, cache_requests, closed_requests_file, read_closed_requests
+from safety_counts import SAFETY_SERVICE_NAMES, add_safety_counts
+from scoring import add_weighting_factors, historic_factor_tables, prioritize, top_k
+from synthetic_data import write_synthetic_data
+from zone_tagging import PROMISE_ZONE_FILE, find_points_in_zone, load_zone_layer
+
+BENCHMARK_DIR = 'benchmarks'
+BENCHMARK_SCALES = [1]
+BENCHMARK_REPEATS = 3
+BENCHMARK_YEARS = [2017, 2018, 2019, 2020, 2021, 2022]
+
+
+def _version():
+    """
+    the git commit of the code being benchmarked
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # kilobytes on linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def measure(function, repeats=BENCHMARK_REPEATS):
+    """
+    times a function and measures the peak memory it allocates
+        Args:
+            function: called with no arguments
+            repeats: the number of timed calls
+        Returns:
+            timing: dict with seconds_median, seconds_min, repeats and peak_traced_mb
+            result: the return value of the last call
+    """
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds_median': float(np.median(seconds)), 'seconds_min': min(seconds), 'repeats': repeats,
+            'peak_traced_mb': peak / 2**20}, result
+
+
+def benchmark_scale(scale, repeats=BENCHMARK_REPEATS, years=BENCHMARK_YEARS):
+    """
+    runs every hot path on synthetic data of one scale, in the current directory
+        Args:
+            scale: size as a multiple of a real year
+            repeats: the number of timed calls of each case
+            years: the closed requests years to read, the last one is the current year
+        Returns: list of result dicts, one per case
+    """
+    if not all(os.path.exists(closed_requests_file(year)) for year in years):
+        write_synthetic_data(scale=scale, years=years)
+    results = []
+
+    def record(case, function, rows=None):
+        timing, result = measure(function, repeats)
+        results.append({'scale': scale, 'case': case, 'rows': len(result) if rows is None else int(rows), **timing})
+        print(f"scale {scale:g} {case:<28} {timing['seconds_median']:8.3f}s {timing['peak_traced_mb']:9.1f}MB")
+        return result
+
+    service_names = [STREET_LIGHT_SERVICE] + SAFETY_SERVICE_NAMES
+    closed = record('read_closed_requests_csv',
+                    lambda: read_closed_requests(years, service_names=service_names, use_cache=False))
+    for year in years:
+        cache_requests(closed_requests_file(year))
+    record('read_closed_requests_cached',
+           lambda: read_closed_requests(years, service_names=service_names), rows=len(closed))
+
+    lights = closed[closed['service_name'].eq(STREET_LIGHT_SERVICE) & ~closed['status'].eq(REFERRED_STATUS)]
+    historic_lights = lights[lights['year'].isin(years[:-1])].reset_index(drop=True)
+    # the newest year stands in for the open requests, so every scale has enough of them
+    open_lights = lights[lights['year'].eq(years[-1])].reset_index(drop=True)
+    safety_reports = closed[closed['service_name'].isin(SAFETY_SERVICE_NAMES)].reset_index(drop=True)
+
+    def zone_tag():
+        # reload the zone file every call so each repeat pays for the full tagging
+        load_zone_layer.cache_clear()
+        return find_points_in_zone(historic_lights[['lat', 'lng']], PROMISE_ZONE_FILE)
+    record('find_points_in_zone', zone_tag, rows=len(historic_lights))
+    open_lights['name'] = find_points_in_zone(open_lights[['lat', 'lng']], PROMISE_ZONE_FILE)['name'].fillna('Rest of City')
+
+    counted = record('safety_counts',
+                     lambda: add_safety_counts(open_lights.copy(), safety_reports),
+                     rows=len(open_lights) + len(safety_reports))
+    open_lights['number_safety_related_near'] = counted['number_safety_related_near']
+
+    historic_tables = record('aggregate',
+                             lambda: aggregate(historic_lights, 'case_age_days',
+                                               {'city_wide':['year'], 'district_by_year':['year','council_district'],
+                                                'district':['council_district'], 'zipcode':['zipcode'],
+                                                'community':['comm_plan_name']},
+                                               labels={'median':'Median Time to Repair', 'count':'Count'}),
+                             rows=len(historic_lights))
+
+    factorized = add_weighting_factors(open_lights, *historic_factor_tables(historic_tables))
+    prioritized = record('prioritize', lambda: prioritize(factorized), rows=len(factorized))
+    scores = prioritized['combined_priority'].to_numpy()
+    record('top_k', lambda: top_k(scores, 100), rows=len(scores))
+    return results
+
+
+def run_benchmarks(scales=BENCHMARK_SCALES, repeats=BENCHMARK_REPEATS, benchmark_dir=BENCHMARK_DIR):
+    """
+    benchmarks every scale and writes the results to <benchmark_dir>/results_<git commit>.json
+        Args:
+            scales: list of sizes as a multiple of a real year
+            repeats: the number of timed calls of each case
+            benchmark_dir: directory for the synthetic data and the results
+        Returns: the path of the results file
+    """
+    benchmark_dir = os.path.abspath(benchmark_dir)
+    version = _version()
+    report = {'version': version, 'timestamp': pd.Timestamp.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+              'cpu_count': os.cpu_count(), 'results': [], 'max_rss_mb': {}}
+    start_dir = os.getcwd()
+    for scale in scales:
+        # the loaders read data/..., so each scale runs in its own directory
+        scale_dir = os.path.join(benchmark_dir, f"scale_{scale:g}")
+        os.makedirs(scale_dir, exist_ok=True)
+        os.chdir(scale_dir)
+        try:
+            report['results'].extend(benchmark_scale(scale, repeats))
+        finally:
+            os.chdir(start_dir)
+        report['max_rss_mb'][f"{scale:g}"] = _max_rss_mb()
+    results_file = os.path.join(benchmark_dir, f"results_{version}.json")
+    with open(results_file, 'w') as f:
+        json.dump(report, f, indent=1)
+    return results_file
+
+
+def compare_results(old_file, new_file):
+    """
+    lines up two results files case by case
+        Args:
+            old_file, new_file: results json files from run_benchmarks
+        Returns: dataframe with the old and new median times and peak memory of every case and their ratios
+    """
+    tables = []
+    for file_name in (old_file, new_file):
+        with open(file_name) as f:
+            tables.append(pd.DataFrame(json.load(f)['results'])[['scale', 'case', 'seconds_median', 'peak_traced_mb']])
+    comparison = tables[0].merge(tables[1], on=['scale', 'case'], suffixes=('_old', '_new'))
+    comparison['time_ratio'] = comparison['seconds_median_new'] / comparison['seconds_median_old']
+    comparison['memory_ratio'] = comparison['peak_traced_mb_new'] / comparison['peak_traced_mb_old']
+    return comparison
+
+
+if __name__ == "__main__":
+    options = dict(arg.split('=', 1) for arg in sys.argv[1:] if '=' in arg)
+    scales = [float(scale) for scale in options['scales'].split(',')] if 'scales' in options else BENCHMARK_SCALES
+    results_file = run_benchmarks(scales, repeats=int(options.get('repeats', BENCHMARK_REPEATS)))
+    print(f"Wrote {results_file}")
+    if 'compare' in options:
+        print(compare_results(options['compare'], results_file).to_string(index=False))
@@ -0,0 +1,127 @@
+"""
+Counting of nighttime crimes on the block of each street light request, from the ARJIS public crime extract.
+
+The crime file only locates incidents by a hundred block address ('1200 BLOCK MARKET ST'), so crimes are linked
+to street light requests by address: both sides are normalized and the crime streets are matched against an
+n-gram index of the street light streets (address_matching.py), then requests and crimes on the same hundred
+block of the same street are paired. Only crimes in the dark (between an approximate San Diego sunset and
+sunrise) and after the street light was reported count. Crimes are matched in batches of rows, and every
+distinct street name is only matched once, so the work grows with the data rather than with its square.
+"""
+
+import numpy as np
+import pandas as pd
+
+from address_matching import MATCH_THRESHOLD, StreetIndex, match_addresses, normalize_addresses
+from profiling import Progress, profiled
+from safety_counts import LIGHT_OUT_DETAILS
+
+CRIME_FILE = 'data/ARJISPublicCrime091422.txt'
+# column names of the 09/14/22 extract, other extracts may name them differently, so every function takes them
+CRIME_ADDRESS_COLUMN = 'BLOCK_ADDRESS'
+CRIME_DATE_COLUMN = 'activityDate'
+CRIME_BATCH_ROWS = 200000
+# standard time sunrise and sunset in San Diego at the June solstice and half the yearly swing, in hours
+SUNRISE_HOURS = (4.72, 1.07)
+SUNSET_HOURS = (18.98, 1.12)
+# daylight saving time, roughly the second Sunday of March to the first Sunday of November, as days of the year
+DAYLIGHT_SAVING_DAYS = (68, 308)
+
+
+def read_crime_data(file_name=CRIME_FILE, date_column=CRIME_DATE_COLUMN):
+    """
+    reads the ARJIS public crime extract and parses the incident dates
+        Args:
+            file_name: path of the crime extract
+            date_column: the column with the date and time of each incident
+        Returns: a dataframe of crimes with the dates parsed, crimes without a readable date are dropped
+    """
+    crime_data = pd.read_csv(file_name, low_memory=False)
+    if date_column not in crime_data:
+        raise ValueError(f"{file_name} has no {date_column} column, give the date column as one of {list(crime_data.columns)}")
+    dates = pd.to_datetime(crime_data[date_column], errors='coerce')
+    # the format is inferred from the first date, only dates written some other way are parsed one by one
+    other_format = dates.isna() & crime_data[date_column].notna()
+    if other_format.any():
+        dates[other_format] = pd.to_datetime(crime_data.loc[other_format, date_column], errors='coerce', format='mixed')
+    crime_data[date_column] = dates
+    return crime_data[crime_data[date_column].notna()].reset_index(drop=True)
+
+
+def is_dark(times):
+    """
+    whether the sun was down in San Diego, from a cosine model of sunrise and sunset over the year that is within
+    about a quarter of an hour of the almanac
+        Args:
+            times: array like of local date times
+        Returns: bool array
+    """
+    times = pd.DatetimeIndex(times)
+    day = times.dayofyear.to_numpy()
+    # 1 at the June solstice, -1 at the December solstice
+    season = np.cos(2 * np.pi * (day - 172) / 365.25)
+    clock_shift = ((day >= DAYLIGHT_SAVING_DAYS[0]) & (day < DAYLIGHT_SAVING_DAYS[1])).astype('float64')
+    sunrise = SUNRISE_HOURS[0] + SUNRISE_HOURS[1] * (1 - season) + clock_shift
+    sunset = SUNSET_HOURS[0] - SUNSET_HOURS[1] * (1 - season) + clock_shift
+    hour = times.hour.to_numpy() + times.minute.to_numpy() / 60
+    return (hour < sunrise) | (hour >= sunset)
+
+
+@profiled
+def count_crimes_near(lights, crimes, threshold=MATCH_THRESHOLD, address_column=CRIME_ADDRESS_COLUMN,
+                      date_column=CRIME_DATE_COLUMN, batch_rows=CRIME_BATCH_ROWS):
+    """
+    counts the nighttime crimes on the same block as each street light request and after it was reported
+        Args:
+            lights: dataframe of street light requests with street_address and date_requested columns
+            crimes: dataframe from read_crime_data
+            threshold: lowest street name similarity that counts as the same street
+            address_column: the block address column of crimes
+            date_column: the incident date column of crimes
+            batch_rows: crimes matched at a time, bounds the memory of the matched pairs
+        Returns:
+            counts: an int64 numpy array aligned with the rows of lights
+    """
+    counts = np.zeros(len(lights), dtype=np.int64)
+    light_times = pd.to_datetime(lights['date_requested']).to_numpy(dtype='datetime64[ns]')
+    crime_times = pd.to_datetime(crimes[date_column]).to_numpy(dtype='datetime64[ns]')
+    # crimes in daylight, or before any of the lights broke, can never count
+    usable = is_dark(crime_times) & ~np.isnat(crime_times)
+    if len(lights) and not np.all(np.isnat(light_times)):
+        usable &= crime_times > np.nanmin(light_times)
+    usable = np.flatnonzero(usable)
+    if len(usable) == 0:
+        return counts
+    light_addresses = normalize_addresses(lights['street_address'])
+    index = StreetIndex(light_addresses['street_name'])
+    progress = Progress(len(usable), label='crimes matched')
+    for start in range(0, len(usable), batch_rows):
+        batch = usable[start:start + batch_rows]
+        crime_addresses = normalize_addresses(crimes[address_column].to_numpy()[batch])
+        pairs = match_addresses(light_addresses, crime_addresses, threshold=threshold, index=index)
+        light_rows = pairs['left_row'].to_numpy()
+        after = crime_times[batch[pairs['right_row'].to_numpy()]] > light_times[light_rows]
+        counts += np.bincount(light_rows[after], minlength=len(lights))
+        progress.update(len(batch))
+    return counts
+
+
+def add_crime_counts(lights, crimes, threshold=MATCH_THRESHOLD, address_column=CRIME_ADDRESS_COLUMN,
+                     date_column=CRIME_DATE_COLUMN):
+    """
+    adds the number_night_crimes_on_block column to a dataframe of street light requests
+        Args:
+            lights: dataframe of street light requests with street_address, date_requested and
+                service_name_detail columns
+            crimes: dataframe from read_crime_data
+            threshold: lowest street name similarity that counts as the same street
+            address_column: the block address column of crimes
+            date_column: the incident date column of crimes
+        Returns:
+            lights: the input dataframe with number_night_crimes_on_block added
+    """
+    lights['number_night_crimes_on_block'] = count_crimes_near(lights, crimes, threshold=threshold,
+                                                               address_column=address_column, date_column=date_column)
+    # as with the safety count, only a light that is actually dark can be linked to crimes
+    lights.loc[~lights['service_name_detail'].isin(LIGHT_OUT_DETAILS), 'number_night_crimes_on_block'] = 0
+    return lights
@@ -0,0 +1,412 @@
+"""
+Shared loading of the Get It Done request files.
+
+The first time a csv is read it is converted into a typed Parquet cache under data/cache. Later reads go
+to the cache, reading only the requested columns and pushing the service/status filters down into the
+Parquet scan. A cache entry is rebuilt when the size or modification time of its source csv changes. With
+verify_hash the content hash decides instead: a touched but unchanged file keeps its cache and an edit that kept
+the size and modification time is still caught.
+
+Frames are returned compact: the low cardinality text columns as categoricals (read straight from the Parquet
+dictionary encoding), repeated street addresses as a categorical too, and the repair time, zip code and council
+district as float32. Yearly frames are concatenated on a shared set of categories so the result stays compact.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+from profiling import Progress, profiled
+
+DATA_DIR = 'data'
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+OPEN_REQUESTS_FILE = os.path.join(DATA_DIR, 'get_it_done_requests_open_datasd.csv')
+STREET_LIGHT_SERVICE = 'Street Light Maintenance'
+REFERRED_STATUS = 'Referred'
+# default number of processes used to read yearly files, None means one per core
+LOAD_WORKERS = None
+# rows per chunk when streaming a csv and no memory limit is given
+STREAM_CHUNK_ROWS = 100000
+
+REQUEST_COLUMNS = ['service_request_id', 'service_request_parent_id', 'date_requested',
+                   'case_age_days', 'service_name', 'service_name_detail',
+                   'date_closed', 'status', 'lat', 'lng', 'street_address', 'zipcode',
+                   'council_district', 'comm_plan_name', 'park_name', 'case_origin']
+DATE_COLUMNS = ['date_requested', 'date_closed']
+# columns that are numeric but show up as a mix of numbers and strings across the yearly files
+NUMERIC_COLUMNS = ['case_age_days', 'lat', 'lng', 'zipcode', 'council_district']
+# text columns with few distinct values, always held as categoricals
+CATEGORY_COLUMNS = ['service_name', 'service_name_detail', 'status', 'comm_plan_name', 'park_name', 'case_origin']
+# other text columns (street_address) become categoricals when at most this share of their values are distinct
+MAX_CATEGORY_RATIO = 0.5
+# numeric columns that fit float32 exactly (whole days, 5 digit zip codes, district numbers), lat and lng stay
+# float64 since float32 would move points by up to a meter
+FLOAT32_COLUMNS = ['case_age_days', 'zipcode', 'council_district']
+
+
+def closed_requests_file(year):
+    """
+    gives the path of the closed request file for a year
+        Args:
+            year: the year of closures
+        Returns: the path of the csv file
+    """
+    return os.path.join(DATA_DIR, f"get_it_done_requests_closed_{year}_datasd.csv")
+
+
+def _file_hash(file_name):
+    """
+    sha256 of a file's content, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_paths(file_name):
+    base = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(CACHE_DIR, base + '.parquet'), os.path.join(CACHE_DIR, base + '.json')
+
+
+def type_requests(df):
+    """
+    gives the request columns consistent types so files from different years line up
+        Args:
+            df: a dataframe of requests as read from csv
+        Returns:
+            df: the dataframe with parsed dates and numeric columns as float64
+    """
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            # zipcodes come in as a mix of ints, floats and strings like '92101-1234'
+            values = df[column].astype('string').str.split('-').str[0] if column == 'zipcode' else df[column]
+            df[column] = pd.to_numeric(values, errors='coerce').astype('float64')
+    return df
+
+
+def compact_requests(df, max_category_ratio=MAX_CATEGORY_RATIO):
+    """
+    converts the request columns to compact types, columns that are already compact are left as they are
+        Args:
+            df: a dataframe of typed requests, it is changed in place
+            max_category_ratio: text columns outside CATEGORY_COLUMNS become categoricals when at most this
+                share of their values are distinct
+        Returns:
+            df: the dataframe with categorical text columns and float32 numeric columns
+    """
+    for column in df.columns:
+        # text is object or, from pandas 3, the str dtype
+        if not pd.api.types.is_string_dtype(df[column].dtype) or column.endswith('_id'):
+            continue
+        if column in CATEGORY_COLUMNS or df[column].nunique() <= max_category_ratio * len(df):
+            df[column] = df[column].astype('category')
+    for column in FLOAT32_COLUMNS:
+        if column in df.columns and df[column].dtype == 'float64':
+            df[column] = df[column].astype('float32')
+    return df
+
+
+def concat_requests(frames):
+    """
+    concatenates request frames, putting each categorical column on the union of its categories first so it
+    stays categorical (pd.concat turns categoricals with different categories into object strings)
+        Args:
+            frames: list of request dataframes with the same columns, they are changed in place
+        Returns: a single dataframe with a fresh index
+    """
+    frames = [frame for frame in frames if len(frame.columns)]
+    if not frames:
+        return pd.DataFrame()
+    for column in frames[0].columns:
+        if not all(column in frame and isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+        categories = frames[0][column].cat.categories
+        for frame in frames[1:]:
+            categories = categories.union(frame[column].cat.categories)
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def memory_footprint(df):
+    """
+    the in-memory size of a dataframe of requests and the size it would have with text as object strings and
+    numbers as float64, without building that copy
+        Args:
+            df: a dataframe of requests
+        Returns: (compact megabytes, plain megabytes)
+    """
+    compact = df.memory_usage(deep=True, index=False)
+    plain = compact.copy()
+    for column in df.columns:
+        dtype = df[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            # a pointer per row plus the size of each row's string, as memory_usage counts object columns
+            sizes = np.array([sys.getsizeof(value) for value in df[column].cat.categories] + [sys.getsizeof(np.nan)])
+            plain[column] = 8 * len(df) + sizes[df[column].cat.codes.to_numpy()].sum()
+        elif dtype == 'float32':
+            plain[column] = 8 * len(df)
+    return compact.sum() / 2**20, plain.sum() / 2**20
+
+
+def _cache_is_fresh(file_name, meta_file, verify_hash):
+    """
+    checks the cache metadata against the source file, refreshing the stored size/mtime on a hash match
+    """
+    if not os.path.exists(meta_file):
+        return False
+    with open(meta_file) as f:
+        meta = json.load(f)
+    stat = os.stat(file_name)
+    same_stat = meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns
+    if not verify_hash:
+        return same_stat
+    if meta['size'] != stat.st_size or meta['sha256'] != _file_hash(file_name):
+        return False
+    if not same_stat:
+        meta['mtime_ns'] = stat.st_mtime_ns
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f)
+    return True
+
+
+def cache_requests(file_name, verify_hash=False):
+    """
+    makes sure there is an up to date Parquet cache for a request csv, converting it if needed
+        Args:
+            file_name: path of the request csv
+            verify_hash: compare content hashes instead of trusting the size and mtime, hashes the csv on every call
+        Returns: the path of the Parquet cache file
+    """
+    cache_file, meta_file = _cache_paths(file_name)
+    if os.path.exists(cache_file) and _cache_is_fresh(file_name, meta_file, verify_hash):
+        return cache_file
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    stat = os.stat(file_name)
+    requests = type_requests(pd.read_csv(file_name, low_memory=False))
+    requests.to_parquet(cache_file, index=False)
+    with open(meta_file, 'w') as f:
+        json.dump({'source': file_name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                   'sha256': _file_hash(file_name)}, f)
+    return cache_file
+
+
+def _filter_expression(service_names, exclude_status):
+    """
+    builds the pyarrow filter for the service and status conditions, None if there are none
+    """
+    expression = None
+    if service_names is not None:
+        expression = pc.field('service_name').isin(list(service_names))
+    if exclude_status is not None:
+        # rows with no status are kept, as with DataFrame.ne
+        status_filter = ~pc.field('status').isin(list(exclude_status)) | pc.field('status').is_null()
+        expression = status_filter if expression is None else expression & status_filter
+    return expression
+
+
+def _read_columns(columns):
+    """
+    the columns to read from csv, the filter columns have to be read even if they are not returned
+    """
+    return list(columns) + [column for column in ('service_name', 'status') if column not in columns]
+
+
+def _filter_chunk(chunk, service_names, exclude_status):
+    """
+    applies the service and status conditions to a dataframe
+    """
+    if service_names is not None:
+        chunk = chunk[chunk['service_name'].isin(service_names)]
+    if exclude_status is not None:
+        chunk = chunk[~chunk['status'].isin(exclude_status)]
+    return chunk
+
+
+def chunk_rows_for_memory(file_name, memory_limit_mb, sample_rows=2000):
+    """
+    picks a chunk size so that parsing one chunk of a csv stays inside a memory ceiling
+        Args:
+            file_name: path of the csv
+            memory_limit_mb: the memory to allow for a raw chunk, in megabytes
+            sample_rows: number of rows read to estimate the in-memory size of a row
+        Returns: the number of rows per chunk
+    """
+    sample = pd.read_csv(file_name, nrows=sample_rows, low_memory=False)
+    bytes_per_row = max(sample.memory_usage(deep=True).sum() / max(len(sample), 1), 1)
+    # parsing needs roughly as much again as the finished chunk, so only budget half the limit for it
+    return max(int(memory_limit_mb * 2**20 / 2 / bytes_per_row), 1000)
+
+
+def iter_requests(file_name, columns=REQUEST_COLUMNS, service_names=None, exclude_status=None, chunk_rows=None,
+                  memory_limit_mb=None):
+    """
+    streams a request csv in bounded chunks, filtering and typing each chunk as it is read
+        Args:
+            file_name: path of the request csv
+            columns: the columns to return
+            service_names: if given, only rows with one of these service names are returned
+            exclude_status: if given, rows with one of these statuses are dropped
+            chunk_rows: rows per chunk, worked out from memory_limit_mb or STREAM_CHUNK_ROWS if not given
+            memory_limit_mb: memory ceiling for a raw chunk, in megabytes
+        Yields: typed dataframes holding only the requested columns of the rows that pass the filters
+    """
+    if chunk_rows is None:
+        chunk_rows = chunk_rows_for_memory(file_name, memory_limit_mb) if memory_limit_mb else STREAM_CHUNK_ROWS
+    columns = list(columns)
+    progress = Progress(label=f"{os.path.basename(file_name)} rows read")
+    for chunk in pd.read_csv(file_name, usecols=_read_columns(columns), chunksize=chunk_rows, low_memory=False):
+        progress.update(len(chunk))
+        chunk = _filter_chunk(chunk, service_names, exclude_status)
+        if len(chunk):
+            yield type_requests(chunk[columns].copy())
+
+
+@profiled
+def read_requests(file_name, columns=REQUEST_COLUMNS, service_names=None, exclude_status=None, use_cache=True,
+                  verify_hash=False, streaming=False, chunk_rows=None, memory_limit_mb=None, compact=True):
+    """
+    reads a Get It Done request file, from the Parquet cache when possible
+        Args:
+            file_name: path of the request csv
+            columns: the columns to return
+            service_names: if given, only rows with one of these service names are returned
+            exclude_status: if given, rows with one of these statuses are dropped
+            use_cache: set False to always parse the csv
+            verify_hash: compare content hashes instead of trusting the size and mtime, hashes the csv on every call
+            streaming: read the csv in bounded chunks instead of going through the cache, for low memory hosts
+            chunk_rows: rows per chunk when streaming
+            memory_limit_mb: memory ceiling for a raw chunk when streaming, in megabytes. It does not cover the
+                result: the filtered chunks are kept compacted until the end, and joining them needs about twice
+                the compacted result for a moment, on top of the chunk ceiling
+            compact: return categorical text and float32 numeric columns (compact_requests), False for object
+                strings and float64
+        Returns: a dataframe of the requested columns and rows
+    """
+    if streaming:
+        chunks = iter_requests(file_name, columns=columns, service_names=service_names,
+                               exclude_status=exclude_status, chunk_rows=chunk_rows,
+                               memory_limit_mb=memory_limit_mb)
+        # compacting each chunk as it arrives keeps only one chunk of object strings in memory at a time, the
+        # compacted chunks and their concatenation are both held while they are joined
+        chunks = [compact_requests(chunk) if compact else chunk for chunk in chunks]
+        if not chunks:
+            return pd.DataFrame(columns=list(columns))
+        requests = concat_requests(chunks) if compact else pd.concat(chunks, ignore_index=True)
+    elif use_cache and HAVE_PYARROW:
+        cache_file = cache_requests(file_name, verify_hash=verify_hash)
+        # dictionary encoded columns come out of the scan as categoricals, never as object strings
+        table = pq.read_table(cache_file, columns=list(columns),
+                              filters=_filter_expression(service_names, exclude_status),
+                              read_dictionary=[column for column in columns if column in CATEGORY_COLUMNS] if compact else None)
+        requests = table.to_pandas()
+    else:
+        requests = pd.read_csv(file_name, usecols=_read_columns(columns), low_memory=False)
+        requests = type_requests(_filter_chunk(requests, service_names, exclude_status)[list(columns)].reset_index(drop=True))
+    return compact_requests(requests) if compact else requests
+
+
+def read_open_requests(columns=REQUEST_COLUMNS, service_names=None, exclude_status=None, **kwargs):
+    """
+    reads the currently open requests
+        Args:
+            columns: the columns to return
+            service_names: if given, only rows with one of these service names are returned
+            exclude_status: if given, rows with one of these statuses are dropped
+            kwargs: passed on to read_requests
+        Returns: a dataframe of the open requests
+    """
+    return read_requests(OPEN_REQUESTS_FILE, columns=columns, service_names=service_names,
+                         exclude_status=exclude_status, **kwargs)
+
+
+def _read_year(year, columns, service_names, exclude_status, kwargs):
+    """
+    reads one year of closed requests and tags it with the year, run in the worker processes
+    """
+    years_raw_data = read_requests(closed_requests_file(year), columns=columns, service_names=service_names,
+                                   exclude_status=exclude_status, **kwargs)
+    years_raw_data['year'] = year
+    return years_raw_data
+
+
+@profiled
+def read_closed_requests(year_list, columns=REQUEST_COLUMNS, service_names=None, exclude_status=None,
+                         workers=LOAD_WORKERS, **kwargs):
+    """
+    reads in closed request data for multiple years, adds year data, and puts all the data together in a single df
+    the years are read concurrently in a process pool and concatenated once at the end
+        Args:
+            year_list: a list of the years to be read
+            columns: the columns to return
+            service_names: if given, only rows with one of these service names are returned
+            exclude_status: if given, rows with one of these statuses are dropped
+            workers: number of processes to read with, None for one per core, 1 to read in this process
+            kwargs: passed on to read_requests
+        Returns: a dataframe with the appropriate columns of the closed request data
+    """
+    year_list = list(year_list)
+    if not year_list:
+        return pd.DataFrame(columns=list(columns) + ['year'])
+    workers = min(workers or os.cpu_count() or 1, len(year_list))
+    if kwargs.get('memory_limit_mb'):
+        # each worker streams its own file, so they share the memory ceiling
+        kwargs['memory_limit_mb'] = kwargs['memory_limit_mb'] / workers
+    args = [(year, columns, service_names, exclude_status, kwargs) for year in year_list]
+    if workers <= 1:
+        years_data = [_read_year(*year_args) for year_args in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            years_data = list(pool.map(_read_year, *zip(*args)))
+    if kwargs.get('compact', True):
+        return compact_requests(concat_requests(years_data))
+    return pd.concat(years_data, ignore_index=True)
+
+
+def read_street_light_requests(year_list=None, **kwargs):
+    """
+    reads the street light maintenance requests that were not referred elsewhere
+        Args:
+            year_list: the years of closed requests to read, None for the open requests
+            kwargs: passed on to read_requests
+        Returns: a dataframe of street light requests
+    """
+    filters = {'service_names': [STREET_LIGHT_SERVICE], 'exclude_status': [REFERRED_STATUS]}
+    if year_list is None:
+        return read_open_requests(**filters, **kwargs)
+    return read_closed_requests(year_list, **filters, **kwargs)
+
+
+def load_options_from_args(arg_list):
+    """
+    reads the loader options from command line arguments
+    "streaming" turns on chunked reading and "memory_limit_mb=<megabytes>" sets its memory ceiling
+        Args:
+            arg_list: the command line arguments
+        Returns: a dict of keyword arguments for the read functions
+    """
+    options = {}
+    for arg in arg_list:
+        if arg == 'streaming':
+            options['streaming'] = True
+        elif arg.startswith('memory_limit_mb='):
+            options['streaming'] = True
+            options['memory_limit_mb'] = float(arg.split('=', 1)[1])
+    return options
@@ -0,0 +1,148 @@
+"""
+Metric radius neighbor queries for lat/lng request data.
+
+Coordinates are projected once per dataset, vectorized, into a local metric CRS (California State Plane
+zone 6 by default, which covers San Diego) and held in a KD-tree. Radius queries then take feet or meters
+and are correct at every latitude, unlike distances taken directly in degrees.
+"""
+
+import numpy as np
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+from profiling import Progress, profiled
+
+# NAD83 / California zone 6 in meters
+DEFAULT_CRS = 'EPSG:26946'
+METERS_PER_UNIT = {'m': 1.0, 'meters': 1.0, 'ft': 0.3048, 'feet': 0.3048}
+
+
+def to_meters(distance, units='ft'):
+    """
+    converts a distance to meters
+        Args:
+            distance: the distance to convert
+            units: the units of distance, one of 'm', 'meters', 'ft' or 'feet'
+        Returns: the distance in meters
+    """
+    if units not in METERS_PER_UNIT:
+        raise ValueError(f"unknown distance units '{units}', expected one of {sorted(METERS_PER_UNIT)}")
+    return distance * METERS_PER_UNIT[units]
+
+
+def project_lat_lng(lat, lng, crs=DEFAULT_CRS):
+    """
+    projects lat/lng arrays into a metric CRS in a single vectorized call
+        Args:
+            lat: array like of latitudes in degrees
+            lng: array like of longitudes in degrees
+            crs: the projected CRS to use, must have meters as its unit
+        Returns:
+            xy: an (n, 2) float array of projected coordinates in meters, rows with missing input are nan
+    """
+    transformer = Transformer.from_crs('EPSG:4326', crs, always_xy=True)
+    x, y = transformer.transform(np.asarray(lng, dtype='float64'), np.asarray(lat, dtype='float64'))
+    xy = np.column_stack([x, y])
+    xy[~np.isfinite(xy).all(axis=1)] = np.nan
+    return xy
+
+
+class NeighborIndex:
+    """
+    a KD-tree over projected request locations that answers batched "neighbors within r" queries
+        Args:
+            lat: array like of latitudes in degrees
+            lng: array like of longitudes in degrees
+            crs: the projected CRS to use, must have meters as its unit
+    """
+
+    def __init__(self, lat, lng, crs=DEFAULT_CRS):
+        self.crs = crs
+        xy = project_lat_lng(lat, lng, crs=crs)
+        # rows with no location can never be a neighbor, keep a map from tree position back to input row
+        self.rows = np.flatnonzero(np.isfinite(xy).all(axis=1))
+        self.xy = xy[self.rows]
+        self.tree = cKDTree(self.xy)
+        self.size = len(xy)
+
+    @classmethod
+    def from_frame(cls, df, crs=DEFAULT_CRS):
+        """
+        builds an index from a dataframe with lat and lng columns
+            Args:
+                df: the dataframe to index
+                crs: the projected CRS to use
+            Returns: a NeighborIndex whose row numbers refer to the positions in df
+        """
+        return cls(df['lat'].to_numpy(), df['lng'].to_numpy(), crs=crs)
+
+    def _project_queries(self, lat, lng):
+        """
+        projects query points and returns them with the positions of the usable ones
+        """
+        xy = project_lat_lng(lat, lng, crs=self.crs)
+        usable = np.flatnonzero(np.isfinite(xy).all(axis=1))
+        return xy, usable
+
+    @profiled
+    def pairs_within(self, lat, lng, radius, units='ft', batch_size=20000):
+        """
+        finds every (query, indexed point) pair closer than the radius
+            Args:
+                lat: array like of query latitudes
+                lng: array like of query longitudes
+                radius: the search radius
+                units: the units of radius, 'ft' or 'm'
+                batch_size: number of query points handled at a time, bounds the memory used for pairs
+            Returns:
+                query_rows: int array of query positions
+                point_rows: int array of indexed row positions
+                distances: float array of distances in meters
+        """
+        radius_m = to_meters(radius, units)
+        xy, usable = self._project_queries(lat, lng)
+        query_rows, point_rows, distances = [], [], []
+        progress = Progress(len(usable), label='neighbor queries')
+        for start in range(0, len(usable), batch_size):
+            batch = usable[start:start + batch_size]
+            pairs = cKDTree(xy[batch]).sparse_distance_matrix(self.tree, radius_m, output_type='ndarray')
+            # strictly inside the radius
+            pairs = pairs[pairs['v'] < radius_m]
+            query_rows.append(batch[pairs['i']])
+            point_rows.append(self.rows[pairs['j']])
+            distances.append(pairs['v'])
+            progress.update(len(batch))
+        if not query_rows:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+        return np.concatenate(query_rows), np.concatenate(point_rows), np.concatenate(distances)
+
+    def count_within(self, lat, lng, radius, units='ft'):
+        """
+        counts the indexed points closer than the radius to each query point
+            Args:
+                lat: array like of query latitudes
+                lng: array like of query longitudes
+                radius: the search radius
+                units: the units of radius, 'ft' or 'm'
+            Returns:
+                counts: an int64 array aligned with the query points, 0 for queries with no location
+        """
+        query_rows, _, _ = self.pairs_within(lat, lng, radius, units=units)
+        return np.bincount(query_rows, minlength=len(np.asarray(lat))).astype(np.int64)
+
+    def query_within(self, lat, lng, radius, units='ft'):
+        """
+        lists the indexed rows closer than the radius to each query point
+            Args:
+                lat: array like of query latitudes
+                lng: array like of query longitudes
+                radius: the search radius
+                units: the units of radius, 'ft' or 'm'
+            Returns:
+                neighbors: a list with one int array of indexed row positions per query point
+        """
+        n_queries = len(np.asarray(lat))
+        query_rows, point_rows, _ = self.pairs_within(lat, lng, radius, units=units)
+        order = np.lexsort((point_rows, query_rows))
+        splits = np.cumsum(np.bincount(query_rows, minlength=n_queries))[:-1]
+        return np.split(point_rows[order], splits)
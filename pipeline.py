@@ -0,0 +1,369 @@
+"""
+The project as a pipeline of named stages with cached outputs.
+
+    load -> filter -> zone_tag ------\\
+                   -> safety_count ---> factorize -> score -> report
+                   -> aggregate -----/
+                   -> crime_count --/    (only when the crime factor has a weight)
+
+Each stage's output is pickled in data/cache/pipeline under a fingerprint of the stage's code (its function
+and the project modules it uses), its parameters (years, radius, weights, ...), the fingerprints of the stages
+it reads from and, for load, the size and modification time (or sha256 with verify_hash) of the data files.
+A rerun only executes the stages whose fingerprint changed, and only reads the cached outputs those stages
+need, so new weights read the factorized requests and score them without touching the raw data. Stages whose
+inputs are ready run at the same time in a thread pool (zone_tag, safety_count and aggregate after filter).
+
+Run as a script: python pipeline.py [weighting_matrix.csv] [radius=<feet>] [top=<n>] [force] [streaming]
+[memory_limit_mb=<megabytes>] [profile]
+"""
+
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import address_matching
+import aggregation
+import crime_counts
+import data_loading
+import neighbor_query
+import profiling
+import safety_counts
+import scoring
+import zone_tagging
+from aggregation import aggregate
+from crime_counts import CRIME_FILE, add_crime_counts, read_crime_data
+from data_loading import (CACHE_DIR, REFERRED_STATUS, STREET_LIGHT_SERVICE, _file_hash, closed_requests_file,
+                          concat_requests, load_options_from_args, read_closed_requests, read_open_requests)
+from safety_counts import SAFETY_RADIUS, SAFETY_RADIUS_UNITS, SAFETY_SERVICE_NAMES, add_safety_counts
+from scoring import (DEFAULT_WEIGHTS, add_weighting_factors, historic_factor_tables, min_max_scale, prioritize,
+                     read_weights)
+from zone_tagging import PROMISE_ZONE_FILE, find_points_in_zone
+
+PIPELINE_CACHE_DIR = os.path.join(CACHE_DIR, 'pipeline')
+# default number of stages run at the same time
+PIPELINE_WORKERS = 4
+# cached outputs kept per stage, so switching back to recent settings is also a cache hit
+KEEP_ARTIFACTS = 3
+HISTORIC_YEARS = [2017, 2018, 2019, 2020, 2021]
+CURRENT_YEAR = 2022
+PRIORITIZED_REQUESTS_FILE = 'graphs/prioritized_requests.csv'
+OUTPUT_COLUMNS = ['service_request_id', 'service_request_parent_id', 'date_requested',
+                  'case_age_days', 'service_name_detail', 'street_address', 'promise_zone_weighting',
+                  'safety_weighting_factor', 'age_weighting_factor',
+                  'district_weighting_factor', 'zipcode_weighting_factor',
+                  'community_weighting_factor', 'combined_priority']
+
+
+class Stage:
+    """
+    one named step of the pipeline
+        Args:
+            name: the stage name, also used for its cache files
+            function: called with the outputs of the input stages (in order) and the params and options as
+                keyword arguments, returns the stage output
+            inputs: names of the stages whose outputs the function takes
+            params: dict of settings that change the output, part of the fingerprint
+            options: dict of settings that only change how the output is made (e.g. streaming), not fingerprinted
+            modules: project modules whose source is part of the fingerprint
+            source_files: data files whose size and modification time are part of the fingerprint
+            output_files: files the stage writes, the stage reruns if any of them is missing
+    """
+
+    def __init__(self, name, function, inputs=(), params=None, options=None, modules=(), source_files=(),
+                 output_files=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.options = options or {}
+        self.modules = list(modules)
+        self.source_files = list(source_files)
+        self.output_files = list(output_files)
+
+    def fingerprint(self, input_fingerprints, verify_hash=False):
+        """
+        hash of everything that decides the stage output
+            Args:
+                input_fingerprints: the fingerprints of the input stages, in order
+                verify_hash: fingerprint the source files by content instead of size and modification time
+            Returns: hex digest
+        """
+        digest = hashlib.sha256()
+        digest.update(self.name.encode())
+        digest.update(inspect.getsource(self.function).encode())
+        for module in self.modules:
+            digest.update(inspect.getsource(module).encode())
+        digest.update(repr(sorted(self.params.items())).encode())
+        for input_fingerprint in input_fingerprints:
+            digest.update(input_fingerprint.encode())
+        for source_file in self.source_files:
+            if not os.path.exists(source_file):
+                digest.update(f"{source_file} missing".encode())
+            elif verify_hash:
+                digest.update(_file_hash(source_file).encode())
+            else:
+                stat = os.stat(source_file)
+                digest.update(f"{source_file} {stat.st_size} {stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+
+def _artifact_path(stage_name, fingerprint, cache_dir):
+    return os.path.join(cache_dir, f"{stage_name}-{fingerprint[:20]}.pkl")
+
+
+def _save_artifact(stage_name, fingerprint, output, cache_dir, keep):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _artifact_path(stage_name, fingerprint, cache_dir)
+    # write then rename so an interrupted run never leaves a truncated artifact behind
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    old_paths = sorted(glob.glob(os.path.join(cache_dir, f"{stage_name}-*.pkl")), key=os.path.getmtime)
+    for old_path in old_paths[:-keep]:
+        os.remove(old_path)
+
+
+def _load_artifact(stage_name, fingerprint, cache_dir):
+    path = _artifact_path(stage_name, fingerprint, cache_dir)
+    with open(path, 'rb') as f:
+        output = pickle.load(f)
+    # touch so the artifacts in use are the last ones pruned
+    os.utime(path)
+    return output
+
+
+def _run_stage(stage, inputs):
+    with profiling.stage(f"pipeline {stage.name}") as timed:
+        output = stage.function(*inputs, **stage.params, **stage.options)
+        timed.rows = len(output) if isinstance(output, (pd.DataFrame, pd.Series)) else None
+    return output
+
+
+def run_pipeline(stages, targets=None, cache_dir=PIPELINE_CACHE_DIR, workers=PIPELINE_WORKERS, force=False,
+                 verify_hash=False, keep=KEEP_ARTIFACTS):
+    """
+    runs the stages that are out of date and returns the outputs of the target stages
+        Args:
+            stages: list of Stage, every input must name an earlier stage
+            targets: names of the stages whose outputs are wanted, None for the last stage
+            cache_dir: directory of the cached stage outputs
+            workers: the most stages run at the same time
+            force: rerun every stage the targets depend on
+            verify_hash: fingerprint the data files by content instead of size and modification time
+            keep: the number of cached outputs kept per stage
+        Returns:
+            outputs: dict of target name -> output
+            run_stages: names of the stages that were executed, in the order they finished
+    """
+    by_name = {}
+    fingerprints = {}
+    for stage in stages:
+        unknown = [name for name in stage.inputs if name not in by_name]
+        if unknown:
+            raise ValueError(f"stage {stage.name} reads from {unknown}, which are not earlier stages")
+        by_name[stage.name] = stage
+        fingerprints[stage.name] = stage.fingerprint([fingerprints[name] for name in stage.inputs],
+                                                     verify_hash=verify_hash)
+    targets = [stages[-1].name] if targets is None else list(targets)
+
+    def is_fresh(stage):
+        return (not force and os.path.exists(_artifact_path(stage.name, fingerprints[stage.name], cache_dir))
+                and all(os.path.exists(output_file) for output_file in stage.output_files))
+
+    # walk back from the targets: a fresh stage is read from the cache and its inputs are not needed at all
+    to_run, to_load = set(), set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name in to_run or name in to_load:
+            continue
+        if is_fresh(by_name[name]):
+            to_load.add(name)
+        else:
+            to_run.add(name)
+            pending.extend(by_name[name].inputs)
+
+    with profiling.stage('pipeline cached outputs', rows=len(to_load)):
+        results = {name: _load_artifact(name, fingerprints[name], cache_dir) for name in to_load}
+    run_stages = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        running = {}
+        waiting = [stage for stage in stages if stage.name in to_run]
+        while waiting or running:
+            for stage in [stage for stage in waiting if all(name in results for name in stage.inputs)]:
+                waiting.remove(stage)
+                running[pool.submit(_run_stage, stage, [results[name] for name in stage.inputs])] = stage
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+                _save_artifact(stage.name, fingerprints[stage.name], results[stage.name], cache_dir, keep)
+                run_stages.append(stage.name)
+    return {name: results[name] for name in targets}, run_stages
+
+
+# the project stages
+
+def load_stage(years, current_year, **load_options):
+    """
+    reads the open and closed street light and safety related requests, every other service is filtered out
+    as the files are read
+    """
+    service_names = [STREET_LIGHT_SERVICE] + SAFETY_SERVICE_NAMES
+    return {'open': read_open_requests(service_names=service_names, **load_options),
+            'closed': read_closed_requests(list(years) + [current_year], service_names=service_names,
+                                           **load_options)}
+
+
+def filter_stage(loaded, years, current_year):
+    """
+    splits the loaded requests into open street lights, historic street light closures and safety reports
+    """
+    def street_lights(df):
+        keep = df['service_name'].eq(STREET_LIGHT_SERVICE) & ~df['status'].eq(REFERRED_STATUS)
+        return df[keep].reset_index(drop=True)
+    open_requests, closed_requests = loaded['open'], loaded['closed']
+    safety_reports = concat_requests([open_requests[open_requests['service_name'].isin(SAFETY_SERVICE_NAMES)].copy(),
+                                      closed_requests[closed_requests['year'].eq(current_year)
+                                                      & closed_requests['service_name'].isin(SAFETY_SERVICE_NAMES)].copy()])
+    return {'open_lights': street_lights(open_requests),
+            'historic_lights': street_lights(closed_requests[closed_requests['year'].isin(years)]),
+            'safety_reports': safety_reports}
+
+
+def zone_tag_stage(filtered, zone_file):
+    """
+    the Promise Zone name of every open street light request, 'Rest of City' outside it
+    """
+    open_lights = filtered['open_lights'][['lat', 'lng']]
+    return find_points_in_zone(open_lights, zone_file)['name'].fillna(value='Rest of City')
+
+
+def safety_count_stage(filtered, radius, units):
+    """
+    the number of safety related requests near and after every open street light request
+    """
+    open_lights = filtered['open_lights'][['lat', 'lng', 'date_requested', 'service_name_detail']].copy()
+    return add_safety_counts(open_lights, filtered['safety_reports'], radius=radius,
+                             units=units)['number_safety_related_near']
+
+
+def aggregate_stage(filtered, labels):
+    """
+    historic repair time statistics by council district, zip code and community
+    """
+    return aggregate(filtered['historic_lights'], 'case_age_days',
+                     {'district':['council_district'], 'zipcode':['zipcode'], 'community':['comm_plan_name']},
+                     labels=labels)
+
+
+def crime_count_stage(filtered, crime_file):
+    """
+    the number of nighttime crimes on the block of every open street light request after it was reported
+    """
+    open_lights = filtered['open_lights'][['street_address', 'date_requested', 'service_name_detail']].copy()
+    return add_crime_counts(open_lights, read_crime_data(crime_file))['number_night_crimes_on_block']
+
+
+def factorize_stage(filtered, zone_names, safety_counts_near, historic_tables, crime_counts_near=None, min_count=None):
+    """
+    the open street light requests with every weighting factor, the crime factor only if the crimes were counted
+    """
+    open_lights = filtered['open_lights'].copy()
+    open_lights['name'] = zone_names
+    open_lights['number_safety_related_near'] = safety_counts_near
+    district_data, zipcode_data, community_data = historic_factor_tables(historic_tables, min_count=min_count)
+    open_lights = add_weighting_factors(open_lights, district_data, zipcode_data, community_data)
+    if crime_counts_near is not None:
+        open_lights['number_night_crimes_on_block'] = crime_counts_near
+        open_lights['crime_weighting_factor'] = min_max_scale(open_lights['number_night_crimes_on_block'])
+    return open_lights
+
+
+def score_stage(factorized, weights, k):
+    """
+    the open requests in priority order
+    """
+    return prioritize(factorized, dict(weights), k=k)
+
+
+def report_stage(prioritized, output_file, columns):
+    """
+    writes the prioritized requests
+    """
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    prioritized[list(columns)].to_csv(output_file, index=False)
+    return output_file
+
+
+def project_stages(years=HISTORIC_YEARS, current_year=CURRENT_YEAR, radius=SAFETY_RADIUS,
+                   units=SAFETY_RADIUS_UNITS, weights=None, k=None, output_file=PRIORITIZED_REQUESTS_FILE,
+                   load_options=None):
+    """
+    the stages of the project from the raw csv files to the prioritized requests
+        Args:
+            years: the historic years of closed requests
+            current_year: the year of recent closures used for the safety counts
+            radius, units: the safety count search radius
+            weights: dict of factor column -> weight, DEFAULT_WEIGHTS if not given, a crime_weighting_factor
+                weight adds a crime_count stage reading the ARJIS crime extract
+            k: the number of requests to report, None for all of them
+            output_file: the csv the report stage writes
+            load_options: streaming / chunking options passed on to the loaders
+        Returns: list of Stage
+    """
+    years = tuple(years)
+    weights = weights or DEFAULT_WEIGHTS
+    use_crime_data = bool(weights.get('crime_weighting_factor'))
+    source_files = ([data_loading.OPEN_REQUESTS_FILE]
+                    + [closed_requests_file(year) for year in years + (current_year,)])
+    stages = [
+        Stage('load', load_stage, params={'years': years, 'current_year': current_year},
+              options=load_options, modules=[data_loading], source_files=source_files),
+        Stage('filter', filter_stage, ['load'], params={'years': years, 'current_year': current_year}),
+        Stage('zone_tag', zone_tag_stage, ['filter'], params={'zone_file': PROMISE_ZONE_FILE},
+              modules=[zone_tagging], source_files=[PROMISE_ZONE_FILE]),
+        Stage('safety_count', safety_count_stage, ['filter'], params={'radius': radius, 'units': units},
+              modules=[safety_counts, neighbor_query]),
+        Stage('aggregate', aggregate_stage, ['filter'],
+              params={'labels': {'median':'Median Time to Repair', 'count':'Count'}}, modules=[aggregation]),
+    ]
+    factor_inputs = ['filter', 'zone_tag', 'safety_count', 'aggregate']
+    output_columns = list(OUTPUT_COLUMNS)
+    if use_crime_data:
+        stages.append(Stage('crime_count', crime_count_stage, ['filter'], params={'crime_file': CRIME_FILE},
+                            modules=[crime_counts, address_matching], source_files=[CRIME_FILE]))
+        factor_inputs.append('crime_count')
+        output_columns[-1:-1] = ['number_night_crimes_on_block', 'crime_weighting_factor']
+    return stages + [
+        Stage('factorize', factorize_stage, factor_inputs, params={'min_count': scoring.MIN_HISTORIC_REPAIRS},
+              modules=[scoring]),
+        Stage('score', score_stage, ['factorize'], params={'weights': tuple(sorted(weights.items())), 'k': k},
+              modules=[scoring]),
+        Stage('report', report_stage, ['score'], params={'output_file': output_file, 'columns': tuple(output_columns)},
+              output_files=[output_file]),
+    ]
+
+
+if __name__ == "__main__":
+    arg_list = sys.argv[1:]
+    if "profile" in arg_list:
+        profiling.enable_profiling()
+    weights = read_weights('weighting_matrix.csv') if "weighting_matrix.csv" in arg_list else None
+    radius_arg = [arg for arg in arg_list if arg.startswith('radius=')]
+    top_arg = [arg for arg in arg_list if arg.startswith('top=')]
+    stages = project_stages(radius=float(radius_arg[0].split('=',1)[1]) if radius_arg else SAFETY_RADIUS,
+                            weights=weights, k=int(top_arg[0].split('=',1)[1]) if top_arg else None,
+                            load_options=load_options_from_args(arg_list))
+    start = time.perf_counter()
+    outputs, run_stages = run_pipeline(stages, force="force" in arg_list)
+    print(f"Wrote {outputs['report']} in {time.perf_counter() - start:.1f}s, "
+          f"ran stages: {', '.join(run_stages) or 'none (all cached)'}")
+    profiling.write_report()
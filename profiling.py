@@ -0,0 +1,248 @@
+"""
+Opt-in timing and memory instrumentation of the project scripts.
+
+Nothing is recorded until enable_profiling() is called (the scripts do this when given the profile argument),
+so the hooks below cost one flag check when profiling is off. When on:
+    - stage(name) is a context manager and profiled() a decorator, both record wall time, CPU time of the
+      process (all threads), peak resident memory and a row count for every call
+    - Progress reports long loops at most every few seconds with rows/s and an ETA
+    - write_report() writes everything as a Chrome trace (open it in chrome://tracing or Perfetto) whose
+      summary section has the totals per stage / function
+Peak memory comes from a sampling thread reading the resident size of the process (every SAMPLE_INTERVAL
+seconds), so work done in the loader's or renderer's worker processes shows up in their stage's time only.
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_REPORT_FILE = 'profile_report.json'
+# seconds between resident memory samples
+SAMPLE_INTERVAL = 0.05
+# seconds between progress lines
+PROGRESS_INTERVAL = 5.0
+
+_enabled = False
+_records = []
+_open_records = []
+_lock = threading.Lock()
+_sampler = None
+_start_time = time.perf_counter()
+
+
+def _rss_mb():
+    """
+    the current resident size of this process, falls back to the peak so far where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0.0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+class _MemorySampler(threading.Thread):
+    """
+    background thread that raises the peak memory of every open stage to the current resident size
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            rss = _rss_mb()
+            with _lock:
+                for record in _open_records:
+                    record['peak_rss_mb'] = max(record['peak_rss_mb'], rss)
+
+
+def enable_profiling():
+    """
+    starts recording stages, functions and progress
+    """
+    global _enabled, _sampler, _start_time
+    if _enabled:
+        return
+    _enabled = True
+    _start_time = time.perf_counter()
+    _sampler = _MemorySampler()
+    _sampler.start()
+
+
+def profiling_enabled():
+    return _enabled
+
+
+class _Stage:
+    """
+    the record of one timed block, set .rows inside the block to report how many rows it handled
+    """
+
+    def __init__(self, name, category, rows):
+        self.name = name
+        self.category = category
+        self.rows = rows
+        self.record = None
+
+    def __enter__(self):
+        if _enabled:
+            rss = _rss_mb()
+            self.record = {'name': self.name, 'category': self.category, 'thread': threading.get_ident(),
+                           'start': time.perf_counter() - _start_time, 'start_rss_mb': rss, 'peak_rss_mb': rss,
+                           '_cpu': time.process_time()}
+            with _lock:
+                _open_records.append(self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.record is None:
+            return False
+        record = self.record
+        record['cpu_seconds'] = time.process_time() - record.pop('_cpu')
+        record['wall_seconds'] = time.perf_counter() - _start_time - record['start']
+        rss = _rss_mb()
+        record['end_rss_mb'] = rss
+        record['rows'] = self.rows
+        with _lock:
+            _open_records.remove(record)
+            record['peak_rss_mb'] = max(record['peak_rss_mb'], rss)
+            _records.append(record)
+        return False
+
+
+def stage(name, rows=None):
+    """
+    times a block of a script
+        Args:
+            name: the stage name in the report
+            rows: the number of rows handled, can also be set on the returned object inside the block
+        Returns: a context manager
+    """
+    return _Stage(name, 'stage', rows)
+
+
+def profiled(function=None, name=None):
+    """
+    decorator that times every call of a function, the row count is the length of what it returns
+        Args:
+            function: the decorated function
+            name: the name in the report, the function's module.name if not given
+    """
+    if function is None:
+        return functools.partial(profiled, name=name)
+    label = name or f"{function.__module__}.{function.__qualname__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        with _Stage(label, 'function', None) as timed:
+            result = function(*args, **kwargs)
+            rows = result[0] if isinstance(result, tuple) and result else result
+            timed.rows = len(rows) if hasattr(rows, '__len__') and not isinstance(rows, (str, dict)) else None
+        return result
+    return wrapper
+
+
+class Progress:
+    """
+    throttled progress of a long loop, prints at most once every interval seconds and only when profiling
+        Args:
+            total: the number of rows the loop will handle, None if not known
+            label: what is being counted
+            interval: the least seconds between two progress lines
+    """
+
+    def __init__(self, total=None, label='rows', interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, rows=1):
+        """
+        counts rows as done and reports if the interval has passed
+        """
+        self.done += rows
+        if not _enabled:
+            return
+        now = time.perf_counter()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        rate = self.done / max(now - self.start, 1e-9)
+        if self.total:
+            eta = (self.total - self.done) / rate if rate > 0 else float('inf')
+            print(f"{self.label}: {self.done}/{self.total} ({self.done / self.total:.0%}), {rate:,.0f}/s, "
+                  f"ETA {eta // 60:.0f}m{eta % 60:02.0f}s", file=sys.stderr, flush=True)
+        else:
+            print(f"{self.label}: {self.done}, {rate:,.0f}/s", file=sys.stderr, flush=True)
+
+
+def summary():
+    """
+    totals of the recorded stages and functions
+        Returns: list of dicts with name, category, calls, wall/cpu seconds, the highest peak memory and rows
+    """
+    totals = {}
+    with _lock:
+        records = list(_records)
+    for record in records:
+        total = totals.setdefault((record['category'], record['name']),
+                                  {'name': record['name'], 'category': record['category'], 'calls': 0,
+                                   'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_mb': 0.0, 'rows': None})
+        total['calls'] += 1
+        total['wall_seconds'] += record['wall_seconds']
+        total['cpu_seconds'] += record['cpu_seconds']
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+        if record['rows'] is not None:
+            total['rows'] = (total['rows'] or 0) + record['rows']
+    return sorted(totals.values(), key=lambda total: -total['wall_seconds'])
+
+
+def write_report(file_name=PROFILE_REPORT_FILE):
+    """
+    writes the recorded stages as a Chrome trace with a summary section and prints the summary
+        Args:
+            file_name: path of the json report
+        Returns: the path, None when profiling is off
+    """
+    if not _enabled:
+        return None
+    with _lock:
+        records = sorted(_records, key=lambda record: record['start'])
+    events = [{'name': record['name'], 'cat': record['category'], 'ph': 'X', 'pid': os.getpid(),
+               'tid': record['thread'], 'ts': record['start'] * 1e6, 'dur': record['wall_seconds'] * 1e6,
+               'args': {'cpu_seconds': record['cpu_seconds'], 'peak_rss_mb': record['peak_rss_mb'],
+                        'rss_change_mb': record['end_rss_mb'] - record['start_rss_mb'], 'rows': record['rows']}}
+              for record in records]
+    # resident memory at the start and end of every record as a counter track
+    events += [{'name': 'resident memory', 'ph': 'C', 'pid': os.getpid(), 'ts': seconds * 1e6, 'args': {'MB': rss}}
+               for record in records
+               for seconds, rss in ((record['start'], record['start_rss_mb']),
+                                    (record['start'] + record['wall_seconds'], record['end_rss_mb']))]
+    totals = summary()
+    os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+    with open(file_name, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'summary': totals,
+                   'otherData': {'command': ' '.join(sys.argv), 'wall_seconds': time.perf_counter() - _start_time}},
+                  f, indent=1)
+    for total in totals:
+        rows = f", {total['rows']:,} rows" if total['rows'] is not None else ''
+        print(f"{total['name']:<45} {total['calls']:4d}x {total['wall_seconds']:8.2f}s wall "
+              f"{total['cpu_seconds']:8.2f}s cpu {total['peak_rss_mb']:8.0f}MB peak{rows}")
+    return file_name
@@ -0,0 +1,289 @@
+"""
+Mergeable quantile sketches of repair times, stored per year and grouping key.
+
+The sketch is a DDSketch style log bucketed histogram. A value x > 0 goes in bucket ceil(log(x)/log(gamma))
+with gamma = (1 + alpha)/(1 - alpha), so every quantile it returns is within a relative error of alpha of
+a value at that rank in the data (alpha = 0.01 gives medians within 1%, about a day at 100 days). Zeros and
+negative values are kept in their own counts/buckets. Merging two sketches just adds bucket counts, so a
+multi-year median is a merge of the stored yearly sketches and a new year of closures only needs the new
+file to be read. With exact=True a sketch keeps the raw values instead and gives exact answers.
+
+Each stored year records the size and modification time of the closed request file it came from, the key
+columns, value column and sketch settings, and the filters it was read with, as the Parquet cache of
+data_loading.py does, and a year is sketched again when any of them changes.
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loading import closed_requests_file, read_street_light_requests
+
+DEFAULT_ALPHA = 0.01
+SKETCH_STORE_FILE = 'data/repair_time_sketches.json'
+# loader options that change how the files are read but not which rows come back
+READ_OPTIONS = {'use_cache', 'verify_hash', 'streaming', 'chunk_rows', 'memory_limit_mb', 'compact', 'workers'}
+
+
+class QuantileSketch:
+    """
+    a mergeable sketch of a distribution of values
+        Args:
+            alpha: the relative accuracy of the quantiles
+            exact: keep every value and answer exactly instead of sketching
+    """
+
+    def __init__(self, alpha=DEFAULT_ALPHA, exact=False):
+        self.alpha = alpha
+        self.exact = exact
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.zero_count = 0
+        self.positive = {}
+        self.negative = {}
+        self.values = np.zeros(0)
+
+    def _bucket_indices(self, values):
+        return np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+
+    @staticmethod
+    def _add_counts(store, indices):
+        buckets, counts = np.unique(indices, return_counts=True)
+        for bucket, count in zip(buckets.tolist(), counts.tolist()):
+            store[bucket] = store.get(bucket, 0) + count
+
+    def add(self, values):
+        """
+        adds an array of values to the sketch, nans are ignored
+            Args:
+                values: array like of values
+            Returns: the sketch
+        """
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        if self.exact:
+            self.values = np.concatenate([self.values, values])
+            return self
+        self.zero_count += int(np.count_nonzero(values == 0))
+        self._add_counts(self.positive, self._bucket_indices(values[values > 0]))
+        self._add_counts(self.negative, self._bucket_indices(-values[values < 0]))
+        return self
+
+    def merge(self, other):
+        """
+        adds another sketch with the same settings into this one
+            Args:
+                other: a QuantileSketch
+            Returns: the sketch
+        """
+        if (other.alpha, other.exact) != (self.alpha, self.exact):
+            raise ValueError("only sketches with the same alpha and exact setting can be merged")
+        self.count += other.count
+        if self.exact:
+            self.values = np.concatenate([self.values, other.values])
+            return self
+        self.zero_count += other.zero_count
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for bucket, count in other_store.items():
+                store[bucket] = store.get(bucket, 0) + count
+        return self
+
+    def quantile(self, q):
+        """
+        estimates a quantile of the values added so far
+        the sketch answers with the bucket of the value at rank floor(q * (count - 1)), so the median of an even
+        number of values is the lower middle value's bucket, not the average of the two middle values that the
+        exact path (np.quantile) and groupby give
+            Args:
+                q: the quantile, between 0 and 1
+            Returns: the estimate, nan for an empty sketch
+        """
+        if self.count == 0:
+            return np.nan
+        if self.exact:
+            return float(np.quantile(self.values, q))
+        # buckets in increasing order of value, each represented by the value with the least relative error
+        negative_buckets = sorted(self.negative, reverse=True)
+        positive_buckets = sorted(self.positive)
+        representatives = ([-2 * self.gamma ** b / (self.gamma + 1) for b in negative_buckets] + [0.0]
+                           + [2 * self.gamma ** b / (self.gamma + 1) for b in positive_buckets])
+        counts = ([self.negative[b] for b in negative_buckets] + [self.zero_count]
+                  + [self.positive[b] for b in positive_buckets])
+        rank = q * (self.count - 1)
+        position = int(np.searchsorted(np.cumsum(counts), rank, side='right'))
+        return representatives[min(position, len(representatives) - 1)]
+
+    def to_dict(self):
+        if self.exact:
+            return {'alpha': self.alpha, 'exact': True, 'values': self.values.tolist()}
+        return {'alpha': self.alpha, 'exact': False, 'count': self.count, 'zero_count': self.zero_count,
+                'positive': [[b, c] for b, c in self.positive.items()],
+                'negative': [[b, c] for b, c in self.negative.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(alpha=data['alpha'], exact=data['exact'])
+        if sketch.exact:
+            return sketch.add(data['values'])
+        sketch.count = data['count']
+        sketch.zero_count = data['zero_count']
+        sketch.positive = {b: c for b, c in data['positive']}
+        sketch.negative = {b: c for b, c in data['negative']}
+        return sketch
+
+
+def build_sketches(df, value_column, key_columns, alpha=DEFAULT_ALPHA, exact=False):
+    """
+    sketches the values of every group of a dataframe
+        Args:
+            df: the dataframe
+            value_column: the column to sketch
+            key_columns: the columns that make up the group key
+            alpha: the relative accuracy of the sketches
+            exact: keep the raw values instead of sketching
+        Returns: dict of group key tuple -> QuantileSketch, groups with a missing key are left out
+    """
+    sketches = {}
+    for keys, group in df.groupby(list(key_columns), observed=True)[value_column]:
+        # plain python keys so the store can be written as json
+        keys = tuple(key.item() if hasattr(key, 'item') else key for key in (keys if isinstance(keys, tuple) else (keys,)))
+        sketches[keys] = QuantileSketch(alpha, exact).add(group.to_numpy())
+    return sketches
+
+
+def sketch_settings(year, key_columns, value_column='case_age_days', alpha=DEFAULT_ALPHA, exact=False, **kwargs):
+    """
+    what a stored year of sketches depends on: its source file's size and modification time, the key and
+    value columns, the sketch settings and the filters the closures were read with
+        Args:
+            year: the year of closures
+            key_columns: the columns that make up the group key
+            value_column: the sketched column
+            alpha: the relative accuracy of the sketches
+            exact: whether the raw values are kept
+            kwargs: the options passed on to read_street_light_requests, READ_OPTIONS are left out
+        Returns: a json ready dict, equal to the one stored for the year if the stored sketches are current
+    """
+    source = closed_requests_file(year)
+    stat = os.stat(source) if os.path.exists(source) else None
+    settings = {'source': source, 'size': stat and stat.st_size, 'mtime_ns': stat and stat.st_mtime_ns,
+                'key_columns': list(key_columns), 'value_column': value_column, 'alpha': alpha, 'exact': exact,
+                'filters': {name: value for name, value in sorted(kwargs.items()) if name not in READ_OPTIONS}}
+    # round tripped so it compares equal to the settings read back from the store
+    return json.loads(json.dumps(settings, default=str))
+
+
+def load_sketch_store(store_file=SKETCH_STORE_FILE):
+    """
+    reads stored sketches
+        Args:
+            store_file: path of the json store
+        Returns:
+            store: dict of grouping name -> year -> group key tuple -> QuantileSketch
+            settings: dict of grouping name -> year -> the sketch_settings the year was built with, a store
+                written before the settings were recorded has none, so all its years are sketched again
+    """
+    if not os.path.exists(store_file):
+        return {}, {}
+    with open(store_file) as f:
+        contents = json.load(f)
+    if isinstance(contents, list):
+        contents = {'sketches': contents, 'settings': []}
+    store = {}
+    for entry in contents['sketches']:
+        year_sketches = store.setdefault(entry['grouping'], {}).setdefault(entry['year'], {})
+        year_sketches[tuple(entry['keys'])] = QuantileSketch.from_dict(entry['sketch'])
+    settings = {}
+    for entry in contents['settings']:
+        settings.setdefault(entry['grouping'], {})[entry['year']] = entry['settings']
+    return store, settings
+
+
+def save_sketch_store(store, settings, store_file=SKETCH_STORE_FILE):
+    """
+    writes sketches to the json store
+        Args:
+            store: dict of grouping name -> year -> group key tuple -> QuantileSketch
+            settings: dict of grouping name -> year -> the sketch_settings the year was built with
+            store_file: path of the json store
+    """
+    contents = {'settings': [{'grouping': grouping, 'year': int(year), 'settings': year_settings}
+                             for grouping, years in settings.items() for year, year_settings in years.items()],
+                'sketches': [{'grouping': grouping, 'year': int(year), 'keys': list(keys), 'sketch': sketch.to_dict()}
+                             for grouping, years in store.items() for year, sketches in years.items()
+                             for keys, sketch in sketches.items()]}
+    with open(store_file, 'w') as f:
+        json.dump(contents, f)
+
+
+def update_sketch_store(year_list, groupings, value_column='case_age_days', store_file=SKETCH_STORE_FILE,
+                        alpha=DEFAULT_ALPHA, exact=False, **kwargs):
+    """
+    adds sketches for the years that are not in the store yet or are out of date, reading only those years'
+    street light closures. a year is out of date when its closed request file changed size or modification time,
+    or the key columns, value column, alpha, exact or filters differ from the ones it was sketched with
+        Args:
+            year_list: the years that should be in the store
+            groupings: dict of grouping name -> list of key columns
+            value_column: the column to sketch
+            store_file: path of the json store
+            alpha: the relative accuracy of the sketches
+            exact: keep the raw values instead of sketching
+            kwargs: passed on to read_street_light_requests
+        Returns: the updated store
+    """
+    store, stored_settings = load_sketch_store(store_file)
+    # taken before reading, so a file that changes while it is read is sketched again next time
+    wanted = {grouping: {year: sketch_settings(year, key_columns, value_column, alpha=alpha, exact=exact, **kwargs)
+                         for year in year_list}
+              for grouping, key_columns in groupings.items()}
+    # a year needs sketching if it is not stored, or was stored from another file or with other settings
+    missing_years = sorted({year for year in year_list for grouping in groupings
+                            if year not in store.get(grouping, {})
+                            or stored_settings.get(grouping, {}).get(year) != wanted[grouping][year]})
+    if not missing_years:
+        return store
+    new_data = read_street_light_requests(missing_years, **kwargs)
+    for year in missing_years:
+        year_data = new_data[new_data['year'].eq(year)]
+        for grouping, key_columns in groupings.items():
+            store.setdefault(grouping, {})[year] = build_sketches(year_data, value_column, key_columns,
+                                                                  alpha=alpha, exact=exact)
+            stored_settings.setdefault(grouping, {})[year] = wanted[grouping][year]
+    save_sketch_store(store, stored_settings, store_file)
+    return store
+
+
+def sketch_table(store, grouping, key_columns, year_list, quantiles=(0.5,), labels=None):
+    """
+    merges the stored yearly sketches of a grouping into a table of counts and quantiles
+        Args:
+            store: dict of grouping name -> year -> group key tuple -> QuantileSketch
+            grouping: the grouping name
+            key_columns: names for the parts of the group key
+            year_list: the years to merge
+            quantiles: the quantiles to report, 0.5 is reported as median and others as e.g. p90
+            labels: optional dict renaming columns, as in aggregation.aggregate
+        Returns: a tidy dataframe with the key columns, count and one column per quantile
+    """
+    merged = {}
+    for year in year_list:
+        for keys, sketch in store[grouping][year].items():
+            if keys not in merged:
+                merged[keys] = QuantileSketch(sketch.alpha, sketch.exact)
+            merged[keys].merge(sketch)
+    rows = []
+    for keys in sorted(merged):
+        row = dict(zip(key_columns, keys))
+        for q in quantiles:
+            row['median' if q == 0.5 else f"p{round(q * 100)}"] = merged[keys].quantile(q)
+        row['count'] = merged[keys].count
+        rows.append(row)
+    table = pd.DataFrame(rows, columns=list(key_columns)
+                         + ['median' if q == 0.5 else f"p{round(q * 100)}" for q in quantiles] + ['count'])
+    return table.rename(columns=labels) if labels else table
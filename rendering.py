@@ -0,0 +1,169 @@
+"""
+Headless, parallel rendering of the project graphs with change detection.
+
+Figures are described as jobs (a drawing function, its data and its output files) and rendered with the
+non-interactive Agg backend in a process pool, so a batch run never blocks on plt.show() and takes about
+as long as the slowest figure. Each job is fingerprinted from its data, arguments and the source of its
+drawing function; a job whose fingerprint matches the last render and whose files exist is skipped.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+GRAPH_DIR = 'graphs'
+RENDER_MANIFEST_FILE = os.path.join(GRAPH_DIR, 'render_manifest.json')
+# default number of processes used to render, None means one per core
+RENDER_WORKERS = None
+SAVE_OPTIONS = {'transparent':False, 'dpi':80, 'bbox_inches':"tight"}
+
+
+class FigureJob:
+    """
+    one figure to render
+        Args:
+            function: a module level drawing function taking output_files as its first argument
+            output_files: the files the function writes
+            kwargs: the data and settings passed to the function
+    """
+
+    def __init__(self, function, output_files, **kwargs):
+        self.function = function
+        self.output_files = [output_files] if isinstance(output_files, str) else list(output_files)
+        self.kwargs = kwargs
+
+    def fingerprint(self):
+        """
+        hash of the drawing code, the output files and every argument, data included
+        """
+        digest = hashlib.sha256()
+        digest.update(inspect.getsource(self.function).encode())
+        digest.update(repr(self.output_files).encode())
+        for name in sorted(self.kwargs):
+            digest.update(name.encode())
+            value = self.kwargs[name]
+            if isinstance(value, (pd.DataFrame, pd.Series)):
+                digest.update(repr(value.columns if isinstance(value, pd.DataFrame) else value.name).encode())
+                digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+            elif isinstance(value, np.ndarray):
+                digest.update(np.ascontiguousarray(value).tobytes())
+            else:
+                digest.update(repr(value).encode())
+        return digest.hexdigest()
+
+
+def _run_job(function, output_files, kwargs):
+    function(output_files, **kwargs)
+    plt.close('all')
+
+
+@profiled
+def render_figures(jobs, workers=RENDER_WORKERS, manifest_file=RENDER_MANIFEST_FILE, force=False):
+    """
+    renders the figures whose data changed since the last render
+        Args:
+            jobs: list of FigureJob
+            workers: number of processes to render with, None for one per core, 1 to render in this process
+            manifest_file: json file of the fingerprints of the last render
+            force: render every job even if it is unchanged
+        Returns: list of the output files that were rendered
+    """
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    fingerprints = [job.fingerprint() for job in jobs]
+    stale = [(job, fingerprint) for job, fingerprint in zip(jobs, fingerprints)
+             if force or any(manifest.get(output_file) != fingerprint or not os.path.exists(output_file)
+                             for output_file in job.output_files)]
+    workers = min(workers or os.cpu_count() or 1, len(stale))
+    if workers <= 1:
+        for job, _ in stale:
+            _run_job(job.function, job.output_files, job.kwargs)
+    elif stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # list() so an error in any figure is raised here
+            list(pool.map(_run_job, *zip(*[(job.function, job.output_files, job.kwargs) for job, _ in stale])))
+    for job, fingerprint in stale:
+        manifest.update({output_file: fingerprint for output_file in job.output_files})
+    os.makedirs(os.path.dirname(manifest_file) or '.', exist_ok=True)
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return [output_file for job, _ in stale for output_file in job.output_files]
+
+
+# drawing functions, each one makes a single figure and saves it to its output files
+
+def histogram_figure(output_files, values, bins, xlabel, ylabel, figsize, xlim=None):
+    """
+    histogram of values, if xlim is given the second output file is a zoomed in copy
+    """
+    fig, ax = plt.subplots(figsize=figsize)
+    ax.hist(values, bins=bins)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.savefig(output_files[0], **SAVE_OPTIONS)
+    if xlim is not None:
+        plt.axis(xmin=xlim[0], xmax=xlim[1])
+        plt.savefig(output_files[1], **SAVE_OPTIONS)
+
+
+def points_figure(output_files, x, y, xlabel, ylabel, style='bo', figsize=(6,6), title=None):
+    """
+    x vs y as unconnected points
+    """
+    fig, ax = plt.subplots(figsize=figsize)
+    plt.plot(x, y, style)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    if title is not None:
+        plt.title(title)
+    plt.savefig(output_files[0], **SAVE_OPTIONS)
+
+
+def lines_figure(output_files, data, xlabel, ylabel, figsize=(10,5), xticks=None, ymin=None, legend_title=None,
+                 legend=True, color=None):
+    """
+    one line per column of data against its index
+    """
+    fig, ax = plt.subplots(figsize=figsize)
+    if color is None:
+        plt.plot(data, label=data.columns)
+    else:
+        plt.plot(data, color=color)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    if ymin is not None:
+        plt.axis(ymin=ymin)
+    if xticks is not None:
+        ax.set_xticks(xticks, minor=False)
+    if legend:
+        plt.legend(title=legend_title)
+    plt.savefig(output_files[0], **SAVE_OPTIONS)
+
+
+def flow_figure(output_files, requests_per_year, repairs_per_year, xticks):
+    """
+    requests filed per year and repairs completed per year on twin axes
+    """
+    fig, ax = plt.subplots(figsize=(6,5))
+    plt.plot(requests_per_year.index, requests_per_year.to_numpy(), color='tab:blue')
+    plt.xlabel('Year')
+    plt.ylabel('Number of repair requests', color='tab:blue')
+    plt.axis(ymin=0)
+    ax.set_xticks(xticks, minor=False)
+    ax2 = ax.twinx()
+    ax2.plot(repairs_per_year.index, repairs_per_year.to_numpy(), color='tab:red')
+    ax2.set_ylabel('Number of repairs completed', color='tab:red')
+    ax2.axis(ymin=0)
+    plt.savefig(output_files[0], **SAVE_OPTIONS)
@@ -0,0 +1,228 @@
+"""
+Indexed spatio-temporal counting of safety related requests near open street light requests.
+
+Replaces the per light loop in distance_filtering.py. The safety reports are sorted by date once so the
+"requested after the light broke" condition becomes an index cutoff, and a NeighborIndex over the projected
+report locations answers the radius query (in feet or meters) for all the lights at once.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+from neighbor_query import NeighborIndex, project_lat_lng, to_meters
+from profiling import Progress, profiled
+
+# service names counted as safety related
+SAFETY_SERVICE_NAMES = ['Graffiti - Code Enforcement', 'Illegal Dumping', 'Graffiti', 'Encampment', 'Homeless Outreach']
+# street light issues where the light is actually dark, only these keep a safety count
+LIGHT_OUT_DETAILS = ['STREET LIGHT OUT', 'POLE KNOCK OVER/DAMAGE']
+# search radius around a broken light
+SAFETY_RADIUS = 150
+SAFETY_RADIUS_UNITS = 'ft'
+# state store for incremental updates, prior counts keyed on service_request_id plus a watermark sidecar
+SAFETY_STATE_FILE = 'data/safety_count_state.csv'
+
+
+def _sort_by_date(safety_reports):
+    """
+    drops safety reports without a date and sorts the rest by date_requested
+        Args:
+            safety_reports: dataframe of safety related requests with lat, lng and date_requested columns
+        Returns:
+            lat: float array of latitudes in date order
+            lng: float array of longitudes in date order
+            times: datetime64[ns] array of request dates, sorted
+    """
+    times = pd.to_datetime(safety_reports['date_requested']).to_numpy(dtype='datetime64[ns]')
+    dated = np.flatnonzero(~np.isnat(times))
+    order = dated[np.argsort(times[dated], kind='stable')]
+    return (safety_reports['lat'].to_numpy(dtype='float64')[order],
+            safety_reports['lng'].to_numpy(dtype='float64')[order],
+            times[order])
+
+
+@profiled
+def count_safety_near(lights, safety_reports, radius=SAFETY_RADIUS, units=SAFETY_RADIUS_UNITS):
+    """
+    counts the safety related reports requested within a radius of and after each street light request
+        Args:
+            lights: dataframe of street light requests with lat, lng and date_requested columns
+            safety_reports: dataframe of safety related requests with lat, lng and date_requested columns
+            radius: the search radius
+            units: the units of radius, 'ft' or 'm'
+        Returns:
+            counts: an int64 numpy array aligned with the rows of lights
+    """
+    counts = np.zeros(len(lights), dtype=np.int64)
+    # sort the safety reports by date so "after the light broke" is everything past a cutoff index
+    safety_lat, safety_lng, safety_times = _sort_by_date(safety_reports)
+    if len(safety_times) == 0:
+        return counts
+    safety_index = NeighborIndex(safety_lat, safety_lng)
+
+    light_times = pd.to_datetime(lights['date_requested']).to_numpy(dtype='datetime64[ns]')
+    dated = ~np.isnat(light_times)
+    # position of the first safety report strictly after each light request
+    cutoffs = np.full(len(lights), len(safety_times), dtype=np.int64)
+    cutoffs[dated] = np.searchsorted(safety_times, light_times[dated], side='right')
+
+    light_rows, safety_rows, _ = safety_index.pairs_within(lights['lat'].to_numpy(), lights['lng'].to_numpy(),
+                                                           radius, units=units)
+    after = safety_rows >= cutoffs[light_rows]
+    counts += np.bincount(light_rows[after], minlength=len(lights))
+    return counts
+
+
+def add_safety_counts(lights, safety_reports, radius=SAFETY_RADIUS, units=SAFETY_RADIUS_UNITS, state_file=None):
+    """
+    adds the number_safety_related_near column to a dataframe of street light requests
+        Args:
+            lights: dataframe of street light requests with lat, lng, date_requested and service_name_detail columns
+            safety_reports: dataframe of safety related requests with lat, lng and date_requested columns
+            radius: the search radius
+            units: the units of radius, 'ft' or 'm'
+            state_file: if given, the counts and watermark are saved there so the next update_safety_counts
+                run only counts what is new, lights needs a service_request_id column for this
+        Returns:
+            lights: the input dataframe with number_safety_related_near added
+    """
+    counts = count_safety_near(lights, safety_reports, radius=radius, units=units)
+    if state_file is not None:
+        save_safety_state(pd.Series(counts, index=lights['service_request_id'].to_numpy()),
+                          pd.to_datetime(safety_reports['date_requested']).max(), radius, units, state_file=state_file)
+    lights['number_safety_related_near'] = counts
+    # if the issue with the light is not that it won't come on then zero out the safety count
+    lights.loc[~lights['service_name_detail'].isin(LIGHT_OUT_DETAILS), 'number_safety_related_near'] = 0
+    return lights
+
+
+def _watermark_file(state_file):
+    return os.path.splitext(state_file)[0] + '.json'
+
+
+def load_safety_state(state_file=SAFETY_STATE_FILE):
+    """
+    reads the incremental safety count state store
+        Args:
+            state_file: path of the state csv, the watermark is read from a json file next to it
+        Returns:
+            state: series of raw safety counts indexed by service_request_id, None if there is no usable store
+            settings: dict with the watermark (last processed date_requested) and the radius the counts were made with
+    """
+    if not (os.path.exists(state_file) and os.path.exists(_watermark_file(state_file))):
+        return None, None
+    with open(_watermark_file(state_file)) as f:
+        settings = json.load(f)
+    settings['watermark'] = pd.Timestamp(settings['watermark'])
+    state = pd.read_csv(state_file, index_col='service_request_id')['number_safety_related_near']
+    return state, settings
+
+
+def save_safety_state(state, watermark, radius, units, state_file=SAFETY_STATE_FILE):
+    """
+    writes the incremental safety count state store
+        Args:
+            state: series of raw safety counts indexed by service_request_id
+            watermark: the latest date_requested of the safety reports included in the counts
+            radius: the search radius the counts were made with
+            units: the units of radius
+            state_file: path of the state csv, the watermark is written to a json file next to it
+    """
+    state.rename('number_safety_related_near').rename_axis('service_request_id').to_csv(state_file)
+    with open(_watermark_file(state_file), 'w') as f:
+        json.dump({'watermark': str(watermark), 'radius': radius, 'units': units}, f)
+
+
+def update_safety_counts(lights, safety_reports, state_file=SAFETY_STATE_FILE, radius=SAFETY_RADIUS, units=SAFETY_RADIUS_UNITS):
+    """
+    adds number_safety_related_near to the street light requests reusing the counts from the last run
+    lights already in the state store only get the safety reports requested after the watermark added to
+    their prior count, newly opened lights get a full count, and lights that have closed drop out of the store.
+    a missing store or a change of radius falls back to a full count. safety reports that are published late
+    with a date_requested before the watermark are not picked up until the next full count
+        Args:
+            lights: dataframe of open street light requests with service_request_id, lat, lng, date_requested
+                and service_name_detail columns
+            safety_reports: dataframe of safety related requests with lat, lng and date_requested columns
+            state_file: path of the state csv
+            radius: the search radius
+            units: the units of radius, 'ft' or 'm'
+        Returns:
+            lights: the input dataframe with number_safety_related_near added
+    """
+    state, settings = load_safety_state(state_file)
+    if settings is not None and (settings['radius'], settings['units']) != (radius, units):
+        state, settings = None, None
+    safety_dates = pd.to_datetime(safety_reports['date_requested'])
+
+    counts = np.zeros(len(lights), dtype=np.int64)
+    known = lights['service_request_id'].isin(state.index).to_numpy() if state is not None else np.zeros(len(lights), dtype=bool)
+    if known.any():
+        # only the safety reports that arrived since the last run can change a known light's count
+        new_reports = safety_reports[safety_dates.gt(settings['watermark']).to_numpy()]
+        known_lights = lights[known]
+        counts[known] = (state.reindex(known_lights['service_request_id']).to_numpy(dtype='int64')
+                         + count_safety_near(known_lights, new_reports, radius=radius, units=units))
+    if (~known).any():
+        counts[~known] = count_safety_near(lights[~known], safety_reports, radius=radius, units=units)
+
+    watermark = safety_dates.max()
+    if settings is not None and (pd.isna(watermark) or settings['watermark'] > watermark):
+        watermark = settings['watermark']
+    # only the currently open lights are kept, so closed ones fall out of the store
+    save_safety_state(pd.Series(counts, index=lights['service_request_id'].to_numpy()), watermark, radius, units,
+                      state_file=state_file)
+
+    lights['number_safety_related_near'] = counts
+    # if the issue with the light is not that it won't come on then zero out the safety count
+    lights.loc[~lights['service_name_detail'].isin(LIGHT_OUT_DETAILS), 'number_safety_related_near'] = 0
+    return lights
+
+
+def count_safety_near_loop(lights, safety_reports, radius=SAFETY_RADIUS, units=SAFETY_RADIUS_UNITS):
+    """
+    one light at a time reference for count_safety_near, it projects the points with the same project_lat_lng
+    and CRS, so it checks the KD-tree indexing and the date cutoffs but not the projection or the units
+        Args:
+            lights: dataframe of street light requests with lat, lng and date_requested columns
+            safety_reports: dataframe of safety related requests with lat, lng and date_requested columns
+            radius: the search radius
+            units: the units of radius, 'ft' or 'm'
+        Returns:
+            counts: an int64 numpy array aligned with the rows of lights
+    """
+    radius_m = to_meters(radius, units)
+    safety_dates = pd.to_datetime(safety_reports['date_requested'])
+    safety_locations = [Point(xy) for xy in project_lat_lng(safety_reports['lat'], safety_reports['lng'])]
+    light_dates = pd.to_datetime(lights['date_requested'])
+    light_locations = [Point(xy) for xy in project_lat_lng(lights['lat'], lights['lng'])]
+    counts = np.zeros(len(lights), dtype=np.int64)
+    progress = Progress(len(lights), label='lights counted')
+    for i, (light_location, light_date) in enumerate(zip(light_locations, light_dates)):
+        counts[i] = sum(1 for location, date in zip(safety_locations, safety_dates)
+                        if date > light_date and location.distance(light_location) < radius_m)
+        progress.update()
+    return counts
+
+
+def check_against_loop(lights, safety_reports, sample_size=200, radius=SAFETY_RADIUS, units=SAFETY_RADIUS_UNITS, seed=0):
+    """
+    compares the indexed counts with the original loop on a random sample of lights
+        Args:
+            lights: dataframe of street light requests
+            safety_reports: dataframe of safety related requests
+            sample_size: number of lights to check with the slow loop
+            radius: the search radius
+            units: the units of radius, 'ft' or 'm'
+            seed: random seed for the sample
+        Returns:
+            mismatches: dataframe of the sampled lights where the two methods disagree, empty when they match
+    """
+    sample = lights.sample(n=min(sample_size, len(lights)), random_state=seed).reset_index(drop=True)
+    sample['indexed_count'] = count_safety_near(sample, safety_reports, radius=radius, units=units)
+    sample['loop_count'] = count_safety_near_loop(sample, safety_reports, radius=radius, units=units)
+    return sample[sample['indexed_count'].ne(sample['loop_count'])]
@@ -0,0 +1,142 @@
+"""
+Safety features of open street light requests for several radii, time windows and safety service types at once.
+
+One neighbor query at the largest radius finds every (light, safety report) pair. Each pair that came after the
+light broke is put in the bin of the smallest radius it is inside and the shortest window it falls in, the bins
+are counted per light and service type with one bincount, and cumulative sums over the radius and window axes
+turn the bins into the counts for every radius x window combination. Distance and time decayed sums come from
+the same bincount with the decay as weights. The result is a wide table keyed by service_request_id, and its
+safety_150ft_all column is the number_safety_related_near count of safety_counts.py.
+
+Run as a script: python safety_features.py [radii=50,150,300] [windows=7,30,90] [decay] [streaming]
+[memory_limit_mb=<megabytes>] [profile]
+"""
+
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_loading import (concat_requests, load_options_from_args, read_closed_requests, read_open_requests,
+                          read_street_light_requests)
+from neighbor_query import NeighborIndex, to_meters
+from profiling import enable_profiling, profiled, stage, write_report
+from safety_counts import LIGHT_OUT_DETAILS, SAFETY_RADIUS_UNITS, SAFETY_SERVICE_NAMES
+
+FEATURE_RADII = [50, 150, 300]
+# days after the light broke, None is any time after
+FEATURE_WINDOWS = [7, 30, 90, None]
+# distance (in the radius units) and days over which the decayed weights fall to 1/e
+DECAY_DISTANCE = 150
+DECAY_DAYS = 30
+SAFETY_FEATURES_FILE = 'data/open_street_light_safety_features.csv'
+
+
+def _window_label(window):
+    return 'all' if window is None else f"{window:g}d"
+
+
+def _service_label(service_name):
+    return re.sub(r'[^a-z0-9]+', '_', str(service_name).lower()).strip('_')
+
+
+@profiled
+def safety_features(lights, safety_reports, radii=FEATURE_RADII, windows=FEATURE_WINDOWS, units=SAFETY_RADIUS_UNITS,
+                    by_service=True, decay_distance=None, decay_days=None, lights_out_only=True):
+    """
+    counts the safety reports near and after each street light request for every radius and time window
+        Args:
+            lights: dataframe of street light requests with service_request_id, lat, lng, date_requested and
+                service_name_detail columns
+            safety_reports: dataframe of safety related requests with lat, lng, date_requested and service_name
+                columns
+            radii: the search radii
+            windows: the time windows in days after the light request, None for any time after
+            units: the units of radii and decay_distance, 'ft' or 'm'
+            by_service: also count each safety service type on its own
+            decay_distance: if given (or decay_days is), adds safety_decayed columns where each report counts
+                exp(-distance / decay_distance - days / decay_days)
+            decay_days: the time scale of the decay, DECAY_DAYS if only decay_distance is given
+            lights_out_only: zero the features of lights whose issue is not that they are dark, as the safety
+                count does
+        Returns: dataframe with service_request_id and one column per feature, aligned with the rows of lights
+    """
+    radii = sorted(radii)
+    windows = sorted(windows, key=lambda window: np.inf if window is None else window)
+    radii_m = np.array([to_meters(radius, units) for radius in radii])
+    window_days = np.array([np.inf if window is None else window for window in windows], dtype='float64')
+    decay = decay_distance is not None or decay_days is not None
+
+    report_times = pd.to_datetime(safety_reports['date_requested']).to_numpy(dtype='datetime64[ns]')
+    dated = np.flatnonzero(~np.isnat(report_times))
+    service_codes, service_names = pd.factorize(np.asarray(safety_reports['service_name'], dtype=object)[dated], sort=True)
+    if not by_service:
+        service_codes, service_names = np.zeros(len(dated), dtype=np.int64), []
+    n_lights, n_services, n_radii, n_windows = len(lights), max(len(service_names), 1), len(radii), len(windows)
+
+    # one query at the largest radius, the smaller radii are picked out of its pairs
+    light_times = pd.to_datetime(lights['date_requested']).to_numpy(dtype='datetime64[ns]')
+    light_rows, report_rows, distances = NeighborIndex(
+        safety_reports['lat'].to_numpy()[dated], safety_reports['lng'].to_numpy()[dated]
+    ).pairs_within(lights['lat'].to_numpy(), lights['lng'].to_numpy(), radii[-1], units=units)
+    days = (report_times[dated][report_rows] - light_times[light_rows]) / np.timedelta64(1, 'D')
+    radius_bin = np.searchsorted(radii_m, distances, side='right')
+    window_bin = np.searchsorted(window_days, days, side='left')
+    # strictly after the light request and inside the longest window, nan days (undated lights) never are
+    keep = (days > 0) & (window_bin < n_windows)
+    light_rows, radius_bin, window_bin = light_rows[keep], radius_bin[keep], window_bin[keep]
+    flat = ((light_rows * n_services + service_codes[report_rows[keep]]) * n_radii + radius_bin) * n_windows + window_bin
+    shape = (n_lights, n_services, n_radii, n_windows)
+
+    def cube(weights=None):
+        binned = np.bincount(flat, weights=weights, minlength=int(np.prod(shape))).reshape(shape)
+        return binned.cumsum(axis=2).cumsum(axis=3)
+
+    counts = cube()
+    blocks = {'safety': counts.sum(axis=1)}
+    if by_service:
+        blocks.update({_service_label(name): counts[:, position] for position, name in enumerate(service_names)})
+    if decay:
+        scale_m = to_meters(decay_distance if decay_distance is not None else DECAY_DISTANCE, units)
+        weights = np.exp(-distances[keep] / scale_m - days[keep] / (decay_days or DECAY_DAYS))
+        blocks['safety_decayed'] = cube(weights).sum(axis=1)
+
+    features = {'service_request_id': lights['service_request_id'].to_numpy()}
+    for prefix, block in blocks.items():
+        dtype = 'float32' if prefix == 'safety_decayed' else 'int32'
+        for i, radius in enumerate(radii):
+            for j, window in enumerate(windows):
+                features[f"{prefix}_{radius:g}{units}_{_window_label(window)}"] = block[:, i, j].astype(dtype)
+    features = pd.DataFrame(features)
+    if lights_out_only:
+        # as with the safety count, only a light that is actually dark gets features
+        features.loc[~lights['service_name_detail'].isin(LIGHT_OUT_DETAILS).to_numpy(), features.columns[1:]] = 0
+    return features
+
+
+if __name__ == "__main__":
+    arg_list = sys.argv[1:]
+    options = dict(arg.split('=', 1) for arg in arg_list if '=' in arg)
+    radii = [float(radius) for radius in options['radii'].split(',')] if 'radii' in options else FEATURE_RADII
+    # the any time after window is always included
+    windows = ([float(window) for window in options['windows'].split(',')] + [None] if 'windows' in options
+               else FEATURE_WINDOWS)
+    load_options = load_options_from_args(arg_list)
+    if "profile" in arg_list:
+        enable_profiling()
+
+    with stage('load open street lights') as timed:
+        open_street_lights = read_street_light_requests(**load_options)
+        timed.rows = len(open_street_lights)
+    with stage('load safety requests') as timed:
+        safety_adjacent_data = concat_requests([read_open_requests(service_names=SAFETY_SERVICE_NAMES, **load_options),
+                                                read_closed_requests([2022], service_names=SAFETY_SERVICE_NAMES,
+                                                                     **load_options)])
+        timed.rows = len(safety_adjacent_data)
+    with stage('safety features', rows=len(open_street_lights)):
+        features = safety_features(open_street_lights, safety_adjacent_data, radii=radii, windows=windows,
+                                   decay_distance=DECAY_DISTANCE if "decay" in arg_list else None)
+    features.to_csv(SAFETY_FEATURES_FILE, index=False)
+    print(f"Wrote {features.shape[1] - 1} features of {len(features)} requests to {SAFETY_FEATURES_FILE}")
+    write_report()
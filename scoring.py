@@ -0,0 +1,204 @@
+"""
+Scoring and top-k selection of open street light requests.
+
+The weighting factor columns are packed into one contiguous float matrix, the combined priority is a
+single matrix-vector product with the weights, and the next work orders are picked with argpartition
+so only the selected k requests are ever sorted.
+"""
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+# demonstration weighting, used when no weighting_matrix.csv is given
+DEFAULT_WEIGHTS = {'promise_zone_weighting':0.1,
+                   'safety_weighting_factor':0.4, 'age_weighting_factor':0.3,
+                   'district_weighting_factor':0.05, 'zipcode_weighting_factor':0.05,
+                   'community_weighting_factor':0.1}
+FACTOR_COLUMNS = list(DEFAULT_WEIGHTS)
+# factors that are only computed on request (e.g. the crime factor needs the ARJIS extract), used when weighted
+OPTIONAL_FACTOR_COLUMNS = ['crime_weighting_factor']
+# value used for a factor a request has no data for, e.g. a zip code with too few historic repairs
+MISSING_FACTOR_VALUE = 0.5
+# zip codes and communities with fewer historic repairs than this get MISSING_FACTOR_VALUE
+MIN_HISTORIC_REPAIRS = 10
+# mannualy collected from SANDAG website
+DISTRICT_INCOME_DATA = pd.DataFrame({'Council District':[1,2,3,4,5,6,7,8,9],"Median Household Income (dollars)":[100768,75942,65810,56857,105047,85734,76946,50778,43222]})
+
+
+def read_weights(file_name):
+    """
+    reads user supplied weights from a csv with one column per weighting factor and the weights in the first row
+        Args:
+            file_name: path of the weighting matrix csv
+        Returns: dict of factor column -> weight
+    """
+    weighting_matrix = pd.read_csv(file_name)
+    unknown = set(weighting_matrix.columns) - set(FACTOR_COLUMNS) - set(OPTIONAL_FACTOR_COLUMNS)
+    if unknown:
+        raise ValueError(f"unknown weighting factors in {file_name}: {sorted(unknown)}, "
+                         f"expected {FACTOR_COLUMNS + OPTIONAL_FACTOR_COLUMNS}")
+    return {factor_name: float(weight) for factor_name, weight in weighting_matrix.iloc[0].items()}
+
+
+def min_max_scale(values):
+    """
+    scales values linearly so the smallest is 0 and the largest is 1
+    """
+    return (values - values.min()) / (values.max() - values.min())
+
+
+def historic_factor_tables(historic_tables, district_info=DISTRICT_INCOME_DATA, min_count=MIN_HISTORIC_REPAIRS):
+    """
+    turns historic median repair times into district, zip code and community equity factors
+        Args:
+            historic_tables: dict from aggregation.aggregate with district, zipcode and community tables
+                labeled 'Median Time to Repair' and 'Count'
+            district_info: table of the council districts to keep, joined on 'Council District', None for all
+            min_count: zip codes and communities with fewer historic repairs are left out
+        Returns: the district, zip code and community tables with a weighting factor column each
+    """
+    district_data = historic_tables['district'].rename(columns={'council_district':'Council District'})
+    if district_info is not None:
+        district_data = district_data.merge(district_info, how='inner', on='Council District')
+    district_data['district_weighting_factor'] = min_max_scale(district_data['Median Time to Repair'])
+    zipcode_data = historic_tables['zipcode'].rename(columns={'zipcode':'Zip Code'})
+    zipcode_data = zipcode_data[zipcode_data['Count'].ge(min_count)].reset_index(drop=True)
+    zipcode_data['zipcode_weighting_factor'] = min_max_scale(zipcode_data['Median Time to Repair'])
+    community_data = historic_tables['community'].rename(columns={'comm_plan_name':'Community'})
+    community_data = community_data[community_data['Count'].ge(min_count)].reset_index(drop=True)
+    community_data['community_weighting_factor'] = min_max_scale(community_data['Median Time to Repair'])
+    return district_data, zipcode_data, community_data
+
+
+def add_weighting_factors(open_lights, district_data, zipcode_data, community_data):
+    """
+    adds the weighting factor columns to open street light requests
+        Args:
+            open_lights: open requests with number_safety_related_near and the Promise Zone name column from
+                zone tagging ('Rest of City' outside it)
+            district_data, zipcode_data, community_data: the tables from historic_factor_tables
+        Returns: a new dataframe with the factor columns, zip codes and communities without a factor get
+            MISSING_FACTOR_VALUE
+    """
+    open_lights = open_lights.copy()
+    open_lights['promise_zone_weighting'] = open_lights['name'].ne('Rest of City').astype('int64')
+    # uniform weighting factors for case_age_days and the safety count
+    open_lights['safety_weighting_factor'] = min_max_scale(open_lights['number_safety_related_near'])
+    open_lights['age_weighting_factor'] = min_max_scale(open_lights['case_age_days'])
+    # join the historic equity factors on each request's district, zip code and community
+    open_lights = open_lights.merge(district_data[['district_weighting_factor','Council District']],how='left',left_on='council_district',right_on='Council District')
+    open_lights.drop(columns='Council District',inplace=True)
+    open_lights = open_lights.merge(zipcode_data[['zipcode_weighting_factor','Zip Code']],how='left',left_on='zipcode',right_on='Zip Code')
+    open_lights.drop(columns='Zip Code',inplace=True)
+    open_lights['zipcode_weighting_factor'] = open_lights['zipcode_weighting_factor'].fillna(MISSING_FACTOR_VALUE)
+    open_lights = open_lights.merge(community_data[['community_weighting_factor','Community']],how='left',left_on='comm_plan_name',right_on='Community')
+    open_lights.drop(columns='Community',inplace=True)
+    open_lights['community_weighting_factor'] = open_lights['community_weighting_factor'].fillna(MISSING_FACTOR_VALUE)
+    return open_lights
+
+
+def weighted_factor_columns(weights):
+    """
+    the factor columns scored for a set of weights, the standard ones plus any weighted optional ones
+        Args:
+            weights: dict of factor column -> weight
+        Returns: list of factor columns
+    """
+    return FACTOR_COLUMNS + [factor_name for factor_name in OPTIONAL_FACTOR_COLUMNS if weights.get(factor_name)]
+
+
+def weight_vector(weights, factor_columns=FACTOR_COLUMNS):
+    """
+    lines the weights up with the factor columns, factors without a weight get 0
+        Args:
+            weights: dict of factor column -> weight
+            factor_columns: the order of the factor matrix columns
+        Returns: a float array of weights
+    """
+    return np.array([weights.get(factor_name, 0.0) for factor_name in factor_columns], dtype='float64')
+
+
+def factor_matrix(df, factor_columns=FACTOR_COLUMNS, missing_value=MISSING_FACTOR_VALUE):
+    """
+    packs the weighting factor columns into a contiguous requests x factors matrix
+        Args:
+            df: the dataframe of requests with the factor columns
+            factor_columns: the factor columns, in matrix column order
+            missing_value: value used in place of missing factors
+        Returns: a C ordered float64 array
+    """
+    matrix = np.ascontiguousarray(df[factor_columns].to_numpy(dtype='float64'))
+    matrix[np.isnan(matrix)] = missing_value
+    return matrix
+
+
+def score(matrix, weights, factor_columns=FACTOR_COLUMNS):
+    """
+    combines the factors of every request into a single priority
+        Args:
+            matrix: the requests x factors matrix
+            weights: dict of factor column -> weight, or an array in factor column order
+            factor_columns: the order of the factor matrix columns
+        Returns: float array with the combined priority of each request
+    """
+    if isinstance(weights, dict):
+        weights = weight_vector(weights, factor_columns)
+    return matrix @ weights
+
+
+def top_k(scores, k, groups=None, quotas=None):
+    """
+    finds the positions of the highest priority requests
+        Args:
+            scores: float array of priorities
+            k: the number of requests to return, None for all of them
+            groups: optional array of a group (e.g. council district) for each request, used with quotas
+            quotas: optional dict of group -> the most requests to take from that group, groups not
+                in the dict get none
+        Returns: int array of positions, highest priority first, equal priorities in row order as with a
+            stable sort
+    """
+    candidates = np.arange(len(scores))
+    if quotas is not None:
+        groups = np.asarray(groups)
+        # rank the requests inside each group and keep the ones that fit inside the group's quota
+        order = np.lexsort((-scores, groups))
+        group_sorted = groups[order]
+        starts = np.flatnonzero(np.r_[True, group_sorted[1:] != group_sorted[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        limits = np.array([quotas.get(group, 0) for group in group_sorted], dtype=np.int64)
+        candidates = np.sort(order[rank < limits])
+    if k is not None and k < len(candidates):
+        if k <= 0:
+            return candidates[:0]
+        # partial selection, only the chosen k get sorted. argpartition splits ties at the cut arbitrarily, so
+        # everything above the k-th score is kept and the ties at it are taken in row order
+        candidate_scores = scores[candidates]
+        kth = -np.partition(-candidate_scores, k - 1)[k - 1]
+        above = candidates[candidate_scores > kth]
+        candidates = np.concatenate([above, candidates[candidate_scores == kth][:k - len(above)]])
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+@profiled
+def prioritize(df, weights=None, k=None, group_column=None, quotas=None):
+    """
+    scores open requests and returns the top ones in priority order
+        Args:
+            df: the dataframe of requests with the factor columns
+            weights: dict of factor column -> weight, DEFAULT_WEIGHTS if not given
+            k: the number of requests to return, None for all of them
+            group_column: the column holding each request's group, used with quotas
+            quotas: optional dict of group -> the most requests to take from that group
+        Returns: the selected rows with a combined_priority column, highest priority first
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    factor_columns = weighted_factor_columns(weights)
+    scores = score(factor_matrix(df, factor_columns), weights, factor_columns)
+    groups = df[group_column].to_numpy() if group_column is not None else None
+    selected = top_k(scores, k, groups=groups, quotas=quotas)
+    prioritized = df.iloc[selected].copy()
+    prioritized['combined_priority'] = scores[selected]
+    return prioritized
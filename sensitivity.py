@@ -0,0 +1,115 @@
+"""
+Sensitivity of the work order to the choice of weights.
+
+Many weight vectors (a grid or a random sample from the simplex) are scored at once as a
+requests x factors . factors x scenarios matrix product, in chunks of scenarios sized to a memory budget.
+Each scenario is compared with the baseline weights by top-k overlap and by Kendall's tau. Tau is estimated
+on a fixed random sample of request pairs, which keeps it linear in the number of scenarios; with the
+default 20000 pairs its standard error is under 0.01. When there are no more pairs than that, every pair
+is compared and tau is exact.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from profiling import Progress, profiled
+from scoring import DEFAULT_WEIGHTS, FACTOR_COLUMNS, weight_vector
+
+SWEEP_MEMORY_MB = 256
+
+
+def random_weights(n_scenarios, n_factors=len(FACTOR_COLUMNS), seed=0):
+    """
+    samples weight vectors uniformly from the simplex (non-negative, summing to 1)
+        Args:
+            n_scenarios: the number of weight vectors
+            n_factors: the number of weighting factors
+            seed: random seed
+        Returns: an (n_scenarios, n_factors) float array
+    """
+    return np.random.default_rng(seed).dirichlet(np.ones(n_factors), size=n_scenarios)
+
+
+def grid_weights(steps, n_factors=len(FACTOR_COLUMNS)):
+    """
+    every weight vector on the simplex whose weights are multiples of 1/steps
+        Args:
+            steps: the number of steps the unit weight is split into
+            n_factors: the number of weighting factors
+        Returns: an (n_scenarios, n_factors) float array
+    """
+    # stars and bars: choose where the n_factors - 1 dividers go among steps + n_factors - 1 slots
+    grid = []
+    for dividers in itertools.combinations(range(steps + n_factors - 1), n_factors - 1):
+        edges = np.array((-1,) + dividers + (steps + n_factors - 1,))
+        grid.append(np.diff(edges) - 1)
+    return np.array(grid, dtype='float64') / steps
+
+
+def _top_k_rows(scores, k):
+    """
+    positions of the k highest scores in every row, in no particular order
+    """
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+@profiled
+def sweep(matrix, scenarios, baseline_weights=None, k=100, n_pairs=20000, memory_mb=SWEEP_MEMORY_MB, seed=0,
+          factor_columns=FACTOR_COLUMNS):
+    """
+    scores every weight scenario and measures how far its ranking moves from the baseline
+        Args:
+            matrix: the requests x factors matrix from scoring.factor_matrix
+            scenarios: an (n_scenarios, n_factors) array of weight vectors
+            baseline_weights: dict of factor column -> weight to compare against, DEFAULT_WEIGHTS if not given
+            k: the size of the work order list compared by top-k overlap
+            n_pairs: the number of request pairs used to estimate Kendall's tau, every pair is used if there
+                are no more than this
+            memory_mb: rough memory budget for the scenario scores held at one time
+            seed: random seed for the pair sample
+            factor_columns: the factor columns of matrix, in order
+        Returns:
+            scenario_table: dataframe with the weights, top_k_overlap and kendall_tau of each scenario
+            top_k_frequency: float array, the share of scenarios that put each request in the top k
+    """
+    n_requests = matrix.shape[0]
+    k = min(k, n_requests)
+    # scored the same way as the scenarios, so the baseline weights as a scenario reproduce the baseline exactly
+    baseline = (weight_vector(baseline_weights or DEFAULT_WEIGHTS, factor_columns)[None, :] @ matrix.T)[0]
+    in_baseline_top = np.zeros(n_requests, dtype=bool)
+    in_baseline_top[_top_k_rows(baseline[None, :], k)[0]] = True
+
+    rng = np.random.default_rng(seed)
+    if n_requests * (n_requests - 1) // 2 <= n_pairs:
+        first, second = np.triu_indices(n_requests, k=1)
+    else:
+        first = rng.integers(0, n_requests, size=n_pairs)
+        # never a request with itself, such a pair could only pull tau toward 0
+        second = (first + rng.integers(1, n_requests, size=n_pairs)) % n_requests
+    n_pairs = max(len(first), 1)
+    # the score difference of a pair is linear in the weights, so it comes straight from the factor differences
+    pair_differences = matrix[first] - matrix[second]
+    baseline_order = np.sign(baseline[first] - baseline[second])
+
+    # scores and partition positions are each about one 8 byte value per request per scenario
+    chunk = max(1, int(memory_mb * 2**20 // (8 * 2 * max(n_requests + n_pairs, 1))))
+    overlap = np.empty(len(scenarios))
+    tau = np.empty(len(scenarios))
+    top_k_count = np.zeros(n_requests, dtype=np.int64)
+    progress = Progress(len(scenarios), label='weight scenarios scored')
+    for start in range(0, len(scenarios), chunk):
+        # scenarios x requests, so each scenario's scores are contiguous for the partial sort
+        scores = scenarios[start:start + chunk] @ matrix.T
+        top = _top_k_rows(scores, k)
+        overlap[start:start + chunk] = in_baseline_top[top].sum(axis=1) / k
+        top_k_count += np.bincount(top.ravel(), minlength=n_requests)
+        # tau-a over the sampled pairs, ties count as neither agreeing nor disagreeing
+        tau[start:start + chunk] = np.sign(scenarios[start:start + chunk] @ pair_differences.T) @ baseline_order / n_pairs
+        progress.update(len(scenarios[start:start + chunk]))
+
+    scenario_table = pd.DataFrame(scenarios, columns=factor_columns[:scenarios.shape[1]])
+    scenario_table['top_k_overlap'] = overlap
+    scenario_table['kendall_tau'] = tau
+    return scenario_table, top_k_count / len(scenarios)
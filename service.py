@@ -0,0 +1,402 @@
+"""
+Long running prioritization service that keeps the project data warm in memory.
+
+The pipeline (pipeline.py) is run once to get the filtered and factorized requests, then everything a query
+needs is built into a Snapshot: the requests x factors matrix, the service_request_id lookup, a NeighborIndex
+over the date sorted safety reports, an n-gram street index with a location per hundred block for address
+queries, and the Promise Zone layer. Queries only read the snapshot, so each is a matrix-vector product or a
+single KD-tree lookup, run in a worker thread so a long rescore does not hold up other connections. Until the
+first snapshot is built every query is answered 503. A background task polls the data files and, once a new
+drop has stopped changing, builds a new snapshot in a worker thread (only the out of date pipeline stages
+rerun) and swaps it in.
+Queries that already started finish on the snapshot they picked up, so none are dropped during a reload.
+
+Endpoints (GET with query parameters, or POST with a json object of the same parameters):
+    /health                                 sizes and load time of the current snapshot
+    /priority?id=<service_request_id>       factors, combined priority and rank of one open request
+    /safety_near?address=<address>          safety reports near and after a point, lat=&lng= instead of an
+        [&radius=<feet>][&after=<date>]     address, the Promise Zone of the point is also returned
+    /top?k=<n>                              the n highest priority open requests
+    /what_if?k=<n>                          the top n under other weights and how far they are from the
+                                            baseline top n
+    /reload (POST)                          rebuild the snapshot now
+Every endpoint but health and reload takes weights as <factor column>=<weight>, which replace the baseline
+weight of that factor only.
+
+Run as a script: python service.py [weighting_matrix.csv] [radius=<feet>] [host=<host>] [port=<n>]
+[socket=<path>] [reload_interval=<seconds>] [streaming] [memory_limit_mb=<megabytes>] [profile]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from address_matching import StreetIndex, normalize_addresses, parse_address
+from data_loading import load_options_from_args
+from neighbor_query import NeighborIndex
+from pipeline import OUTPUT_COLUMNS, project_stages, run_pipeline
+from safety_counts import SAFETY_RADIUS, SAFETY_RADIUS_UNITS, _sort_by_date
+from scoring import (DEFAULT_WEIGHTS, FACTOR_COLUMNS, OPTIONAL_FACTOR_COLUMNS, factor_matrix, read_weights, score,
+                     top_k)
+from zone_tagging import PROMISE_ZONE_FILE, load_zone_layer
+
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8311
+# seconds between two checks of the data files for a new drop
+RELOAD_INTERVAL = 30.0
+DEFAULT_TOP_K = 100
+# largest request body accepted, in bytes
+MAX_BODY_BYTES = 1 << 20
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error',
+               503: 'Service Unavailable'}
+
+
+def _records(df):
+    """
+    rows of a dataframe as json ready dicts, dates in iso format and missing values as null
+    """
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+def _top_k_count(params):
+    """
+    the k query parameter of top and what_if, a ValueError (400) unless it is a whole number of at least 1
+    """
+    k = int(params.get('k', DEFAULT_TOP_K))
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+    return k
+
+
+class Snapshot:
+    """
+    the data and indexes of one data drop, built once and only read afterwards
+        Args:
+            filtered: output of the pipeline filter stage
+            factorized: output of the pipeline factorize stage
+            weights: the baseline dict of factor column -> weight
+            radius, units: the default safety search radius
+            zone_file: the zone file point queries are tagged with
+    """
+
+    def __init__(self, filtered, factorized, weights, radius=SAFETY_RADIUS, units=SAFETY_RADIUS_UNITS,
+                 zone_file=PROMISE_ZONE_FILE):
+        self.loaded_at = pd.Timestamp.now().isoformat(timespec='seconds')
+        self.radius = radius
+        self.units = units
+        self.requests = factorized.reset_index(drop=True)
+        self.factor_columns = FACTOR_COLUMNS + [column for column in OPTIONAL_FACTOR_COLUMNS
+                                                if column in self.requests]
+        self.columns = [column for column in OUTPUT_COLUMNS if column != 'combined_priority']
+        self.columns += [column for column in ['number_night_crimes_on_block', 'crime_weighting_factor']
+                         if column in self.requests]
+        self.weights = dict(weights)
+        self.matrix = factor_matrix(self.requests, self.factor_columns)
+        self.baseline_scores = score(self.matrix, self.weights, self.factor_columns)
+        self.row_by_id = {str(request_id): row for row, request_id in enumerate(self.requests['service_request_id'])}
+
+        # safety reports in date order, so "after a date" is everything past a cutoff index
+        safety_lat, safety_lng, self.safety_times = _sort_by_date(filtered['safety_reports'])
+        self.safety_index = NeighborIndex(safety_lat, safety_lng)
+
+        # a location for every hundred block of every street seen in the requests, for address queries
+        known = pd.concat([filtered[name][['street_address', 'lat', 'lng']]
+                           for name in ('open_lights', 'historic_lights', 'safety_reports')], ignore_index=True)
+        known = known.dropna().reset_index(drop=True)
+        addresses = normalize_addresses(known['street_address'])
+        self.street_index = StreetIndex(addresses['street_name'])
+        addresses['street'] = addresses['street_name'].map(self.street_index.lookup)
+        addresses[['lat', 'lng']] = known[['lat', 'lng']]
+        self.block_locations = (addresses.dropna(subset=['street', 'block'])
+                                .groupby(['street', 'block'])[['lat', 'lng']].median())
+        self.zone_layer = load_zone_layer(zone_file, 'name')
+
+    def weights_from(self, params):
+        """
+        the baseline weights with any factor weights given in the query parameters put in their place
+            Args:
+                params: dict of query parameters
+            Returns: dict of factor column -> weight
+        """
+        weights = dict(self.weights)
+        for name, value in params.items():
+            if name in FACTOR_COLUMNS or name in OPTIONAL_FACTOR_COLUMNS:
+                if name not in self.factor_columns:
+                    raise ValueError(f"{name} was not computed for this service, restart it with that factor weighted")
+                weights[name] = float(value)
+        return weights
+
+    def scores(self, weights):
+        if weights == self.weights:
+            return self.baseline_scores
+        return score(self.matrix, weights, self.factor_columns)
+
+    def locate(self, address):
+        """
+        the location of an address from the requests seen on its hundred block, or the nearest block of the
+        same street
+            Args:
+                address: a street address
+            Returns: (lat, lng)
+        """
+        block, _, street_name, _ = parse_address(address)
+        if np.isnan(block) or not street_name:
+            raise ValueError(f"'{address}' has no block number or street name")
+        positions, _ = self.street_index.match([street_name])
+        if positions[0] < 0:
+            raise LookupError(f"no known street matches '{address}'")
+        blocks = self.block_locations.loc[positions[0]]
+        nearest = blocks.index[np.argmin(np.abs(blocks.index.to_numpy() - block))]
+        return float(blocks.at[nearest, 'lat']), float(blocks.at[nearest, 'lng'])
+
+    def priority(self, params):
+        if 'id' not in params:
+            raise ValueError("priority needs an id parameter")
+        row = self.row_by_id.get(str(params['id']))
+        if row is None:
+            raise LookupError(f"no open street light request with id {params['id']}")
+        scores = self.scores(self.weights_from(params))
+        result = _records(self.requests.iloc[[row]][self.columns])[0]
+        result['combined_priority'] = float(scores[row])
+        result['rank'] = int((scores > scores[row]).sum()) + 1
+        result['open_requests'] = len(scores)
+        return result
+
+    def safety_near(self, params):
+        if 'address' in params:
+            lat, lng = self.locate(params['address'])
+        elif 'lat' in params and 'lng' in params:
+            lat, lng = float(params['lat']), float(params['lng'])
+        else:
+            raise ValueError("safety_near needs an address or lat and lng parameters")
+        radius = float(params.get('radius', self.radius))
+        units = params.get('units', self.units)
+        _, safety_rows, _ = self.safety_index.pairs_within([lat], [lng], radius, units=units)
+        if 'after' in params:
+            cutoff = np.searchsorted(self.safety_times, pd.Timestamp(params['after']).to_datetime64(), side='right')
+            safety_rows = safety_rows[safety_rows >= cutoff]
+        zone = self.zone_layer.label_points(np.array([lat]), np.array([lng]))[0]
+        return {'lat': lat, 'lng': lng, 'radius': radius, 'units': units, 'count': int(len(safety_rows)),
+                'promise_zone': zone if isinstance(zone, str) else None}
+
+    def top(self, params):
+        scores = self.scores(self.weights_from(params))
+        selected = top_k(scores, _top_k_count(params))
+        top_requests = self.requests.iloc[selected][self.columns].copy()
+        top_requests['combined_priority'] = scores[selected]
+        return {'requests': _records(top_requests)}
+
+    def what_if(self, params):
+        weights = self.weights_from(params)
+        k = _top_k_count(params)
+        selected = top_k(self.scores(weights), k)
+        baseline = top_k(self.baseline_scores, k)
+        ids = self.requests['service_request_id'].to_numpy()
+        result = self.top(params)
+        result.update({'weights': weights,
+                       'top_k_overlap': len(np.intersect1d(selected, baseline)) / max(len(baseline), 1),
+                       'entered': _records(pd.Series(ids[np.setdiff1d(selected, baseline)])),
+                       'left': _records(pd.Series(ids[np.setdiff1d(baseline, selected)]))})
+        return result
+
+    def health(self, params):
+        return {'loaded_at': self.loaded_at, 'open_requests': len(self.requests),
+                'safety_reports': len(self.safety_times), 'known_blocks': len(self.block_locations),
+                'weights': self.weights}
+
+
+class PrioritizationService:
+    """
+    answers queries from a warm Snapshot and swaps in a new one when the data files change
+        Args:
+            weights: the baseline dict of factor column -> weight, DEFAULT_WEIGHTS if not given
+            radius, units: the safety count search radius
+            reload_interval: seconds between two checks of the data files, None to only reload on request
+            load_options: streaming / chunking options passed on to the loaders
+    """
+
+    def __init__(self, weights=None, radius=SAFETY_RADIUS, units=SAFETY_RADIUS_UNITS, reload_interval=RELOAD_INTERVAL,
+                 load_options=None):
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.radius = radius
+        self.units = units
+        self.reload_interval = reload_interval
+        self.load_options = load_options
+        self.stages = project_stages(radius=radius, units=units, weights=self.weights, load_options=load_options)
+        self.snapshot = None
+        self.reloads = 0
+        self._reload_lock = asyncio.Lock()
+        self.routes = {'/health': self._health, '/priority': self._query('priority'),
+                       '/safety_near': self._query('safety_near'), '/top': self._query('top'),
+                       '/what_if': self._query('what_if')}
+
+    def source_signature(self):
+        """
+        the size and modification time of every data file the stages read
+        """
+        signature = []
+        for stage in self.stages:
+            for source_file in stage.source_files:
+                stat = os.stat(source_file) if os.path.exists(source_file) else None
+                signature.append((source_file, stat and (stat.st_size, stat.st_mtime_ns)))
+        return tuple(signature)
+
+    def build_snapshot(self):
+        """
+        runs the out of date pipeline stages and builds a snapshot from their outputs
+        """
+        with profiling.stage('service snapshot') as timed:
+            outputs, _ = run_pipeline(self.stages, targets=['filter', 'factorize'])
+            snapshot = Snapshot(outputs['filter'], outputs['factorize'], self.weights, radius=self.radius,
+                                units=self.units)
+            timed.rows = len(snapshot.requests)
+        return snapshot
+
+    async def reload(self):
+        """
+        builds a new snapshot in a worker thread and swaps it in, queries keep using the old one meanwhile
+        """
+        async with self._reload_lock:
+            snapshot = await asyncio.get_running_loop().run_in_executor(None, self.build_snapshot)
+            self.snapshot = snapshot
+            self.reloads += 1
+        return {'loaded_at': snapshot.loaded_at, 'reloads': self.reloads}
+
+    async def watch(self):
+        """
+        reloads once a changed set of data files has stayed the same for a whole interval, so a drop that is
+        still being copied is not read half written
+        """
+        loaded = last_seen = self.source_signature()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            current = self.source_signature()
+            if current != loaded and current == last_seen:
+                try:
+                    await self.reload()
+                except Exception as error:
+                    # keep serving the old snapshot, the next change of the files retries
+                    print(f"reload failed, still serving {self.snapshot.loaded_at}: {error!r}", file=sys.stderr)
+                loaded = current
+            last_seen = current
+
+    def _health(self, snapshot, params):
+        return dict(snapshot.health(params), reloads=self.reloads)
+
+    @staticmethod
+    def _query(name):
+        return lambda snapshot, params: getattr(snapshot, name)(params)
+
+    async def dispatch(self, method, target, body):
+        """
+        answers one request
+            Args:
+                method: the http method
+                target: the request path with its query string
+                body: the request body, a json object of parameters for POST
+            Returns: (status, dict)
+        """
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        try:
+            if method == 'POST' and body:
+                body_params = json.loads(body)
+                if not isinstance(body_params, dict):
+                    raise ValueError("a POST body must be a json object of parameters")
+                params.update(body_params)
+            if url.path == '/reload':
+                if method != 'POST':
+                    return 405, {'error': 'reload needs POST'}
+                return 200, await self.reload()
+            if url.path not in self.routes:
+                return 404, {'error': f"unknown endpoint {url.path}, expected one of {sorted(self.routes) + ['/reload']}"}
+            # take the snapshot once, a reload during this query does not change what it sees
+            snapshot = self.snapshot
+            if snapshot is None:
+                return 503, {'error': 'loading, the first snapshot of the data is still being built'}
+            start = time.perf_counter()
+            # rescoring every request is too slow for the event loop, it runs in a worker thread like reload
+            result = await asyncio.get_running_loop().run_in_executor(None, self.routes[url.path], snapshot, params)
+            result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            return 200, result
+        except LookupError as error:
+            return 404, {'error': str(error)}
+        except ValueError as error:
+            return 400, {'error': str(error)}
+
+    async def handle(self, reader, writer):
+        """
+        reads one http request from a connection, answers it and closes the connection
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                status, result = 400, {'error': 'malformed request line'}
+            else:
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    status, result = 400, {'error': f"request body over {MAX_BODY_BYTES} bytes"}
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, result = await self.dispatch(request_line[0].upper(), request_line[1], body)
+        except Exception as error:
+            status, result = 500, {'error': repr(error)}
+        payload = json.dumps(result).encode()
+        writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT, socket_path=None):
+        """
+        loads the first snapshot, then serves http on host:port, or on a unix socket if socket_path is given
+        """
+        await self.reload()
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            where = socket_path
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            where = f"http://{host}:{port}"
+        print(f"Serving {len(self.snapshot.requests)} open requests on {where}", flush=True)
+        watcher = asyncio.create_task(self.watch()) if self.reload_interval else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher:
+                watcher.cancel()
+
+
+if __name__ == "__main__":
+    arg_list = sys.argv[1:]
+    if "profile" in arg_list:
+        profiling.enable_profiling()
+    options = dict(arg.split('=', 1) for arg in arg_list if '=' in arg)
+    service = PrioritizationService(weights=read_weights('weighting_matrix.csv') if "weighting_matrix.csv" in arg_list else None,
+                                    radius=float(options.get('radius', SAFETY_RADIUS)),
+                                    reload_interval=float(options.get('reload_interval', RELOAD_INTERVAL)) or None,
+                                    load_options=load_options_from_args(arg_list))
+    try:
+        asyncio.run(service.serve(host=options.get('host', SERVICE_HOST), port=int(options.get('port', SERVICE_PORT)),
+                                  socket_path=options.get('socket')))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        profiling.write_report()
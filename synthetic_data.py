@@ -0,0 +1,229 @@
+"""
+Synthetic Get It Done data for testing and benchmarking without the real San Diego downloads.
+
+Writes files with the same names and columns as the real ones: the open requests, one closed requests file
+per year and a Promise Zone GeoJSON. The size is set as a multiple of a real year (scale=1 is about
+REAL_YEAR_ROWS closed requests a year, up to scale=100). Locations are clustered: every request belongs to one
+of the community plan areas below, sits near one of that community's hotspots and takes the community's
+council district and zip code, so denser scales pack more requests into the same streets. Requests come in
+mostly during the day, repair times are log-normal with a longer tail for street lights and a district
+effect, and the files keep the quirks the loaders handle (zip+4 codes, missing locations and districts).
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_loading import DATA_DIR, OPEN_REQUESTS_FILE, REQUEST_COLUMNS, STREET_LIGHT_SERVICE, closed_requests_file
+
+# closed requests in a real year, and open requests at any one time, at scale=1
+REAL_YEAR_ROWS = 250000
+REAL_OPEN_ROWS = 40000
+# rows generated and written at a time, so large scales do not need to fit in memory
+WRITE_CHUNK_ROWS = 500000
+SYNTHETIC_YEARS = [2016, 2017, 2018, 2019, 2020, 2021, 2022]
+# the day the open requests file was "downloaded"
+SNAPSHOT_DATE = pd.Timestamp('2022-10-01')
+
+# share of requests by service, the safety related services from safety_counts are all present
+SERVICE_MIX = {STREET_LIGHT_SERVICE:0.05, 'Graffiti':0.08, 'Graffiti - Code Enforcement':0.03,
+               'Illegal Dumping':0.12, 'Encampment':0.15, 'Homeless Outreach':0.03, 'Pothole':0.10,
+               'Missed Collection':0.08, '72 Hour Violation':0.12, 'Sidewalk Repair Issue':0.04,
+               'Traffic Signal Issue':0.04, 'Tree Maintenance':0.04, 'Other':0.12}
+STREET_LIGHT_DETAILS = {'STREET LIGHT OUT':0.70, 'STREET LIGHT DAY BURNER':0.10, 'STREET LIGHT FLICKERING':0.10,
+                        'POLE KNOCK OVER/DAMAGE':0.05, 'STREET LIGHT OTHER':0.05}
+# community plan area: (center lat, center lng, council district, zip code, share of requests)
+COMMUNITIES = {'Downtown':(32.715, -117.160, 3, 92101, 0.12), 'North Park':(32.747, -117.130, 3, 92104, 0.07),
+               'City Heights':(32.748, -117.100, 9, 92105, 0.08), 'Barrio Logan':(32.697, -117.140, 8, 92113, 0.04),
+               'Southeastern San Diego':(32.705, -117.080, 4, 92114, 0.07), 'Encanto':(32.710, -117.040, 4, 92114, 0.04),
+               'Pacific Beach':(32.797, -117.240, 2, 92109, 0.06), 'Point Loma':(32.730, -117.230, 2, 92106, 0.03),
+               'Clairemont Mesa':(32.830, -117.200, 6, 92117, 0.06), 'Linda Vista':(32.785, -117.170, 7, 92111, 0.04),
+               'Mission Valley':(32.770, -117.160, 7, 92108, 0.04), 'College Area':(32.770, -117.070, 9, 92115, 0.05),
+               'Kearny Mesa':(32.830, -117.140, 6, 92123, 0.03), 'Mira Mesa':(32.915, -117.140, 6, 92126, 0.05),
+               'University':(32.870, -117.210, 1, 92122, 0.04), 'La Jolla':(32.840, -117.270, 1, 92037, 0.03),
+               'Carmel Valley':(32.940, -117.220, 1, 92130, 0.02), 'Rancho Bernardo':(33.020, -117.070, 5, 92128, 0.03),
+               'San Ysidro':(32.555, -117.040, 8, 92173, 0.03), 'Otay Mesa-Nestor':(32.575, -117.080, 8, 92154, 0.03)}
+HOTSPOTS_PER_COMMUNITY = 40
+# spread of the hotspots around a community center and of the requests around a hotspot, in degrees
+COMMUNITY_SPREAD = 0.010
+HOTSPOT_SPREAD = 0.0015
+# log-normal repair times: median days and sigma
+STREET_LIGHT_REPAIR_DAYS = (30, 1.2)
+OTHER_REPAIR_DAYS = (7, 1.3)
+# the longest a synthetic repair takes
+MAX_REPAIR_DAYS = 1500
+# rough outline of the Promise Zone (southeastern San Diego), as lng, lat
+PROMISE_ZONE_OUTLINE = [(-117.165, 32.690), (-117.165, 32.725), (-117.110, 32.725), (-117.100, 32.760),
+                        (-117.060, 32.760), (-117.030, 32.720), (-117.050, 32.690), (-117.165, 32.690)]
+PROMISE_ZONE_VERTICES = 2000
+
+
+def _hotspots(rng):
+    """
+    fixed hotspot locations, the same for every file written with the same seed
+    """
+    centers = np.array([(lat, lng) for lat, lng, _, _, _ in COMMUNITIES.values()])
+    spots = np.repeat(centers, HOTSPOTS_PER_COMMUNITY, axis=0)
+    spots += rng.normal(scale=COMMUNITY_SPREAD, size=spots.shape)
+    # a few busy hotspots and many quiet ones
+    popularity = rng.lognormal(sigma=1.0, size=len(spots))
+    community_share = np.repeat([share for *_, share in COMMUNITIES.values()], HOTSPOTS_PER_COMMUNITY)
+    weights = popularity * community_share / np.repeat(
+        np.add.reduceat(popularity, np.arange(0, len(spots), HOTSPOTS_PER_COMMUNITY)), HOTSPOTS_PER_COMMUNITY)
+    return spots, weights / weights.sum()
+
+
+def _request_times(rng, n, start, end):
+    """
+    request times between start and end, more in the summer and during the day
+    """
+    days = (end - start).days
+    day_weights = 1 + 0.2 * np.sin(2 * np.pi * (np.arange(days) - 80) / 365)
+    day = rng.choice(days, size=n, p=day_weights / day_weights.sum())
+    seconds = np.clip(rng.normal(13 * 3600, 4 * 3600, size=n), 0, 86399).astype(np.int64)
+    return start + pd.to_timedelta(day, unit='D') + pd.to_timedelta(seconds, unit='s')
+
+
+def generate_requests(rng, n, hotspots, first_id, closed_in=None, open_at=None):
+    """
+    makes n synthetic requests
+        Args:
+            rng: numpy random generator
+            n: the number of requests
+            hotspots: (locations, weights) from _hotspots
+            first_id: the service_request_id of the first request, the rest follow on
+            closed_in: year the requests were closed in, for a closed requests file
+            open_at: the snapshot date, for the open requests file
+        Returns: a dataframe with the columns of the real files
+    """
+    services = np.array(list(SERVICE_MIX))
+    service_name = services[rng.choice(len(services), size=n, p=list(SERVICE_MIX.values()))]
+    is_light = service_name == STREET_LIGHT_SERVICE
+    details = np.array(list(STREET_LIGHT_DETAILS))
+    service_name_detail = np.char.upper(service_name.astype(str)).astype(object)
+    service_name_detail[is_light] = details[rng.choice(len(details), size=int(is_light.sum()),
+                                                       p=list(STREET_LIGHT_DETAILS.values()))]
+
+    spots, spot_weights = hotspots
+    spot = rng.choice(len(spots), size=n, p=spot_weights)
+    lat = spots[spot, 0] + rng.normal(scale=HOTSPOT_SPREAD, size=n)
+    lng = spots[spot, 1] + rng.normal(scale=HOTSPOT_SPREAD, size=n)
+    community = spot // HOTSPOTS_PER_COMMUNITY
+    community_names = np.array(list(COMMUNITIES), dtype=object)
+    district = np.array([c[2] for c in COMMUNITIES.values()], dtype='float64')[community]
+    zipcode = np.array([c[3] for c in COMMUNITIES.values()], dtype=object)[community]
+
+    # slower repairs in the higher numbered districts, so the equity factors have something to find
+    median_days = np.where(is_light, STREET_LIGHT_REPAIR_DAYS[0], OTHER_REPAIR_DAYS[0]) * (0.8 + 0.05 * district)
+    sigma = np.where(is_light, STREET_LIGHT_REPAIR_DAYS[1], OTHER_REPAIR_DAYS[1])
+    repair_days = np.minimum(rng.lognormal(np.log(median_days), sigma), MAX_REPAIR_DAYS)
+    if closed_in is not None:
+        date_closed = _request_times(rng, n, pd.Timestamp(f"{closed_in}-01-01"), pd.Timestamp(f"{closed_in + 1}-01-01"))
+        date_requested = date_closed - pd.to_timedelta(repair_days, unit='D')
+        case_age_days = np.floor(repair_days)
+        status = np.where(rng.random(n) < 0.08, 'Referred', 'Closed')
+        date_closed = date_closed.strftime('%Y-%m-%dT%H:%M:%S')
+    else:
+        # open requests arrived over the last two years, the old ones are the long tail still waiting
+        date_requested = open_at - pd.to_timedelta(np.minimum(repair_days, 730), unit='D')
+        case_age_days = np.floor((open_at - date_requested) / pd.Timedelta(days=1))
+        status = np.where(rng.random(n) < 0.7, 'New', 'In Process')
+        date_closed = np.full(n, None, dtype=object)
+
+    # the quirks of the real files: zip+4 codes, missing districts and missing locations
+    zip_plus_four = rng.random(n) < 0.02
+    zipcode[zip_plus_four] = [f"{z}-{rng.integers(1000, 9999)}" for z in zipcode[zip_plus_four]]
+    district[rng.random(n) < 0.005] = np.nan
+    missing_location = rng.random(n) < 0.01
+    lat[missing_location] = np.nan
+    lng[missing_location] = np.nan
+
+    return pd.DataFrame({
+        'service_request_id': np.arange(first_id, first_id + n),
+        'service_request_parent_id': np.nan,
+        'date_requested': pd.DatetimeIndex(date_requested).strftime('%Y-%m-%dT%H:%M:%S'),
+        'case_age_days': case_age_days,
+        'service_name': service_name,
+        'service_name_detail': service_name_detail,
+        'date_closed': date_closed,
+        'status': status,
+        'lat': lat.round(6),
+        'lng': lng.round(6),
+        'street_address': [f"{number} {street} ST" for number, street in
+                           zip(rng.integers(100, 9999, size=n), rng.integers(1, 60, size=n))],
+        'zipcode': zipcode,
+        'council_district': district,
+        'comm_plan_name': community_names[community],
+        'park_name': None,
+        'case_origin': rng.choice(['Mobile', 'Web', 'Phone'], size=n, p=[0.6, 0.3, 0.1]),
+        'public_description': 'synthetic request',
+    }, columns=REQUEST_COLUMNS + ['public_description'])
+
+
+def _write_requests(file_name, rng, n, hotspots, first_id, **kwargs):
+    for start in range(0, n, WRITE_CHUNK_ROWS):
+        chunk = generate_requests(rng, min(WRITE_CHUNK_ROWS, n - start), hotspots, first_id + start, **kwargs)
+        chunk.to_csv(file_name, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def write_promise_zone(file_name, vertices=PROMISE_ZONE_VERTICES, seed=0):
+    """
+    writes a Promise Zone GeoJSON with the outline densified to about as many vertices as the real boundary
+        Args:
+            file_name: path of the geojson file
+            vertices: the number of boundary vertices
+            seed: random seed for the small wiggles along the boundary
+    """
+    rng = np.random.default_rng(seed)
+    outline = np.array(PROMISE_ZONE_OUTLINE)
+    per_edge = max(vertices // (len(outline) - 1), 1)
+    points = []
+    for start, end in zip(outline[:-1], outline[1:]):
+        steps = np.linspace(0, 1, per_edge, endpoint=False)[:, None]
+        points.append(start + steps * (end - start) + rng.normal(scale=0.0002, size=(per_edge, 2)) * (steps > 0))
+    ring = np.concatenate(points + [outline[:1]]).round(6).tolist()
+    geojson = {'type': 'FeatureCollection', 'name': 'promise_zone_datasd',
+               'crs': {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:OGC:1.3:CRS84'}},
+               'features': [{'type': 'Feature', 'properties': {'objectid': 1, 'name': 'San Diego Promise Zone'},
+                             'geometry': {'type': 'Polygon', 'coordinates': [ring]}}]}
+    with open(file_name, 'w') as f:
+        json.dump(geojson, f)
+
+
+def write_synthetic_data(scale=1, years=SYNTHETIC_YEARS, data_dir=DATA_DIR, seed=0):
+    """
+    writes a synthetic open requests file, one closed requests file per year and a Promise Zone GeoJSON
+        Args:
+            scale: size as a multiple of a real year
+            years: the years of closed requests files to write
+            data_dir: the directory to write to, the file names are the ones the loaders read
+            seed: random seed, the same seed and scale always give the same files
+        Returns: list of the files written
+    """
+    rng = np.random.default_rng(seed)
+    hotspots = _hotspots(rng)
+    os.makedirs(data_dir, exist_ok=True)
+    file_names = []
+    for year in years:
+        file_name = os.path.join(data_dir, os.path.basename(closed_requests_file(year)))
+        _write_requests(file_name, rng, int(REAL_YEAR_ROWS * scale), hotspots, first_id=year * 10**8, closed_in=year)
+        file_names.append(file_name)
+    file_name = os.path.join(data_dir, os.path.basename(OPEN_REQUESTS_FILE))
+    _write_requests(file_name, rng, int(REAL_OPEN_ROWS * scale), hotspots, first_id=9 * 10**10, open_at=SNAPSHOT_DATE)
+    file_names.append(file_name)
+    file_name = os.path.join(data_dir, 'promise_zone_datasd.geojson')
+    write_promise_zone(file_name, seed=seed)
+    file_names.append(file_name)
+    return file_names
+
+
+if __name__ == "__main__":
+    # python synthetic_data.py [scale=<multiple of a real year>] [data_dir=<directory>] [seed=<n>]
+    options = dict(arg.split('=', 1) for arg in sys.argv[1:] if '=' in arg)
+    for file_name in write_synthetic_data(scale=float(options.get('scale', 1)),
+                                          data_dir=options.get('data_dir', DATA_DIR),
+                                          seed=int(options.get('seed', 0))):
+        print(f"wrote {file_name}")
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from activity_cube import _closed_years, build_cube
+from data_loading import REQUEST_COLUMNS, closed_requests_file
+
+SERVICES = ['Street Light Maintenance', 'Graffiti', 'Pothole']
+
+
+def _write_requests(file_name, rng, n, start, end):
+    requests = pd.DataFrame({column: np.nan for column in REQUEST_COLUMNS}, index=range(n))
+    requests['service_request_id'] = rng.integers(1, 10**8, size=n)
+    requests['service_name'] = rng.choice(SERVICES, size=n)
+    requests['service_name_detail'] = 'OTHER'
+    requests['status'] = 'Closed'
+    requests['date_requested'] = (pd.Timestamp(start) + pd.to_timedelta(
+        rng.integers(0, (pd.Timestamp(end) - pd.Timestamp(start)).days * 24, size=n), unit='h')).astype(str)
+    requests['lat'] = 32.74 + rng.normal(scale=0.01, size=n)
+    requests['lng'] = -117.13 + rng.normal(scale=0.01, size=n)
+    requests.loc[:4, ['lat', 'lng']] = np.nan                   # no location
+    requests.loc[5, ['lat', 'lng']] = (34.05, -118.24)          # outside the city
+    requests['street_address'] = '1200 MARKET ST'
+    requests['council_district'] = 3
+    requests['zipcode'] = 92101
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    requests.to_csv(file_name, index=False)
+    return requests
+
+
+def test_closed_years():
+    files = ['data/get_it_done_requests_open_datasd.csv', 'data/get_it_done_requests_closed_2019_datasd.csv',
+             'data/get_it_done_requests_closed_2022_datasd.csv']
+    assert _closed_years(files) == [2019, 2022]
+
+
+def test_box_counts_match_brute_force(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    requests = pd.concat([_write_requests('data/get_it_done_requests_open_datasd.csv', rng, 120, '2022-06-01', '2022-09-01'),
+                          _write_requests(closed_requests_file(2021), rng, 300, '2021-01-01', '2022-01-01'),
+                          _write_requests(closed_requests_file(2022), rng, 200, '2022-01-01', '2022-06-01')],
+                         ignore_index=True)
+    cube = build_cube('data/cache/cube.npy', cell_size=200, services=SERVICES)
+
+    inside = requests['lat'].between(32.5, 33.15) & requests['lng'].between(-117.35, -116.85)
+    requests = requests[inside].reset_index(drop=True)
+    assert cube.box_counts(0, cube.n_x, 0, cube.n_y, 0, cube.n_days).item() == len(requests)
+
+    ix, iy = cube.cells(requests['lat'], requests['lng'])
+    it = (pd.to_datetime(requests['date_requested']).dt.floor('D').to_numpy(dtype='datetime64[D]')
+          - cube.day0).astype(np.int64)
+    service = requests['service_name'].to_numpy()
+    boxes = np.column_stack([np.sort(rng.integers(-2, cube.n_x + 2, size=(50, 2)), axis=1),
+                             np.sort(rng.integers(-2, cube.n_y + 2, size=(50, 2)), axis=1),
+                             np.sort(rng.integers(-2, cube.n_days + 2, size=(50, 2)), axis=1)])
+    for services in [None, 'Graffiti', ['Street Light Maintenance', 'Pothole']]:
+        wanted = np.isin(service, SERVICES if services is None else np.atleast_1d(services))
+        expected = [int(((ix >= x0) & (ix < x1) & (iy >= y0) & (iy < y1) & (it >= t0) & (it < t1) & wanted).sum())
+                    for x0, x1, y0, y1, t0, t1 in boxes]
+        assert cube.box_counts(*boxes.T, services=services).tolist() == expected
+
+    # a point just west of the grid still sees the cells of its square on the grid, an unlocated point sees none
+    west = requests.loc[requests['lng'].idxmin()]
+    counts = cube.near_counts([west['lat'], np.nan], [west['lng'] - 0.001, -117.13], radius=200, units='m')
+    assert counts.tolist()[1] == 0 and counts[0] >= 1
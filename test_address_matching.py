@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from address_matching import parse_address
+from crime_counts import count_crimes_near, read_crime_data
+
+
+@pytest.mark.parametrize('address, parsed', [
+    ('1234 University Ave #3', (1200.0, '', 'UNIVERSITY', 'AVE')),
+    ('1234 University Ave Apt. 5', (1200.0, '', 'UNIVERSITY', 'AVE')),
+    ('4500 El Cajon Blvd Ste 200, San Diego', (4500.0, '', 'EL CAJON', 'BLVD')),
+    ('100 Fifth Avenue Unit B', (100.0, '', '5TH', 'AVE')),
+    ('1200 BLOCK MARKET ST', (1200.0, '', 'MARKET', 'ST')),
+    ('1234 n Market Street, San Diego', (1200.0, 'N', 'MARKET', 'ST')),
+    ('300 E ST', (300.0, '', 'E', 'ST')),
+    ('5th Ave & Market St', (np.nan, '', '5TH', 'AVE')),
+    ('2200 05TH AVENUE', (2200.0, '', '5TH', 'AVE')),
+])
+def test_parse_address(address, parsed):
+    block, *rest = parse_address(address)
+    assert (np.isnan(block) and np.isnan(parsed[0])) or block == parsed[0]
+    assert tuple(rest) == parsed[1:]
+
+
+def test_parse_address_of_missing_value():
+    block, *rest = parse_address(None)
+    assert np.isnan(block) and rest == ['', '', '']
+
+
+def test_count_crimes_near_counts_night_crimes_on_the_block_after_the_light():
+    lights = pd.DataFrame({'street_address': ['1234 University Ave #3', '500 Market Street', None],
+                           'date_requested': pd.to_datetime(['2022-01-10 09:00', '2022-01-10 09:00', '2022-01-10 09:00'])})
+    crimes = pd.DataFrame({'address': ['1200 BLOCK UNIVERSITY AV', '1200 BLOCK UNIVERSITY AV',
+                                       '1200 BLOCK UNIVERSITY AV', '1300 BLOCK UNIVERSITY AV',
+                                       '500 BLOCK MARKET ST', '500 BLOCK MARKET ST'],
+                           'when': pd.to_datetime(['2022-01-12 23:00',   # night, after: counts
+                                                   '2022-01-12 13:00',   # daytime
+                                                   '2022-01-05 23:00',   # before the light
+                                                   '2022-01-12 23:00',   # next block
+                                                   '2022-01-15 02:00',   # night, after: counts
+                                                   '2022-01-16 21:30'])})  # night, after: counts
+    counts = count_crimes_near(lights, crimes, address_column='address', date_column='when')
+    assert counts.tolist() == [1, 2, 0]
+
+
+def test_read_crime_data_names_the_columns_when_the_date_column_is_missing(tmp_path):
+    crime_file = tmp_path / 'crimes.txt'
+    pd.DataFrame({'BLOCK_ADDRESS': ['500 BLOCK MARKET ST'], 'date': ['2022-01-15 02:00']}).to_csv(crime_file, index=False)
+    with pytest.raises(ValueError, match='date'):
+        read_crime_data(str(crime_file))
+    assert len(read_crime_data(str(crime_file), date_column='date')) == 1
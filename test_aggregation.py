@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregation import aggregate
+
+STATISTICS = ['median', 'count', 'mean', 'std']
+GROUPINGS = {'city_wide': ['year'], 'district_by_year': ['year', 'council_district'],
+             'district': ['council_district'], 'zipcode': ['zipcode'], 'community': ['comm_plan_name']}
+
+
+def _requests(seed=0, n=500):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'year': rng.choice([2019, 2020, 2021], size=n),
+                       'council_district': rng.choice([1.0, 2.0, 3.0, np.nan], size=n),
+                       'zipcode': rng.choice([92101.0, 92104.0, 92105.0, np.nan], size=n).astype('float32'),
+                       'comm_plan_name': pd.Categorical(rng.choice(['Downtown', 'North Park', None], size=n)),
+                       'case_age_days': rng.integers(0, 300, size=n).astype('float64')})
+    df.loc[rng.random(n) < 0.1, 'case_age_days'] = np.nan
+    # a one row group (std nan), an even sized group and a group whose only values are missing
+    extra = pd.DataFrame({'year': [2022, 2023, 2023, 2024], 'council_district': [9.0, 8.0, 8.0, 7.0],
+                          'zipcode': np.array([92199.0, 92198.0, 92198.0, 92197.0], dtype='float32'),
+                          'comm_plan_name': pd.Categorical(['Solo', 'Pair', 'Pair', 'Empty']),
+                          'case_age_days': [4.0, 1.0, 4.0, np.nan]})
+    return pd.concat([df, extra], ignore_index=True)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_aggregate_matches_groupby_agg(seed):
+    df = _requests(seed)
+    tables = aggregate(df, 'case_age_days', GROUPINGS, statistics=STATISTICS)
+    assert set(tables) == set(GROUPINGS)
+    for name, keys in GROUPINGS.items():
+        expected = df.groupby(keys, observed=True)['case_age_days'].agg(STATISTICS).reset_index()
+        pd.testing.assert_frame_equal(tables[name].astype({key: object for key in keys}),
+                                      expected.astype({key: object for key in keys}), check_dtype=False)
+
+
+def test_aggregate_edge_groups():
+    table = aggregate(_requests(), 'case_age_days', {'community': ['comm_plan_name']},
+                      statistics=STATISTICS)['community'].set_index('comm_plan_name')
+    assert table.loc['Solo', 'count'] == 1 and np.isnan(table.loc['Solo', 'std'])
+    # an even count takes the average of the two middle values, as groupby does
+    assert table.loc['Pair', 'median'] == 2.5 and table.loc['Pair', 'std'] == pytest.approx(np.std([1, 4], ddof=1))
+    assert table.loc['Empty', 'count'] == 0 and np.isnan(table.loc['Empty', 'median'])
+
+
+def test_aggregate_without_keys_and_with_labels():
+    df = _requests()
+    table = aggregate(df, 'case_age_days', {'all': []}, labels={'median': 'Median Time to Repair'})['all']
+    assert table['Median Time to Repair'].item() == df['case_age_days'].median()
+    assert table['count'].item() == df['case_age_days'].notna().sum()
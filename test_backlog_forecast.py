@@ -0,0 +1,50 @@
+import warnings
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from backlog_forecast import PERCENTILES, _bands, fit_backlog_model
+
+
+def test_bands_of_weeks_without_repairs_are_nan_and_quiet():
+    model = SimpleNamespace(start=pd.Timestamp('2022-10-02'), districts=np.array([1.0, 2.0]))
+    scenario = {'name': 'baseline', 'capacity': 1.0, 'policy': 'historic'}
+    # weeks x simulations x (districts + all), district 2 has no repairs in any simulation
+    values = np.random.default_rng(0).uniform(1, 30, size=(3, 50, 3))
+    values[:, :, 1] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        bands = _bands(values, model, scenario, 'median_wait')
+    assert len(bands) == 3 * 3
+    no_repairs = bands['council_district'].eq(2)
+    assert bands.loc[no_repairs, [f"p{percentile}" for percentile in PERCENTILES]].isna().all().all()
+    assert bands.loc[~no_repairs, [f"p{percentile}" for percentile in PERCENTILES]].notna().all().all()
+
+
+def _censored_requests(rng, n, hazard, max_age_weeks):
+    """
+    requests whose repair week is geometric with the given weekly hazard, each seen at a random current age:
+    repaired before it they are closed, otherwise still open at that age
+    """
+    repair_weeks = rng.geometric(hazard, size=n) - 1
+    current_weeks = rng.integers(1, 2 * max_age_weeks, size=n)
+    closed = repair_weeks < current_weeks
+    requests = pd.DataFrame({'council_district': rng.choice([1.0, 2.0], size=n),
+                             'case_age_days': np.where(closed, repair_weeks, current_weeks) * 7 + 3.0,
+                             'date_requested': pd.Timestamp('2022-01-01'),
+                             'date_closed': pd.Timestamp('2022-06-01')})
+    return requests[closed], requests[~closed].drop(columns='date_closed')
+
+
+def test_fit_recovers_a_geometric_hazard_with_censored_requests():
+    rng = np.random.default_rng(0)
+    hazard, max_age_weeks = 0.1, 20
+    historic_lights, open_lights = _censored_requests(rng, 40000, hazard, max_age_weeks)
+    # a large share are still open, leaving them out makes the early weeks look much faster
+    assert len(open_lights) > len(historic_lights) / 4
+    model = fit_backlog_model(historic_lights, open_lights, max_age_weeks=max_age_weeks)
+    assert model.districts == [1.0, 2.0]
+    np.testing.assert_allclose(model.hazard[:, :10], hazard, atol=0.015)
+    np.testing.assert_allclose(model.hazard[:, -1], hazard, atol=0.015)
+    assert model.initial_backlog.sum() == len(open_lights)
@@ -0,0 +1,167 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_loading
+from aggregation import aggregate
+from data_loading import (REQUEST_COLUMNS, cache_requests, compact_requests, concat_requests, read_closed_requests,
+                          read_requests, type_requests)
+from scoring import add_weighting_factors, historic_factor_tables
+
+SERVICES = ['Street Light Maintenance', 'Graffiti', 'Pothole']
+STATUSES = ['Closed', 'Referred', 'In Process', None]
+
+
+def _write_requests(file_name, n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    requests = pd.DataFrame({
+        'service_request_id': np.arange(n) + 1000 * seed,
+        'service_request_parent_id': np.where(rng.random(n) < 0.1, 7, np.nan),
+        'date_requested': (pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(0, 8760, size=n), unit='h')).astype(str),
+        'case_age_days': rng.integers(0, 400, size=n),
+        'service_name': rng.choice(SERVICES, size=n),
+        'service_name_detail': rng.choice(['STREET LIGHT OUT', 'OTHER'], size=n),
+        'date_closed': '2022-01-15 00:00:00',
+        'status': rng.choice(np.array(STATUSES, dtype=object), size=n),
+        'lat': 32.7 + rng.random(n) / 10,
+        'lng': -117.1 - rng.random(n) / 10,
+        'street_address': rng.choice(['1200 MARKET ST', '300 E ST', '4500 EL CAJON BLVD'], size=n),
+        'zipcode': rng.choice(['92101', '92104-1234', 92105], size=n),
+        'council_district': rng.choice([1, 3, 9, np.nan], size=n),
+        'comm_plan_name': rng.choice(['Downtown', 'North Park'], size=n),
+        'park_name': np.nan,
+        'case_origin': 'Mobile',
+    })
+    os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+    requests.to_csv(file_name, index=False)
+    return file_name
+
+
+@pytest.fixture
+def request_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return _write_requests(os.path.join('data', 'requests.csv'))
+
+
+def _cache_mtime():
+    return os.stat(os.path.join('data', 'cache', 'requests.parquet')).st_mtime_ns
+
+
+def test_read_closed_requests_of_no_years_is_empty():
+    requests = read_closed_requests([], service_names=['Street Light Maintenance'], memory_limit_mb=64)
+    assert requests.empty
+    assert list(requests.columns) == REQUEST_COLUMNS + ['year']
+
+
+def test_touched_or_rewritten_csv_rebuilds_the_cache(request_file):
+    cache_requests(request_file)
+    built = _cache_mtime()
+    cache_requests(request_file)
+    assert _cache_mtime() == built
+
+    stat = os.stat(request_file)
+    os.utime(request_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache_requests(request_file)
+    assert _cache_mtime() > built
+
+    _write_requests(request_file, n=50, seed=1)
+    assert read_requests(request_file)['service_request_id'].tolist() == list(range(1000, 1050))
+
+
+def test_verify_hash_catches_an_edit_that_keeps_size_and_mtime(request_file):
+    assert read_requests(request_file, verify_hash=True)['service_request_id'].iloc[0] == 0
+    stat = os.stat(request_file)
+    with open(request_file, 'r+') as f:
+        text = f.read()
+        first_id = text.index('\n') + 1
+        f.seek(first_id)
+        f.write('9')
+    os.utime(request_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert read_requests(request_file)['service_request_id'].iloc[0] == 0
+    assert read_requests(request_file, verify_hash=True)['service_request_id'].iloc[0] == 9
+
+
+def test_verify_hash_keeps_the_cache_of_a_touched_file(request_file):
+    cache_requests(request_file, verify_hash=True)
+    built = _cache_mtime()
+    stat = os.stat(request_file)
+    os.utime(request_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache_requests(request_file, verify_hash=True)
+    assert _cache_mtime() == built
+
+
+def _pandas_filtered(file_name, columns, service_names, exclude_status):
+    requests = type_requests(pd.read_csv(file_name, low_memory=False))
+    requests = requests[requests['service_name'].isin(service_names) & ~requests['status'].isin(exclude_status)]
+    return requests[columns].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('have_pyarrow', [True, False])
+def test_pushed_down_filters_match_pandas(request_file, monkeypatch, have_pyarrow):
+    monkeypatch.setattr(data_loading, 'HAVE_PYARROW', have_pyarrow and data_loading.HAVE_PYARROW)
+    columns = ['service_request_id', 'date_requested', 'case_age_days', 'service_name', 'lat', 'zipcode']
+    filters = {'service_names': ['Street Light Maintenance', 'Pothole'], 'exclude_status': ['Referred']}
+    read = read_requests(request_file, columns=columns, compact=False, **filters)
+    expected = _pandas_filtered(request_file, columns, filters['service_names'], filters['exclude_status'])
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(read, expected, check_dtype=False)
+    assert os.path.exists(os.path.join('data', 'cache', 'requests.parquet')) == data_loading.HAVE_PYARROW
+
+
+def _typed_requests(service_names, streets, districts, zipcodes):
+    return type_requests(pd.DataFrame({'service_request_id': np.arange(len(service_names)),
+                                       'service_name': service_names, 'street_address': streets,
+                                       'council_district': districts, 'zipcode': zipcodes,
+                                       'case_age_days': np.arange(len(service_names)) * 10.0,
+                                       'comm_plan_name': ['Downtown'] * len(service_names)}))
+
+
+def test_concat_of_different_categories_stays_categorical_and_round_trips():
+    first = _typed_requests(['Graffiti', 'Pothole', 'Graffiti', None], ['1200 MARKET ST'] * 4, [3, 3, 9, np.nan],
+                            ['92101', '92101-1234', 92105, None])
+    second = _typed_requests(['Street Light Maintenance'] * 2, ['300 E ST'] * 2, [1, 1], [92104, 92104])
+    expected = pd.concat([first, second], ignore_index=True)
+    combined = concat_requests([compact_requests(first.copy()), compact_requests(second.copy())])
+    for column in ['service_name', 'street_address']:
+        assert isinstance(combined[column].dtype, pd.CategoricalDtype)
+        assert combined[column].astype(object).equals(expected[column].astype(object))
+    for column in ['council_district', 'zipcode', 'case_age_days']:
+        assert combined[column].dtype == 'float32'
+        np.testing.assert_array_equal(combined[column].to_numpy('float64'), expected[column].to_numpy())
+    assert combined['service_request_id'].tolist() == expected['service_request_id'].tolist()
+
+
+def test_float32_keys_join_the_float64_zone_and_factor_tables():
+    historic = compact_requests(_typed_requests(['Street Light Maintenance'] * 6, ['1200 MARKET ST'] * 6,
+                                                [1, 1, 3, 3, 9, 9], [92101, 92101, 92104, 92104, 92105, 92105]))
+    tables = aggregate(historic, 'case_age_days',
+                       {'district': ['council_district'], 'zipcode': ['zipcode'], 'community': ['comm_plan_name']},
+                       labels={'median': 'Median Time to Repair', 'count': 'Count'})
+    district_data, zipcode_data, community_data = historic_factor_tables(tables, min_count=1)
+    # the income table has int64 districts, all three must survive its inner join
+    assert sorted(district_data['Council District'].tolist()) == [1, 3, 9]
+
+    # open requests keep float64 keys when they are read without compacting
+    open_lights = pd.DataFrame({'council_district': [1.0, 3.0, 9.0], 'zipcode': [92101.0, 92104.0, 92105.0],
+                                'comm_plan_name': ['Downtown'] * 3, 'name': 'Rest of City',
+                                'number_safety_related_near': [0, 1, 2], 'case_age_days': [5.0, 6.0, 7.0]})
+    scored = add_weighting_factors(open_lights, district_data, zipcode_data, community_data)
+    expected = district_data.set_index('Council District')['district_weighting_factor']
+    assert scored['district_weighting_factor'].tolist() == expected.loc[[1, 3, 9]].tolist()
+    assert scored['zipcode_weighting_factor'].tolist() == [0.0, 0.5, 1.0]
+    assert (historic['zipcode'] == np.float64(92104)).sum() == 2
+    assert (historic['council_district'] == 9).sum() == 2
+
+
+@pytest.mark.parametrize('compact', [True, False])
+def test_streamed_read_matches_cached_read(request_file, compact):
+    filters = {'service_names': ['Street Light Maintenance', 'Graffiti'], 'exclude_status': ['Referred']}
+    cached = read_requests(request_file, compact=compact, **filters)
+    streamed = read_requests(request_file, compact=compact, streaming=True, chunk_rows=17, **filters)
+    assert len(streamed) == len(cached) > 0
+    for column in cached.columns:
+        if isinstance(cached[column].dtype, pd.CategoricalDtype):
+            assert isinstance(streamed[column].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(streamed.astype(object), cached.astype(object))
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import pipeline
+from pipeline import project_stages, run_pipeline
+from synthetic_data import write_synthetic_data
+
+YEARS = [2020, 2021]
+CURRENT_YEAR = 2022
+ALL_STAGES = ['load', 'filter', 'zone_tag', 'safety_count', 'aggregate', 'factorize', 'score', 'report']
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_synthetic_data(scale=0.002, years=YEARS + [CURRENT_YEAR])
+    return tmp_path
+
+
+@pytest.fixture
+def loaded_stages(monkeypatch):
+    loaded = []
+    load_artifact = pipeline._load_artifact
+
+    def spy(stage_name, fingerprint, cache_dir):
+        loaded.append(stage_name)
+        return load_artifact(stage_name, fingerprint, cache_dir)
+    monkeypatch.setattr(pipeline, '_load_artifact', spy)
+    return loaded
+
+
+def _run(**kwargs):
+    stages = project_stages(years=YEARS, current_year=CURRENT_YEAR, output_file='graphs/prioritized.csv', **kwargs)
+    return run_pipeline(stages, targets=['score', 'report'], workers=2)
+
+
+def test_weights_change_reruns_only_score_and_report(data_dir, loaded_stages):
+    outputs, run_stages = _run()
+    assert sorted(run_stages) == sorted(ALL_STAGES)
+    weights = {'promise_zone_weighting': 1.0, 'safety_weighting_factor': 0.0, 'age_weighting_factor': 0.0,
+               'district_weighting_factor': 0.0, 'zipcode_weighting_factor': 0.0, 'community_weighting_factor': 0.0}
+    outputs, run_stages = _run(weights=weights)
+    assert sorted(run_stages) == ['report', 'score']
+    assert loaded_stages == ['factorize']
+    assert outputs['score']['combined_priority'].is_monotonic_decreasing
+    assert pd.read_csv('graphs/prioritized.csv')['service_request_id'].tolist() \
+        == outputs['score']['service_request_id'].tolist()
+
+
+def test_radius_change_reruns_safety_count_and_its_downstream_stages(data_dir, loaded_stages):
+    _run()
+    _, run_stages = _run(radius=300)
+    assert sorted(run_stages) == ['factorize', 'report', 'safety_count', 'score']
+    assert sorted(loaded_stages) == ['aggregate', 'filter', 'zone_tag']
+
+
+def test_fresh_stages_are_not_loaded_when_nothing_downstream_is_stale(data_dir, loaded_stages):
+    first, _ = _run()
+    outputs, run_stages = _run()
+    assert run_stages == []
+    assert sorted(loaded_stages) == ['report', 'score']
+    pd.testing.assert_frame_equal(outputs['score'], first['score'])
+
+    # a missing report file reruns only the report, from the cached scores
+    loaded_stages.clear()
+    (data_dir / 'graphs' / 'prioritized.csv').unlink()
+    _, run_stages = _run()
+    assert run_stages == ['report']
+    assert loaded_stages == ['score']
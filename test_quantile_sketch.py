@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quantile_sketch
+from data_loading import REQUEST_COLUMNS, STREET_LIGHT_SERVICE, closed_requests_file
+from quantile_sketch import QuantileSketch, sketch_table, update_sketch_store
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+
+def _years_of_values(seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.lognormal(mean=3 + year / 10, sigma=1, size=size) for year, size in enumerate([400, 1000, 701])]
+
+
+@pytest.mark.parametrize('alpha', [0.01, 0.05])
+def test_merged_quantiles_are_within_alpha(alpha):
+    years = _years_of_values()
+    merged = QuantileSketch(alpha)
+    for values in years:
+        merged.merge(QuantileSketch(alpha).add(values))
+    every_value = np.concatenate(years)
+    for q in QUANTILES:
+        # the sketch answers for the value at rank floor(q * (n - 1))
+        assert merged.quantile(q) == pytest.approx(np.quantile(every_value, q, method='lower'), rel=alpha)
+
+
+def test_merging_equals_sketching_the_concatenated_data():
+    years = _years_of_values(1)
+    years[1][:20] = 0
+    years[2][:30] = -years[2][:30]
+    for exact in [False, True]:
+        merged = QuantileSketch(exact=exact)
+        for values in years:
+            merged.merge(QuantileSketch(exact=exact).add(values))
+        whole = QuantileSketch(exact=exact).add(np.concatenate(years))
+        assert merged.count == whole.count == sum(len(values) for values in years)
+        assert (merged.zero_count, merged.positive, merged.negative) == (whole.zero_count, whole.positive, whole.negative)
+        assert [merged.quantile(q) for q in QUANTILES] == [whole.quantile(q) for q in QUANTILES]
+
+
+def test_even_count_median_is_a_bucket_value():
+    assert QuantileSketch(exact=True).add([10, 20]).quantile(0.5) == 15
+    assert QuantileSketch(0.01).add([10, 20]).quantile(0.5) == pytest.approx(10, rel=0.01)
+
+
+def _write_closures(year, n, seed):
+    rng = np.random.default_rng(seed)
+    requests = pd.DataFrame({column: np.nan for column in REQUEST_COLUMNS}, index=range(n))
+    requests['service_request_id'] = np.arange(n)
+    requests['service_name'] = STREET_LIGHT_SERVICE
+    requests['status'] = 'Closed'
+    requests['date_requested'] = f"{year}-03-01 08:00:00"
+    requests['case_age_days'] = rng.integers(1, 200, size=n)
+    requests['council_district'] = rng.choice([1, 3, 9], size=n)
+    requests['zipcode'] = rng.choice([92101, 92104], size=n)
+    os.makedirs('data', exist_ok=True)
+    requests.to_csv(closed_requests_file(year), index=False)
+
+
+def test_changed_source_or_settings_resketch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reads = []
+    read = quantile_sketch.read_street_light_requests
+    monkeypatch.setattr(quantile_sketch, 'read_street_light_requests',
+                        lambda years, **kwargs: reads.append(list(years)) or read(years, **kwargs))
+    _write_closures(2021, 50, 0)
+    _write_closures(2022, 30, 1)
+    groupings = {'district': ['council_district']}
+    store_file = 'data/sketches.json'
+
+    def district_count():
+        store = update_sketch_store([2021, 2022], groupings, store_file=store_file, workers=1)
+        return sketch_table(store, 'district', ['council_district'], [2021, 2022])['count'].sum()
+
+    assert district_count() == 80 and reads == [[2021, 2022]]
+    assert district_count() == 80 and len(reads) == 1
+
+    # the current year's file grows
+    _write_closures(2022, 45, 2)
+    assert district_count() == 95 and reads[-1] == [2022]
+
+    # a touch alone is enough, as with the Parquet cache
+    stat = os.stat(closed_requests_file(2021))
+    os.utime(closed_requests_file(2021), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert district_count() == 95 and reads[-1] == [2021]
+
+    # other key columns for the grouping
+    store = update_sketch_store([2021, 2022], {'district': ['zipcode']}, store_file=store_file, workers=1)
+    assert reads[-1] == [2021, 2022]
+    assert set(sketch_table(store, 'district', ['zipcode'], [2021, 2022])['zipcode']) == {92101, 92104}
+
+    # other filters, while loader options that do not change the rows are ignored
+    update_sketch_store([2021, 2022], {'district': ['zipcode']}, store_file=store_file, workers=1, streaming=True)
+    assert len(reads) == 4
+    update_sketch_store([2021, 2022], {'district': ['zipcode']}, store_file=store_file, workers=1,
+                        columns=['case_age_days', 'zipcode', 'council_district', 'date_requested'])
+    assert len(reads) == 5
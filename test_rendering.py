@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pytest
+
+from rendering import FigureJob, histogram_figure, render_figures
+
+
+@pytest.fixture
+def graph_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('graphs')
+    return 'graphs'
+
+
+def _histogram_job(values, output_file=os.path.join('graphs', 'ages.png')):
+    return FigureJob(histogram_figure, output_file, values=values, bins=10, xlabel='Days', ylabel='Count',
+                     figsize=(4, 3))
+
+
+def test_unchanged_job_is_skipped(graph_dir):
+    values = np.arange(50.0)
+    assert render_figures([_histogram_job(values)], workers=1) == [os.path.join('graphs', 'ages.png')]
+    rendered_at = os.stat(os.path.join('graphs', 'ages.png')).st_mtime_ns
+    assert render_figures([_histogram_job(values.copy())], workers=1) == []
+    assert os.stat(os.path.join('graphs', 'ages.png')).st_mtime_ns == rendered_at
+    assert render_figures([_histogram_job(values)], workers=1, force=True) == [os.path.join('graphs', 'ages.png')]
+
+
+def test_changed_data_or_missing_output_is_rendered_again(graph_dir):
+    values = np.arange(50.0)
+    other_file = os.path.join('graphs', 'other.png')
+    jobs = [_histogram_job(values), _histogram_job(values * 2, other_file)]
+    assert len(render_figures(jobs, workers=1)) == 2
+
+    values[0] = -1.0
+    assert render_figures(jobs, workers=1) == [os.path.join('graphs', 'ages.png')]
+
+    os.remove(other_file)
+    assert render_figures(jobs, workers=1) == [other_file]
+    assert os.path.exists(other_file)
+    assert render_figures(jobs, workers=1) == []
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from safety_counts import (add_safety_counts, count_safety_near, count_safety_near_loop, load_safety_state,
+                           update_safety_counts)
+
+
+def _requests(rows):
+    return pd.DataFrame(rows, columns=['lat', 'lng', 'date_requested']).assign(
+        date_requested=lambda df: pd.to_datetime(df['date_requested'], format='ISO8601'))
+
+
+def _random_requests(rng, n):
+    return pd.DataFrame({'lat': 32.72 + rng.normal(scale=0.002, size=n),
+                         'lng': -117.15 + rng.normal(scale=0.002, size=n),
+                         'date_requested': pd.Timestamp('2022-01-01')
+                                           + pd.to_timedelta(rng.integers(0, 90 * 24, size=n), unit='h')})
+
+
+def test_indexed_count_matches_loop_on_edge_cases():
+    lights = _requests([
+        (32.7150, -117.1600, '2022-03-01 12:00'),
+        (32.7150, -117.1600, '2022-03-01 12:00'),   # same place and time as the light above
+        (32.7480, -117.1000, '2022-01-15 08:00'),
+        (np.nan, np.nan, '2022-02-01 09:00'),       # no location
+        (32.7970, -117.2400, None),                 # no date
+    ])
+    safety_reports = _requests([
+        (32.7150, -117.1600, '2022-03-01 12:00:00'),   # same location, same time: not after the light
+        (32.7150, -117.1600, '2022-03-01 12:00:01'),
+        (32.7151, -117.1601, '2022-04-01 00:00'),
+        (32.7150, -117.1590, '2022-05-01 00:00'),   # about 94 m away, outside 150 ft
+        (32.7481, -117.1000, '2022-01-15 07:59'),   # just before the light
+        (32.7481, -117.1000, '2022-01-16 07:59'),
+        (np.nan, np.nan, '2022-06-01 00:00'),
+        (32.7970, -117.2400, '2022-06-01 00:00'),
+        (32.7970, -117.2400, None),
+    ])
+    indexed = count_safety_near(lights, safety_reports)
+    assert indexed.tolist() == count_safety_near_loop(lights, safety_reports).tolist()
+    assert indexed.tolist() == [2, 2, 1, 0, 0]
+
+
+def test_indexed_count_matches_loop_on_random_sample():
+    rng = np.random.default_rng(0)
+    lights, safety_reports = _random_requests(rng, 150), _random_requests(rng, 400)
+    indexed = count_safety_near(lights, safety_reports)
+    assert indexed.tolist() == count_safety_near_loop(lights, safety_reports).tolist()
+    assert indexed.sum() > 0
+
+
+def test_full_run_seeds_incremental_state(tmp_path):
+    rng = np.random.default_rng(1)
+    lights, reports = _random_requests(rng, 60), _random_requests(rng, 200)
+    lights['service_request_id'] = np.arange(len(lights))
+    lights['service_name_detail'] = 'STREET LIGHT OUT'
+    state_file = str(tmp_path / 'state.csv')
+
+    full = add_safety_counts(lights.copy(), reports, state_file=state_file)
+    state, settings = load_safety_state(state_file)
+    assert settings['watermark'] == reports['date_requested'].max()
+    assert np.array_equal(state.to_numpy(), full['number_safety_related_near'].to_numpy())
+
+    later = reports.assign(date_requested=reports['date_requested'] + pd.Timedelta(days=400))
+    combined = pd.concat([reports, later], ignore_index=True)
+    incremental = update_safety_counts(lights.copy(), combined, state_file=state_file)
+    expected = count_safety_near(lights, combined)
+    assert np.array_equal(incremental['number_safety_related_near'].to_numpy(), expected)
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from neighbor_query import project_lat_lng, to_meters
+from safety_counts import SAFETY_SERVICE_NAMES, count_safety_near
+from safety_features import _service_label, _window_label, safety_features
+
+SERVICES = SAFETY_SERVICE_NAMES[:3]
+
+
+def _lights(rows):
+    lights = pd.DataFrame(rows, columns=['lat', 'lng', 'date_requested'])
+    lights['date_requested'] = pd.to_datetime(lights['date_requested'], format='ISO8601')
+    lights['service_request_id'] = np.arange(len(lights)) + 100
+    lights['service_name_detail'] = 'STREET LIGHT OUT'
+    return lights
+
+
+def _reports(rows, service_names):
+    reports = pd.DataFrame(rows, columns=['lat', 'lng', 'date_requested'])
+    reports['date_requested'] = pd.to_datetime(reports['date_requested'], format='ISO8601')
+    reports['service_name'] = service_names
+    return reports
+
+
+def _random_rows(rng, n, days=120):
+    # whole days only, so reports land exactly on the window edges
+    return pd.DataFrame({'lat': 32.72 + rng.normal(scale=0.0008, size=n),
+                         'lng': -117.15 + rng.normal(scale=0.0008, size=n),
+                         'date_requested': pd.Timestamp('2022-01-01')
+                                           + pd.to_timedelta(rng.integers(0, days, size=n), unit='D')})
+
+
+def test_all_time_count_matches_count_safety_near():
+    rng = np.random.default_rng(0)
+    random_lights = _random_rows(rng, 150)
+    random_reports = _random_rows(rng, 500)
+    edge_lights = pd.DataFrame([
+        (32.7150, -117.1600, '2022-03-01 12:00'),
+        (32.7150, -117.1600, '2022-03-01 12:00'),   # same place and time as the light above
+        (np.nan, np.nan, '2022-02-01 09:00'),       # no location
+        (32.7970, -117.2400, None),                 # no date
+    ], columns=['lat', 'lng', 'date_requested'])
+    edge_reports = pd.DataFrame([
+        (32.7150, -117.1600, '2022-03-01 12:00'),   # same time as the lights: not after them
+        (32.7150, -117.1600, '2022-03-01 12:00:01'),
+        (32.7151, -117.1601, '2022-04-01 00:00'),
+        (32.7970, -117.2400, '2022-06-01 00:00'),
+        (32.7970, -117.2400, None),                 # undated report, never counted
+        (np.nan, np.nan, '2022-06-01 00:00'),
+    ], columns=['lat', 'lng', 'date_requested'])
+    lights = _lights(pd.concat([random_lights.astype({'date_requested': str}), edge_lights], ignore_index=True))
+    reports = pd.concat([random_reports.astype({'date_requested': str}), edge_reports], ignore_index=True)
+    reports = _reports(reports, rng.choice(SERVICES, size=len(reports)))
+
+    features = safety_features(lights, reports, lights_out_only=False)
+    expected = count_safety_near(lights, reports, radius=150, units='ft')
+    assert features['safety_150ft_all'].tolist() == expected.tolist()
+    assert features['safety_150ft_all'].tolist()[-4:] == [2, 2, 0, 0]
+    assert expected.sum() > 0
+
+
+def test_every_radius_and_window_matches_a_brute_force_count():
+    rng = np.random.default_rng(1)
+    lights = _lights(_random_rows(rng, 80).astype({'date_requested': str}))
+    reports = _reports(_random_rows(rng, 400).astype({'date_requested': str}), rng.choice(SERVICES, size=400))
+    radii, windows = [50, 150, 300], [7, 30, None]
+    features = safety_features(lights, reports, radii=radii, windows=windows, lights_out_only=False)
+
+    light_xy = project_lat_lng(lights['lat'], lights['lng'])
+    report_xy = project_lat_lng(reports['lat'], reports['lng'])
+    distances = np.hypot(*(light_xy[:, None, :] - report_xy[None, :, :]).transpose(2, 0, 1))
+    days = ((reports['date_requested'].to_numpy()[None, :] - lights['date_requested'].to_numpy()[:, None])
+            / np.timedelta64(1, 'D'))
+    on_window_edge = 0
+    for radius in radii:
+        for window in windows:
+            inside = (distances < to_meters(radius, 'ft')) & (days > 0)
+            if window is not None:
+                inside &= days <= window
+                on_window_edge += int((inside & (days == window)).sum())
+            column = f"{radius:g}ft_{_window_label(window)}"
+            assert features[f"safety_{column}"].tolist() == inside.sum(axis=1).tolist(), column
+            for service_name in SERVICES:
+                by_service = (inside & reports['service_name'].eq(service_name).to_numpy()[None, :]).sum(axis=1)
+                assert features[f"{_service_label(service_name)}_{column}"].tolist() == by_service.tolist(), column
+    assert on_window_edge > 0
+    assert features['safety_300ft_all'].sum() > features['safety_50ft_7d'].sum() > 0
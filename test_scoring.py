@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scoring import DEFAULT_WEIGHTS, FACTOR_COLUMNS, prioritize, top_k
+
+
+def _stable_head(scores, k):
+    return np.argsort(-scores, kind='stable')[:k]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_top_k_equals_head_of_stable_sort_with_ties(seed):
+    rng = np.random.default_rng(seed)
+    # few distinct values, so most cuts fall inside a run of ties
+    scores = rng.integers(0, 6, size=300).astype('float64')
+    for k in [0, 1, 7, 50, 299, 300, 400]:
+        assert top_k(scores, k).tolist() == _stable_head(scores, k).tolist()
+    assert top_k(scores, None).tolist() == _stable_head(scores, None).tolist()
+
+
+def _quota_reference(scores, groups, quotas, k):
+    taken, chosen = {}, []
+    for position in np.argsort(-scores, kind='stable'):
+        if taken.get(groups[position], 0) < quotas.get(groups[position], 0):
+            taken[groups[position]] = taken.get(groups[position], 0) + 1
+            chosen.append(position)
+    return chosen[:k]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_top_k_respects_quotas(seed):
+    rng = np.random.default_rng(seed)
+    scores = rng.integers(0, 10, size=200).astype('float64')
+    groups = rng.choice([1, 2, 3, 4], size=200, p=[0.45, 0.45, 0.07, 0.03])
+    # districts 3 and 4 have fewer candidates than their quota, district 5 has none at all
+    quotas = {1: 5, 2: 8, 3: 40, 4: 40, 5: 10}
+    for k in [None, 3, 20, 1000]:
+        selected = top_k(scores, k, groups=groups, quotas=quotas)
+        assert selected.tolist() == _quota_reference(scores, groups, quotas, k)
+        counts = pd.Series(groups[selected]).value_counts()
+        assert all(counts.get(group, 0) <= quota for group, quota in quotas.items())
+    everything = top_k(scores, None, groups=groups, quotas=quotas)
+    assert (groups[everything] == 3).sum() == (groups == 3).sum()
+    assert (groups[everything] == 4).sum() == (groups == 4).sum()
+
+
+def test_prioritize_top_k_is_the_head_of_the_full_order():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.integers(0, 3, size=(100, len(FACTOR_COLUMNS))) / 2, columns=FACTOR_COLUMNS)
+    df['council_district'] = rng.choice([1.0, 2.0, np.nan], size=100)
+    full = prioritize(df, DEFAULT_WEIGHTS)
+    top = prioritize(df, DEFAULT_WEIGHTS, k=10)
+    assert top.index.tolist() == full.index[:10].tolist()
+    assert top['combined_priority'].tolist() == full['combined_priority'].head(10).tolist()
+    quota = prioritize(df, DEFAULT_WEIGHTS, k=10, group_column='council_district', quotas={1.0: 2, 2.0: 3})
+    assert quota['council_district'].value_counts().to_dict() == {2.0: 3, 1.0: 2}
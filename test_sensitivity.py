@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from scipy.stats import kendalltau
+
+from scoring import DEFAULT_WEIGHTS, FACTOR_COLUMNS, weight_vector
+from sensitivity import grid_weights, random_weights, sweep
+
+
+def _matrix(seed=0, n_requests=60, discrete=False):
+    rng = np.random.default_rng(seed)
+    if discrete:
+        return rng.integers(0, 3, size=(n_requests, len(FACTOR_COLUMNS))) / 2
+    return rng.random((n_requests, len(FACTOR_COLUMNS)))
+
+
+def test_tau_over_every_pair_equals_scipy():
+    matrix = _matrix()
+    scenarios = random_weights(20, len(FACTOR_COLUMNS), seed=1)
+    table, _ = sweep(matrix, scenarios, k=10, n_pairs=len(matrix) ** 2)
+    baseline = matrix @ weight_vector(DEFAULT_WEIGHTS)
+    for weights, tau in zip(scenarios, table['kendall_tau']):
+        # no ties in continuous scores, so tau-a and scipy's tau-b agree
+        assert tau == pytest.approx(kendalltau(matrix @ weights, baseline)[0], abs=1e-12)
+
+
+def test_sampled_tau_is_close_to_scipy():
+    matrix = _matrix(n_requests=2000)
+    scenarios = random_weights(5, len(FACTOR_COLUMNS), seed=2)
+    table, _ = sweep(matrix, scenarios, k=10, n_pairs=20000)
+    baseline = matrix @ weight_vector(DEFAULT_WEIGHTS)
+    for weights, tau in zip(scenarios, table['kendall_tau']):
+        assert tau == pytest.approx(kendalltau(matrix @ weights, baseline)[0], abs=0.03)
+
+
+@pytest.mark.parametrize('discrete', [False, True])
+def test_baseline_weights_overlap_fully(discrete):
+    matrix = _matrix(discrete=discrete)
+    baseline = weight_vector(DEFAULT_WEIGHTS)[None, :]
+    table, frequency = sweep(matrix, np.repeat(baseline, 3, axis=0), k=15)
+    assert table['top_k_overlap'].tolist() == [1.0, 1.0, 1.0]
+    assert sorted(np.unique(frequency).tolist()) == [0.0, 1.0] and frequency.sum() == 15
+    if not discrete:
+        assert table['kendall_tau'].tolist() == [1.0, 1.0, 1.0]
+
+
+def test_chunked_equals_unchunked():
+    matrix = _matrix(n_requests=300)
+    scenarios = np.vstack([random_weights(40, len(FACTOR_COLUMNS)), grid_weights(2)])
+    whole_table, whole_frequency = sweep(matrix, scenarios, k=25, n_pairs=5000, memory_mb=1024)
+    chunked_table, chunked_frequency = sweep(matrix, scenarios, k=25, n_pairs=5000, memory_mb=0.01)
+    assert chunked_table.equals(whole_table)
+    assert np.array_equal(chunked_frequency, whole_frequency)
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import pytest
+
+from service import DEFAULT_TOP_K, PrioritizationService, _top_k_count
+
+
+@pytest.mark.parametrize('body', [b'[1, 2]', b'"k"', b'3', b'null', b'{not json'])
+def test_post_body_that_is_not_a_json_object_is_a_bad_request(body):
+    service = PrioritizationService(reload_interval=None)
+    status, result = asyncio.run(service.dispatch('POST', '/top', body))
+    assert status == 400
+    assert 'error' in result
+
+
+def test_top_k_count():
+    assert _top_k_count({}) == DEFAULT_TOP_K
+    assert _top_k_count({'k': '5'}) == 5
+    for bad_k in ['0', '-3', 'ten']:
+        with pytest.raises(ValueError):
+            _top_k_count({'k': bad_k})
+
+
+@pytest.mark.parametrize('target', ['/health', '/top?k=5', '/what_if?k=5', '/priority?id=1'])
+def test_queries_before_the_first_snapshot_are_answered_loading(target):
+    service = PrioritizationService(reload_interval=None)
+    status, result = asyncio.run(service.dispatch('GET', target, b''))
+    assert status == 503
+    assert 'loading' in result['error']
+
+
+class _StubSnapshot:
+    def __init__(self):
+        self.threads = []
+
+    def top(self, params):
+        self.threads.append(threading.get_ident())
+        if params.get('k') == 'missing':
+            raise LookupError('no such request')
+        return {'requests': [params['k']]}
+
+
+def test_queries_run_off_the_event_loop_thread():
+    service = PrioritizationService(reload_interval=None)
+    service.snapshot = _StubSnapshot()
+    status, result = asyncio.run(service.dispatch('GET', '/top?k=3', b''))
+    assert status == 200
+    assert result['requests'] == ['3']
+    assert service.snapshot.threads[0] != threading.get_ident()
+    status, _ = asyncio.run(service.dispatch('GET', '/top?k=missing', b''))
+    assert status == 404
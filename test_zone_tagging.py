@@ -0,0 +1,42 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, box
+
+from zone_tagging import ZoneLayer, tag_zones
+
+
+def _zone_file(tmp_path):
+    zones = gpd.GeoDataFrame({'name': ['West', 'East']},
+                             geometry=[box(-117.20, 32.70, -117.15, 32.75), box(-117.15, 32.70, -117.10, 32.75)],
+                             crs='EPSG:4326')
+    zone_file = str(tmp_path / 'zones.geojson')
+    zones.to_file(zone_file, driver='GeoJSON')
+    return zone_file
+
+
+POINTS = pd.DataFrame({'lat': [32.72, 32.72, 32.72, 32.70, 32.80, 32.72, np.nan, 32.73, 32.72],
+                       'lng': [-117.18, -117.12, -117.15, -117.17, -117.12, -117.20, -117.12, -117.13, -117.18]})
+
+
+def test_tag_zones_matches_sjoin_within(tmp_path):
+    zone_file = _zone_file(tmp_path)
+    tagged = tag_zones(POINTS, layers={'zone': (zone_file, 'name')})
+    located = POINTS.dropna()
+    points = gpd.GeoDataFrame(located, geometry=[Point(lng, lat) for lat, lng in zip(located['lat'], located['lng'])],
+                              crs='EPSG:4326')
+    joined = gpd.sjoin(points, gpd.read_file(zone_file), how='left', predicate='within')
+    expected = joined.groupby(level=0)['name'].first().reindex(POINTS.index)
+    # the shared border, the outer edges and the missing location are in no zone
+    assert tagged['zone'].isna().tolist() == [False, False, True, True, True, True, True, False, False]
+    assert tagged['zone'].astype(object).where(tagged['zone'].notna(), None).tolist() == \
+        expected.astype(object).where(expected.notna(), None).tolist()
+
+
+def test_memo_is_bounded_and_keeps_labels_right(tmp_path):
+    layer = ZoneLayer(_zone_file(tmp_path), 'name', memo_size=3)
+    expected = ZoneLayer(_zone_file(tmp_path), 'name').label_points(POINTS['lat'], POINTS['lng'])
+    for _ in range(2):
+        labels = layer.label_points(POINTS['lat'], POINTS['lng'])
+        assert len(layer.memo) <= 3
+        assert pd.Series(labels).equals(pd.Series(expected))
@@ -0,0 +1,152 @@
+"""
+Point in polygon tagging of requests against geographic zone files.
+
+Each zone file is read, reprojected to lat/lng and put in a shapely STRtree once per process. Points are
+built vectorized, only the distinct (lat, lng) pairs are tested, and the label found for a pair is
+remembered so repeated requests at the same address are not tested again. The memo keeps the most recently
+used ZONE_MEMO_SIZE locations per layer, so a long running process does not grow without bound.
+"""
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from profiling import profiled
+
+PROMISE_ZONE_FILE = 'data/promise_zone_datasd.geojson'
+COUNCIL_DISTRICTS_FILE = 'data/council_districts_datasd.geojson'
+COMMUNITY_PLAN_FILE = 'data/cmty_plan_datasd.geojson'
+# output column -> (zone file, column of the zone file holding the zone's name)
+ZONE_LAYERS = {'name': (PROMISE_ZONE_FILE, 'name'),
+               'zone_council_district': (COUNCIL_DISTRICTS_FILE, 'district'),
+               'zone_comm_plan_name': (COMMUNITY_PLAN_FILE, 'cpname')}
+# memo marker for a location that has not been tested yet, nan is a valid label
+_UNSEEN = object()
+# locations remembered per zone layer, the least recently used are dropped past this
+ZONE_MEMO_SIZE = 500000
+
+
+class ZoneLayer:
+    """
+    the polygons of one zone file with a spatial index and a memo of labels already found
+        Args:
+            shape_file_name: path of a shape/geojson file of geographic regions
+            name_column: the column of the file with the name to tag points with
+            memo_size: the most locations remembered, least recently used first out
+    """
+
+    def __init__(self, shape_file_name, name_column='name', memo_size=ZONE_MEMO_SIZE):
+        geographic_data = gpd.read_file(shape_file_name)
+        if geographic_data.crs is not None and not geographic_data.crs.equals('EPSG:4326'):
+            geographic_data = geographic_data.to_crs('EPSG:4326')
+        self.names = geographic_data[name_column].to_numpy(dtype=object)
+        self.tree = shapely.STRtree(geographic_data.geometry.to_numpy())
+        self.memo = OrderedDict()
+        self.memo_size = memo_size
+        # the service tags from worker threads, reordering and evicting must not interleave
+        self._memo_lock = threading.Lock()
+
+    def label_pairs(self, pairs):
+        """
+        finds the zone of distinct (lat, lng) pairs, testing only the pairs not labelled by an earlier call
+            Args:
+                pairs: an (n, 2) float array of distinct (lat, lng) pairs
+            Returns:
+                labels: object array of zone names, nan for pairs outside every zone
+        """
+        keys = list(map(tuple, pairs))
+        labels = np.empty(len(keys), dtype=object)
+        with self._memo_lock:
+            labels[:] = [self._recall(key) for key in keys]
+        unseen = np.array([label is _UNSEEN for label in labels], dtype=bool)
+        located = np.isfinite(pairs).all(axis=1)
+        labels[unseen & ~located] = np.nan
+        new = np.flatnonzero(unseen & located)
+        if len(new):
+            point_index, zone_index = self.tree.query(shapely.points(pairs[new, 1], pairs[new, 0]), predicate='within')
+            found = np.full(len(new), np.nan, dtype=object)
+            # a point on a shared border keeps the first zone it was found in
+            first = np.unique(point_index, return_index=True)[1]
+            found[point_index[first]] = self.names[zone_index[first]]
+            labels[new] = found
+            with self._memo_lock:
+                self.memo.update(zip((keys[i] for i in new), found))
+                while len(self.memo) > self.memo_size:
+                    self.memo.popitem(last=False)
+        return labels
+
+    def _recall(self, key):
+        label = self.memo.get(key, _UNSEEN)
+        if label is not _UNSEEN:
+            self.memo.move_to_end(key)
+        return label
+
+    def label_points(self, lat, lng):
+        """
+        finds the name of the zone each point is in
+            Args:
+                lat: array of latitudes
+                lng: array of longitudes
+            Returns:
+                labels: object array of zone names, nan for points outside every zone
+        """
+        pairs, inverse = _distinct_pairs(lat, lng)
+        return self.label_pairs(pairs)[inverse]
+
+
+def _distinct_pairs(lat, lng):
+    """
+    the distinct (lat, lng) pairs and the position of each input point in them
+    """
+    points = np.column_stack([np.asarray(lat, dtype='float64'), np.asarray(lng, dtype='float64')])
+    pairs, inverse = np.unique(points, axis=0, return_inverse=True)
+    return pairs, inverse.ravel()
+
+
+@lru_cache(maxsize=None)
+def load_zone_layer(shape_file_name, name_column='name'):
+    """
+    reads a zone file once per process and keeps the prepared layer
+        Args:
+            shape_file_name: path of a shape/geojson file of geographic regions
+            name_column: the column of the file with the name to tag points with
+        Returns: a ZoneLayer
+    """
+    return ZoneLayer(shape_file_name, name_column)
+
+
+@profiled
+def tag_zones(df, layers=None):
+    """
+    tags each row of a dataframe with the zone it falls in for several zone layers in one pass
+        Args:
+            df: the dataframe with lat and lng columns, it is not modified
+            layers: dict of output column -> (zone file, name column), defaults to the Promise Zone only
+        Returns:
+            df: a copy of the input with one column per layer, nan for points outside every zone of a layer
+    """
+    if layers is None:
+        layers = {'name': ZONE_LAYERS['name']}
+    tagged = df.copy()
+    # the distinct locations are found once and shared by all the layers
+    pairs, inverse = _distinct_pairs(df['lat'], df['lng'])
+    for column, (shape_file_name, name_column) in layers.items():
+        tagged[column] = load_zone_layer(shape_file_name, name_column).label_pairs(pairs)[inverse]
+    return tagged
+
+
+def find_points_in_zone(df, shape_file_name):
+    """
+    takes a dataframe and a finds which points are in the geaographic zones given in an input shape file
+        Args:
+            df: the dataframe with lat and lng columns, it is not modified
+            shape_file_name: the path to a shape file with geographicl regions to be used as filters
+        Returns:
+            df: a copy of the input dataframe with a name column containing the name of the
+                geographic region where the point is located. Points outside any zone get nan for a name
+    """
+    return tag_zones(df, layers={'name': (shape_file_name, 'name')})